@@ -0,0 +1,70 @@
+# arena.py
+#
+# Benchmark for the flat (arena) representation of the model.  A large
+# program is made by repeating a sample program.  It is then parsed
+# both ways:
+#
+#    tree   - parse_file(), a tree of node objects
+#    arena  - parse_file_flat(), nodes in parallel arrays
+#
+# For each, reports the memory kept for the parsed program and the
+# time taken to parse it, to walk over every node and to type-check it.
+# The arena is walked twice: through views (walk(), as code written for
+# the model sees it) and by id (Arena.walk(), no views made).  The type
+# checker only works through views.
+#
+#    bash $ python3 -m bench.arena tests/Programs/mandel.wb 5
+#
+# The second argument is the size (in MB) of the synthetic input.
+
+import os
+import tracemalloc
+
+from wabbit.model import walk
+from wabbit.parse import parse_file, parse_file_flat
+from wabbit.typecheck import check_program
+from .synth import replicate, write_temp
+from .util import timed
+
+def count(model):
+    return sum(1 for _ in walk(model))
+
+def count_ids(model):
+    return sum(1 for _ in model.arena.walk(model.id))
+
+def check(model):
+    # The repeated program redefines its globals.  The resulting errors
+    # (printed, and so captured by timed()) don't matter here.
+    check_program(model)
+
+def measure(label, parse, filename):
+    tracemalloc.start()
+    model = parse(filename)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del model
+
+    model, _, parse_time = timed(parse, filename)
+    nnodes, _, walk_time = timed(count, model)
+    _, _, check_time = timed(check, model)
+    print(f'{label:6s} {size/1e6:8.2f} MB {size/nnodes:6.1f} bytes/node (peak {peak/1e6:8.2f} MB)  '
+          f'parse {parse_time:6.2f}s  walk {walk_time:6.2f}s  check {check_time:6.2f}s')
+    if hasattr(model, 'arena'):
+        _, _, id_time = timed(count_ids, model)
+        print(f'{"":6s} walk by id {id_time:6.2f}s')
+    return size
+
+def main(filename, megabytes=1):
+    text = replicate(filename, int(megabytes * 1e6))
+    print(f'Input: {len(text)/1e6:.1f} MB ({filename} replicated)')
+    tempname = write_temp(text)
+    try:
+        tree = measure('tree', parse_file, tempname)
+        arena = measure('arena', parse_file_flat, tempname)
+        print(f'tree/arena: {tree/arena:.2f}x')
+    finally:
+        os.remove(tempname)
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else 1)
@@ -0,0 +1,63 @@
+# checkcache.py
+#
+# Benchmark for incremental type checking (see wabbit/checkcache.py).
+# A large program of generated functions is checked without a cache,
+# with an empty cache, and again with the filled cache (as a later
+# build would, from a fresh parse) after changing the body of one
+# function and then the signature of one that many others call.
+#
+#    bash $ python3 -m bench.checkcache 5000
+
+from wabbit.parse import parse_source
+from wabbit.typecheck import check_program
+from wabbit.checkcache import CheckCache
+from .util import timed
+
+header = '''
+struct Point {
+    x float;
+    y float;
+}
+func scale(p Point, k float) Point {
+    return Point(p.x * k, p.y * k);
+}
+'''
+
+template = '''
+func f%(n)d(n int) float {
+    var p = Point(float(n), %(n)d.0);
+    var total = 0.0;
+    while n > 0 {
+        p = scale(p, 0.5);
+        total = total + p.x * p.y;
+        n = n - %(step)d;
+    }
+    return total;
+}
+'''
+
+def make_program(nfunctions, step=1):
+    return header + ''.join(template % { 'n': n, 'step': step if n == nfunctions // 2 else 1 }
+                            for n in range(nfunctions))
+
+def check(source, cache=None):
+    ok, _, elapsed = timed(check_program, parse_source(source), cache)
+    assert ok
+    return elapsed
+
+def main(nfunctions=5000):
+    source = make_program(nfunctions)
+    print(f'{nfunctions} functions, {len(source)/1e6:.1f} MB')
+    print(f'no cache          {check(source)*1000:10.1f} ms')
+    cache = CheckCache()
+    print(f'empty cache       {check(source, cache)*1000:10.1f} ms  {cache.stats}')
+    print(f'unchanged         {check(source, cache)*1000:10.1f} ms  {cache.stats}')
+    edited = make_program(nfunctions, step=2)
+    print(f'one body edited   {check(edited, cache)*1000:10.1f} ms  {cache.stats}')
+    changed = edited.replace('func scale(p Point, k float)', 'func scale(p Point, k float, j int)', 1)
+    changed = changed.replace('scale(p, 0.5)', 'scale(p, 0.5, 1)')
+    print(f'signature changed {check(changed, cache)*1000:10.1f} ms  {cache.stats}')
+
+if __name__ == '__main__':
+    import sys
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,33 @@
+# closures.py
+#
+# Benchmark for the closure compiler (wabbit/closures.py).  Runs a
+# program with the tree-walking interpreter (interp.interpret_program)
+# and with the closure compiler and reports the time taken by each.
+# Output is captured and compared.
+#
+#    bash $ python3 -m bench.closures tests/Script/15_mandel.wb
+#    bash $ python3 -m bench.closures tests/Func/22_fib.wb
+
+from wabbit.parse import parse_file
+from wabbit.typecheck import check_program
+from wabbit.interp import interpret_program
+from wabbit.closures import compile_program
+from .util import timed
+
+def main(filename):
+    model = parse_file(filename)
+    if not check_program(model):
+        raise SystemExit(1)
+
+    _, expected, interp_time = timed(interpret_program, model)
+    program, _, compile_time = timed(compile_program, model)
+    _, output, run_time = timed(program)
+    assert output == expected, 'Output differs'
+
+    print(f'interpret : {interp_time:8.3f} s')
+    print(f'compile   : {compile_time:8.3f} s')
+    print(f'run       : {run_time:8.3f} s ({interp_time/(compile_time + run_time):.1f}x)')
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1])
@@ -0,0 +1,83 @@
+# dispatch.py
+#
+# Benchmark for the dispatch tables used by the tree walkers (see
+# Dispatch in wabbit/model.py).  Compares the cost of finding the
+# handler for a node with a Dispatch table and with a chain of
+# isinstance() tests (how check(), interpret(), generate() and
+# to_source() used to work).
+#
+# Both dispatchers are built from the handler table of the type checker
+# (wabbit.typecheck.checkers), in the same order, with every handler
+# replaced by one that does nothing.  For each class of node, the time
+# per dispatch is reported.  Going down the table, the chain has to
+# make more and more tests while the table lookup stays the same.
+#
+#    bash $ python3 -m bench.dispatch
+#
+# An optional argument gives the number of dispatches per class.
+
+
+from wabbit.model import Dispatch, Node
+from wabbit.typecheck import checkers
+from .util import timed
+
+def handler(node):
+    return None
+
+def unknown(node):
+    raise RuntimeError(f"Can't handle {node}")
+
+# Make a function dispatching with an if/elif chain of isinstance()
+# tests over classes (in order)
+def make_chain(classes):
+    lines = [ 'def dispatch(node):' ]
+    for n, cls in enumerate(classes):
+        keyword = 'if' if n == 0 else 'elif'
+        lines.append(f'    {keyword} isinstance(node, classes[{n}]):')
+        lines.append(f'        return handler(node)')
+    lines.append('    else:')
+    lines.append('        return unknown(node)')
+    namespace = { 'classes': classes, 'handler': handler, 'unknown': unknown }
+    exec('\n'.join(lines), namespace)
+    return namespace['dispatch']
+
+def make_table(classes):
+    table = Dispatch({ cls: handler for cls in classes }, default=unknown)
+    def dispatch(node):
+        return table[type(node)](node)
+    return dispatch
+
+# A node of class cls.  Fields are left unset since no handler looks
+# at them.
+def sample(cls):
+    return cls.__new__(cls) if issubclass(cls, Node) else cls()
+
+def dispatch_all(dispatch, nodes):
+    for node in nodes:
+        dispatch(node)
+
+# Time per dispatch (best of a few runs)
+def per_call(dispatch, nodes, repeat=5):
+    return timed(dispatch_all, dispatch, nodes, repeat=repeat)[2] / len(nodes)
+
+def main(count=100000):
+    classes = list(checkers.keys())
+    chain = make_chain(classes)
+    table = make_table(classes)
+
+    print(f'{"class":14s} {"position":>8s} {"chain":>9s} {"table":>9s}')
+    chain_times = [ ]
+    table_times = [ ]
+    for position, cls in enumerate(classes, 1):
+        nodes = [ sample(cls) ] * count
+        chain_times.append(per_call(chain, nodes))
+        table_times.append(per_call(table, nodes))
+        print(f'{cls.__name__:14s} {position:8d} {chain_times[-1]*1e9:7.1f}ns {table_times[-1]*1e9:7.1f}ns')
+
+    # Dispatch cost for the first class in the table and the last
+    print(f'chain: last/first = {chain_times[-1]/chain_times[0]:.2f}x')
+    print(f'table: last/first = {table_times[-1]/table_times[0]:.2f}x')
+
+if __name__ == '__main__':
+    import sys
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,219 @@
+# gvn.py
+#
+# Benchmark for value numbering and dead value removal (see
+# wabbit/iropt.py).  Each program is compiled to IR with the model
+# optimizations and strength reduction only, and with all of
+# optimize_ircode(), then run on the IR machine (irrun.py).  Shown are
+# the number of IR instructions and the number of instructions
+# executed.  Output must come out the same.
+#
+#    bash $ python3 -m bench.gvn tests/*/*.wb
+#
+# With -random N, N random programs are made instead (see
+# random_program()) and only the totals are shown.  A program whose
+# output differs is written to random-<seed>.wb.  Programs come from
+# seeds 0 to N-1, so a run can be repeated.
+#
+#    bash $ python3 -m bench.gvn -random 500
+
+import io
+import re
+import random
+import contextlib
+
+from wabbit.parse import parse_source
+from wabbit.compile import run_pipeline, frontend, optimizations
+from wabbit.irrun import IRMachine
+from wabbit.iropt import optimize_ircode, reduce_strength
+
+# Code that counts the instructions fetched from it
+class CountingCode(tuple):
+    count = 0
+
+    def __getitem__(self, index):
+        CountingCode.count += 1
+        return tuple.__getitem__(self, index)
+
+class CountingMachine(IRMachine):
+    def add_function(self, func):
+        super().add_function(func)
+        code, labels, initial, nargs = self.functions[func.name]
+        self.functions[func.name] = (CountingCode(code), labels, initial, nargs)
+
+def compile_file(filename, optimize):
+    return compile_value(filename, frontend, optimize)
+
+def compile_source(source, optimize):
+    return compile_value(parse_source(source), frontend[1:], optimize)
+
+def compile_value(value, frontend, optimize):
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            module = run_pipeline(value, frontend + optimizations + [ 'ircode' ])
+    except (SystemExit, RuntimeError):
+        return None                # Errors, or structs and enums (not supported by the IR)
+    if optimize:
+        return optimize_ircode(module)
+    for func in module.functions:
+        reduce_strength(func.code)
+    return module
+
+def run(module):
+    out = io.StringIO()
+    CountingCode.count = 0
+    try:
+        CountingMachine(module, out=out).run()
+    except ArithmeticError as err:
+        print(type(err).__name__, file=out)
+    return CountingCode.count, out.getvalue()
+
+def main(filenames):
+    print(f'{"":36s} {"IR":>6s} {"after":>6s} {"executed":>10s} {"after":>10s}')
+    totals = [ 0, 0 ]
+    for filename in filenames:
+        before = compile_file(filename, False)
+        if before is None:
+            continue
+        after = compile_file(filename, True)
+        ir = [ sum(len(func.code) for func in module.functions) for module in (before, after) ]
+        (executed, output), (executed2, output2) = run(before), run(after)
+        assert output == output2
+        totals[0] += ir[0]
+        totals[1] += ir[1]
+        print(f'{filename:36s} {ir[0]:6d} {ir[1]:6d} {executed:10d} {executed2:10d}')
+    print(f'{"total":36s} {totals[0]:6d} {totals[1]:6d}')
+
+# Random programs.  Only ints, so that every program type checks:
+# globals, functions that call the ones before them (never themselves),
+# loops that always end, and arithmetic that never divides by zero.
+# Expressions are often reused, and calls and stores to globals come
+# between them, to give value numbering something to get wrong.
+class RandomProgram:
+    def __init__(self, seed):
+        self.rand = random.Random(seed)
+        self.lines = [ ]
+        self.globals = [ ]
+        self.functions = [ ]       # (name, number of parameters)
+        self.seen = [ ]            # Expressions made so far, for reuse
+        self.count = 0
+
+    def name(self, prefix):
+        self.count += 1
+        return f'{prefix}{self.count}'
+
+    def expr(self, names, depth=0):
+        rand = self.rand
+        choice = rand.random()
+        if self.seen and choice < 0.2:
+            expr = rand.choice(self.seen)
+            if all(name in names for name in re.findall(r'[a-z]+\d+', expr)):
+                return expr
+        if depth > 2 or choice < 0.45:
+            return rand.choice(names) if rand.random() < 0.7 else str(rand.randint(-3, 20))
+        if choice < 0.55 and self.functions:
+            func, nargs = rand.choice(self.functions)
+            expr = f'{func}({", ".join(self.expr(names, depth + 1) for _ in range(nargs))})'
+        elif choice < 0.65:
+            expr = f'({self.expr(names, depth + 1)}) / {rand.randint(1, 7)}'
+        elif choice < 0.7:
+            expr = f'-({self.expr(names, depth + 1)})'
+        else:
+            op = rand.choice('+-*')
+            expr = f'({self.expr(names, depth + 1)} {op} {self.expr(names, depth + 1)})'
+        self.seen.append(expr)
+        return expr
+
+    def condition(self, names):
+        rand = self.rand
+        cond = f'{self.expr(names, 2)} {rand.choice(["<", "<=", ">", ">=", "==", "!="])} {self.expr(names, 2)}'
+        if rand.random() < 0.2:
+            cond = f'{cond} {rand.choice(["&&", "||"])} {self.condition(names)}'
+        return cond
+
+    def block(self, names, indent, depth, loop=False):
+        names = list(names)
+        assignable = [ name for name in names if not name.startswith('i') ]
+        for _ in range(self.rand.randint(1, 5)):
+            choice = self.rand.random()
+            if choice < 0.2:
+                var = self.name('v')
+                self.emit(indent, f'var {var} = {self.expr(names)};')
+                names.append(var)
+                assignable.append(var)
+            elif choice < 0.45 and assignable:
+                self.emit(indent, f'{self.rand.choice(assignable)} = {self.expr(names)};')
+            elif choice < 0.6:
+                self.emit(indent, f'print {self.expr(names)};')
+            elif choice < 0.7 and depth < 2:
+                self.emit(indent, f'if {self.condition(names)} {{')
+                self.block(names, indent + 1, depth + 1, loop)
+                if self.rand.random() < 0.5:
+                    self.emit(indent, '} else {')
+                    self.block(names, indent + 1, depth + 1, loop)
+                self.emit(indent, '}')
+            elif choice < 0.8 and depth < 2:
+                # The counter is only changed at the top of the body, so
+                # continue can't skip it
+                counter = self.name('i')
+                self.emit(indent, f'var {counter} = 0;')
+                self.emit(indent, f'while {counter} < {self.rand.randint(0, 5)} {{')
+                self.emit(indent + 1, f'{counter} = {counter} + 1;')
+                self.block(names + [ counter ], indent + 1, depth + 1, True)
+                self.emit(indent, '}')
+            elif choice < 0.85 and loop:
+                self.emit(indent, f'if {self.condition(names)} {{ {self.rand.choice(["break", "continue"])}; }}')
+            elif self.functions:
+                func, nargs = self.rand.choice(self.functions)
+                self.emit(indent, f'{func}({", ".join(self.expr(names) for _ in range(nargs))});')
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    def make(self):
+        for _ in range(self.rand.randint(1, 3)):
+            name = self.name('g')
+            self.emit(0, f'var {name} = {self.rand.randint(-5, 5)};')
+            self.globals.append(name)
+        for _ in range(self.rand.randint(1, 4)):
+            func = self.name('f')
+            params = [ self.name('p') for _ in range(self.rand.randint(0, 3)) ]
+            self.seen = [ ]
+            self.emit(0, f'func {func}({", ".join(p + " int" for p in params)}) int {{')
+            self.block(self.globals + params, 1, 0)
+            self.emit(1, f'return {self.expr(self.globals + params)};')
+            self.emit(0, '}')
+            self.functions.append((func, len(params)))
+        self.seen = [ ]
+        self.block(self.globals, 0, 0)
+        self.emit(0, f'print {" + ".join(self.globals)};')
+        return '\n'.join(self.lines) + '\n'
+
+def random_program(seed):
+    return RandomProgram(seed).make()
+
+def main_random(count):
+    totals = [ 0, 0, 0, 0 ]
+    failed = 0
+    for seed in range(count):
+        source = random_program(seed)
+        before, after = compile_source(source, False), compile_source(source, True)
+        (executed, output), (executed2, output2) = run(before), run(after)
+        if output != output2:
+            failed += 1
+            with open(f'random-{seed}.wb', 'w') as file:
+                file.write(source)
+            print(f'random-{seed}.wb: output differs')
+        totals[0] += sum(len(func.code) for func in before.functions)
+        totals[1] += sum(len(func.code) for func in after.functions)
+        totals[2] += executed
+        totals[3] += executed2
+    print(f'{"":36s} {"IR":>6s} {"after":>6s} {"executed":>10s} {"after":>10s}')
+    print(f'{f"{count} random programs":36s} {totals[0]:6d} {totals[1]:6d} {totals[2]:10d} {totals[3]:10d}')
+    print(f'{failed} with different output')
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:2] == [ '-random' ]:
+        main_random(int(sys.argv[2]))
+    else:
+        main(sys.argv[1:])
@@ -0,0 +1,119 @@
+# hashcons.py
+#
+# Benchmark for hash-consing (wabbit/hashcons.py).  A large program is
+# made by repeating a sample program and parsed.  Reports:
+#
+#    - The number of nodes and how many are distinct after sharing
+#      closed subtrees (before checking) and after sharing all typed
+#      expressions (after checking).
+#    - The memory kept for the program with and without sharing
+#      (including the HashCons table).
+#    - The time to find the constant value of every expression, once
+#      with each occurrence computed separately and once with the
+#      memoized HashCons.constant().
+#
+#    bash $ python3 -m bench.hashcons tests/Programs/mandel.wb 5
+#
+# The second argument is the size (in MB) of the synthetic input.
+
+import contextlib
+import io
+import tracemalloc
+
+from wabbit.model import Expression, UnaryOp, BinOp, walk
+from wabbit.parse import parse_source
+from wabbit.typecheck import check_program
+from wabbit.hashcons import HashCons, evaluate
+from .synth import replicate
+from .util import timed
+
+def distinct(model):
+    return len({ id(node) for node in walk(model) })
+
+def check(model):
+    # The repeated program redefines its globals.  The resulting errors
+    # don't matter here.
+    with contextlib.redirect_stdout(io.StringIO()):
+        check_program(model)
+
+def memory(make):
+    tracemalloc.start()
+    model = make()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return model, size
+
+def operands(node):
+    if isinstance(node, UnaryOp):
+        return [ node.operand ]
+    elif isinstance(node, BinOp):
+        return [ node.left, node.right ]
+    return [ ]
+
+# Constant value of every expression in the tree, each one computed
+# from scratch
+def constants_unshared(model, hc):
+    count = 0
+    for node in walk(model):
+        if isinstance(node, Expression):
+            values = { }
+            stack = [ node ]
+            while stack:
+                top = stack[-1]
+                pending = [ child for child in operands(top) if id(child) not in values ]
+                if pending:
+                    stack.extend(pending)
+                    continue
+                stack.pop()
+                values[id(top)] = evaluate(top, values)
+            count += values[id(node)] is not None
+    return count
+
+def constants_shared(model, hc):
+    count = 0
+    for node in walk(model):
+        if isinstance(node, Expression):
+            count += hc.constant(node) is not None
+    return count
+
+def main(filename, megabytes=1):
+    text = replicate(filename, int(megabytes * 1e6))
+    print(f'Input: {len(text)/1e6:.1f} MB ({filename} replicated)')
+
+    model, plain_size = memory(lambda: parse_source(text))
+    total = distinct(model)
+    check(model)
+    del model
+
+    hc = HashCons()
+    model, closed_size = memory(lambda: hc.share(parse_source(text)))
+    closed = distinct(model)
+    check(model)
+    typed = distinct(hc.share(model))
+
+    def shared_checked():
+        model = parse_source(text)
+        check(model)
+        hc = HashCons()
+        return hc, hc.share(model)
+    _, typed_size = memory(shared_checked)
+
+    print(f'{total} nodes')
+    print(f'closed subtrees shared : {closed:8d} distinct ({closed/total:.1%})')
+    print(f'typed subtrees shared  : {typed:8d} distinct ({typed/total:.1%})')
+    print(f'memory unshared        : {plain_size/1e6:8.2f} MB')
+    print(f'memory shared (closed) : {closed_size/1e6:8.2f} MB ({closed_size/plain_size:.0%} of unshared)')
+    print(f'memory shared (typed)  : {typed_size/1e6:8.2f} MB ({typed_size/plain_size:.0%} of unshared)')
+
+    # Constant evaluation on the tree with closed subtrees shared.
+    # Every expression is evaluated, but only closed ones have a value.
+    nconst, _, unshared_time = timed(constants_unshared, model, hc)
+    nconst2, _, shared_time = timed(constants_shared, model, hc)
+    assert nconst == nconst2
+    print(f'{nconst} constant expressions')
+    print(f'constants, per node    : {unshared_time:8.3f} s')
+    print(f'constants, memoized    : {shared_time:8.3f} s ({unshared_time/shared_time:.1f}x)')
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else 1)
@@ -0,0 +1,47 @@
+# incremental.py
+#
+# Benchmark for wabbit.incremental.  A large program is made by
+# repeating a sample program.  A single line somewhere in the middle is
+# then edited repeatedly and the time for an incremental update is
+# compared against parsing the whole text again.
+#
+#    bash $ python3 -m bench.incremental tests/Func/23_mandel.wb 2
+
+from wabbit.incremental import IncrementalParser
+from wabbit.parse import parse_source
+from .synth import replicate
+from .util import timed
+
+def main(filename, megabytes=1, nedits=100):
+    text = replicate(filename, int(megabytes * 1e6))
+    print(f'Input: {len(text)/1e6:.1f} MB ({filename} replicated)')
+
+    _, _, full = timed(parse_source, text)
+    print(f'full parse          {full*1000:10.3f} ms')
+
+    parser = IncrementalParser(text)
+
+    # Change an integer literal after the midpoint.  The edit doesn't
+    # change the number of lines.
+    pos = text.index('= 1', len(text) // 2) + 2
+    total = 0.0
+    for n in range(nedits):
+        total += timed(parser.edit, pos, pos + 1, str(n % 10))[2]
+    print(f'edit (same lines)   {total/nedits*1000:10.3f} ms  {parser.stats}')
+
+    # Insert a new line.  Everything after it has to have its line
+    # numbers adjusted.
+    total = 0.0
+    for n in range(nedits):
+        total += timed(parser.edit, pos, pos, '\n')[2]
+    print(f'edit (new line)     {total/nedits*1000:10.3f} ms  {parser.stats}')
+
+    # Diff-based update (as used by a watch loop)
+    text = parser.text
+    pos = text.index('= 1', len(text) // 3) + 2
+    _, _, elapsed = timed(parser.update, text[:pos] + '7' + text[pos+1:])
+    print(f'update (diffed)     {elapsed*1000:10.3f} ms  {parser.stats}')
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else 1)
@@ -0,0 +1,67 @@
+# inline.py
+#
+# Benchmark for inlining (see inline_functions() in wabbit/transform.py).
+# Each program is folded and cleaned of dead code with and without
+# inlining first, then run on the IR machine (irrun.py) and as Python
+# (pycode.py).  Shown are the number of calls made while running on
+# the IR machine and the run times (the best of several runs for short
+# programs).  Output must come out the same.
+#
+#    bash $ python3 -m bench.inline tests/Func/*.wb
+
+import io
+import contextlib
+
+from wabbit.parse import parse_file
+from wabbit.typecheck import check_program
+from wabbit.ircode import generate_ircode
+from wabbit.irrun import IRMachine
+from wabbit.pycode import generate_python, run_python
+from wabbit.transform import fold, inline_functions, eliminate_dead_code
+from .util import timed
+
+# Counts the calls made to functions of the program
+class CountingMachine(IRMachine):
+    calls = 0
+
+    def call(self, name, args):
+        self.calls += 1
+        return super().call(name, args)
+
+def compile_file(filename, inline):
+    model = parse_file(filename)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not check_program(model):
+            return None
+    model = fold(model, { })
+    if inline and inline_functions(model):
+        model = fold(model, { })
+    eliminate_dead_code(model)
+    return model
+
+def measure(filename, inline):
+    model = compile_file(filename, inline)
+    if model is None:
+        return None
+    module = generate_ircode(model)
+    machine = CountingMachine(module, out=io.StringIO())
+    machine.run()
+    _, _, irtime = timed(lambda: IRMachine(module, out=io.StringIO()).run(), repeat=None)
+    source = generate_python(model)
+    _, output, pytime = timed(run_python, source, repeat=None)
+    return machine.calls, irtime, pytime, machine.out.getvalue() + output
+
+def main(filenames):
+    print(f'{"":30s} {"calls":>7s} {"after":>7s} {"IR ms":>8s} {"after":>8s} {"Py ms":>8s} {"after":>8s}')
+    for filename in filenames:
+        before = measure(filename, False)
+        if before is None:
+            continue
+        after = measure(filename, True)
+        assert before[3] == after[3]
+        print(f'{filename:30s} {before[0]:7d} {after[0]:7d} '
+              f'{before[1]*1000:8.1f} {after[1]*1000:8.1f} {before[2]*1000:8.1f} {after[2]*1000:8.1f}')
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1:])
@@ -0,0 +1,83 @@
+# loops.py
+#
+# Benchmark for loop optimization (optimize_loops() in wabbit/transform.py)
+# and the IR optimizations (wabbit/iropt.py).  Each program is compiled
+# to IR with the rest of transform() only and with loop optimization and
+# the IR optimizations added, then run on the IR machine (irrun.py).
+# Shown are the number of IR instructions, the number of arithmetic
+# instructions executed (multiplications separately) and the run time.
+# Output must come out the same.
+#
+#    bash $ python3 -m bench.loops tests/Programs/mandel_loop.wb
+
+import io
+import contextlib
+
+from wabbit import irrun
+from wabbit.parse import parse_file
+from wabbit.typecheck import check_program
+from wabbit.ircode import generate_ircode
+from wabbit.irrun import IRMachine
+from wabbit.iropt import optimize_ircode
+from wabbit.transform import fold, inline_functions, optimize_loops, eliminate_dead_code
+from .util import timed
+
+def compile_file(filename, optimize):
+    model = parse_file(filename)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not check_program(model):
+            return None
+    model = fold(model, { })
+    if inline_functions(model):
+        model = fold(model, { })
+    if optimize:
+        optimize_loops(model)
+    eliminate_dead_code(model)
+    try:
+        module = generate_ircode(model)
+    except RuntimeError:
+        return None                # Structs and enums aren't supported by the IR
+    return optimize_ircode(module) if optimize else module
+
+# Run a module on the IR machine counting the arithmetic instructions
+# executed.  Returns (counts by instruction, time, output).
+def run(module):
+    counts = { }
+    def counted(op, operation):
+        def run_op(*args):
+            counts[op] = counts.get(op, 0) + 1
+            return operation(*args)
+        return run_op
+    saved = dict(irrun.binary_ops), dict(irrun.unary_ops)
+    irrun.binary_ops.update((op, counted(op, operation)) for op, operation in saved[0].items())
+    irrun.unary_ops.update((op, counted(op, operation)) for op, operation in saved[1].items())
+    try:
+        out = io.StringIO()
+        _, _, elapsed = timed(IRMachine(module, out=out).run)
+    finally:
+        irrun.binary_ops.update(saved[0])
+        irrun.unary_ops.update(saved[1])
+    return counts, elapsed, out.getvalue()
+
+def main(filenames):
+    print(f'{"":32s} {"IR":>5s} {"after":>5s} {"arith":>10s} {"after":>10s} '
+          f'{"muls":>9s} {"after":>9s} {"time":>7s} {"after":>7s}')
+    for filename in filenames:
+        before = compile_file(filename, False)
+        if before is None:
+            continue
+        after = compile_file(filename, True)
+        results = [ ]
+        for module in (before, after):
+            counts, elapsed, output = run(module)
+            muls = sum(n for op, n in counts.items() if op.endswith('.mul'))
+            results.append((sum(len(func.code) for func in module.functions),
+                            sum(counts.values()), muls, elapsed, output))
+        assert results[0][4] == results[1][4]
+        (ir, arith, muls, elapsed, _), (ir2, arith2, muls2, elapsed2, _) = results
+        print(f'{filename:32s} {ir:5d} {ir2:5d} {arith:10d} {arith2:10d} '
+              f'{muls:9d} {muls2:9d} {elapsed:6.2f}s {elapsed2:6.2f}s')
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1:])
@@ -0,0 +1,85 @@
+# model.py
+#
+# Memory benchmark for the nodes in wabbit.model.  A large program is
+# made by repeating a sample program, parsed and type-checked (so
+# that every expression has its type filled in).  The tree is then
+# copied twice and the memory used by each copy is measured:
+#
+#    slots  - the node classes of wabbit.model (which use __slots__)
+#    dict   - equivalent classes that keep attributes in a __dict__
+#             (how the node classes used to be defined)
+#
+# Both copies share the same strings, so only the cost of the nodes
+# (and lists of nodes) themselves is counted.
+#
+#    bash $ python3 -m bench.model tests/Programs/mandel.wb 5
+#
+# The second argument is the size (in MB) of the synthetic input.
+
+import contextlib
+import io
+import tracemalloc
+
+from wabbit.model import Node, walk
+from wabbit.parse import parse_source
+from wabbit.typecheck import check_program
+from .synth import replicate
+
+# Classes with a __dict__, one for each class of node
+dict_classes = { }
+
+def dict_class(cls):
+    if cls not in dict_classes:
+        dict_classes[cls] = type(cls.__name__, (), { })
+    return dict_classes[cls]
+
+def attributes(node):
+    for cls in type(node).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            if hasattr(node, name):
+                yield name, getattr(node, name)
+
+# Copy a tree.  make(node) creates an empty node of the desired kind.
+def copy_tree(node, make):
+    if isinstance(node, list):
+        return [ copy_tree(item, make) for item in node ]
+    elif not isinstance(node, Node):
+        return node
+    new = make(node)
+    for name, value in attributes(node):
+        setattr(new, name, copy_tree(value, make))
+    return new
+
+def make_slots(node):
+    return type(node).__new__(type(node))
+
+def make_dict(node):
+    return dict_class(type(node))()
+
+def measure(label, model, make, nnodes):
+    tracemalloc.start()
+    copy = copy_tree(model, make)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{label:6s} {size/1e6:10.2f} MB {size/nnodes:8.1f} bytes/node')
+    return size
+
+def main(filename, megabytes=1):
+    text = replicate(filename, int(megabytes * 1e6))
+    print(f'Input: {len(text)/1e6:.1f} MB ({filename} replicated)')
+    model = parse_source(text)
+
+    # The repeated program redefines its globals.  The resulting errors
+    # don't matter here.
+    with contextlib.redirect_stdout(io.StringIO()):
+        check_program(model)
+
+    nnodes = sum(1 for _ in walk(model))
+    print(f'{nnodes} nodes')
+    slots = measure('slots', model, make_slots, nnodes)
+    dicts = measure('dict', model, make_dict, nnodes)
+    print(f'dict/slots: {dicts/slots:.2f}x')
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else 1)
@@ -0,0 +1,38 @@
+# parcheck.py
+#
+# Benchmark for parallel type checking (see wabbit/parcheck.py).  A
+# program of generated functions (the one from bench/checkcache.py) is
+# checked with increasing numbers of worker processes.  Errors and
+# types must come out the same.  Times are for check_program() as a
+# whole, wall clock.
+#
+#    bash $ python3 -m bench.parcheck 5000 1 2 4 8
+
+import os
+
+from wabbit.parse import parse_source
+from wabbit.model import walk
+from wabbit.typecheck import check_program
+from .checkcache import make_program
+from .util import timed
+
+def check(source, jobs):
+    model = parse_source(source)
+    _, output, elapsed = timed(check_program, model, None, jobs)
+    types = [ getattr(node, 'type', None) for node in walk(model) ]
+    return elapsed, (output, types)
+
+def main(nfunctions=5000, *jobs):
+    source = make_program(nfunctions)
+    print(f'{nfunctions} functions, {os.cpu_count()} CPUs')
+    base, expected = check(source, 1)
+    print(f'{"jobs":>4s} {"time":>10s} {"speedup":>8s}')
+    print(f'{1:4d} {base*1000:8.1f}ms {1.0:7.2f}x')
+    for n in jobs or (2, 4):
+        elapsed, result = check(source, n)
+        assert result == expected
+        print(f'{n:4d} {elapsed*1000:8.1f}ms {base/elapsed:7.2f}x')
+
+if __name__ == '__main__':
+    import sys
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,32 @@
+# parse.py
+#
+# Stress benchmark for expression parsing.  Builds very deeply nested
+# (or very long) expressions and times parse_source() on them.  The
+# time per token should stay flat as the depth grows.
+#
+#    bash $ python3 -m bench.parse 100000
+
+from wabbit.parse import parse_source
+from .util import timed
+
+# Each shape takes a depth and returns source text
+shapes = {
+    'parens':  lambda n: 'print ' + '(' * n + '1' + ')' * n + ';',
+    'unary':   lambda n: 'print ' + '-' * n + '1;',
+    'right':   lambda n: 'print ' + '1 + (' * n + '1' + ')' * n + ';',
+    'calls':   lambda n: 'print ' + 'f(' * n + '1' + ')' * n + ';',
+    'chain':   lambda n: 'print ' + ' + '.join(['x * 2'] * n) + ';',
+    'mixed':   lambda n: 'print ' + '(a < -(b' * n + ')' * (2*n) + ';',
+}
+
+def main(depth=100000):
+    depths = [ d for d in (1000, 10000, 100000, 1000000) if d <= depth ]
+    for name, shape in shapes.items():
+        for n in depths:
+            text = shape(n)
+            _, _, elapsed = timed(parse_source, text)
+            print(f'{name:8s} depth {n:8d} {elapsed:8.3f}s {elapsed/len(text)*1e6:8.3f} us/char')
+
+if __name__ == '__main__':
+    import sys
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
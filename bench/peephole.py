@@ -0,0 +1,52 @@
+# peephole.py
+#
+# Benchmark for the peephole optimizer and superinstructions (see
+# wabbit/iropt.py).  Each program is compiled to IR with all the
+# optimizations, with and without the peephole step, and run on the IR
+# machine (irrun.py).  Shown are the number of IR instructions, the
+# number of instructions dispatched by the machine and the run time
+# (the best of several runs for short programs).  Output must come
+# out the same.
+#
+#    bash $ python3 -m bench.peephole tests/Func/*.wb tests/Programs/*.wb
+
+import io
+
+from wabbit import iropt
+from wabbit.irrun import IRMachine
+from bench.gvn import CountingCode, CountingMachine
+from bench.gvn import compile_file as compile_ir
+from .util import timed
+
+def compile_file(filename, peephole):
+    saved = iropt.peephole
+    if not peephole:
+        iropt.peephole = lambda code: code
+    try:
+        return compile_ir(filename, True)
+    finally:
+        iropt.peephole = saved
+
+def measure(module):
+    out = io.StringIO()
+    CountingCode.count = 0
+    CountingMachine(module, out=out).run()
+    return (sum(len(func.code) for func in module.functions), CountingCode.count,
+            timed(lambda: IRMachine(module, out=io.StringIO()).run(), repeat=None)[2], out.getvalue())
+
+def main(filenames):
+    print(f'{"":32s} {"IR":>5s} {"after":>5s} {"dispatched":>11s} {"after":>11s} '
+          f'{"ms":>8s} {"after":>8s}')
+    for filename in filenames:
+        before = compile_file(filename, False)
+        if before is None:
+            continue
+        after = compile_file(filename, True)
+        (ir, count, elapsed, output), (ir2, count2, elapsed2, output2) = measure(before), measure(after)
+        assert output == output2
+        print(f'{filename:32s} {ir:5d} {ir2:5d} {count:11d} {count2:11d} '
+              f'{elapsed*1000:8.3f} {elapsed2*1000:8.3f}')
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1:])
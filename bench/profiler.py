@@ -0,0 +1,29 @@
+# profiler.py
+#
+# Benchmark for the overhead of the interpreter's profiler (see
+# wabbit/profiler.py).  Each program is run by the interpreter as is,
+# then with profiling, then as is again (to show that nothing is left
+# behind).  Output is discarded.  Times are the best of three runs.
+#
+#    bash $ python3 -m bench.profiler tests/Script/15_mandel.wb
+
+from wabbit.parse import parse_file
+from wabbit.typecheck import check_program
+from wabbit.profiler import Profiler
+from wabbit import interp
+from .util import timed
+
+def main(filenames):
+    for filename in filenames:
+        model = parse_file(filename)
+        if not check_program(model):
+            continue
+        _, _, before = timed(interp.interpret_program, model, repeat=3)
+        _, _, profiled = timed(lambda: interp.profile_program(model, Profiler()), repeat=3)
+        _, _, after = timed(interp.interpret_program, model, repeat=3)
+        print(f'{filename}: {before:.2f}s, profiled {profiled:.2f}s ({profiled/before:.2f}x), '
+              f'after {after:.2f}s')
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1:])
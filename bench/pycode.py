@@ -0,0 +1,42 @@
+# pycode.py
+#
+# Benchmark for running programs translated to Python (wabbit/pycode.py).
+# A program is run with the closure compiler (wabbit/closures.py) and as
+# Python code, and the time of each is reported.  Outputs are compared.
+# With -interp, the tree-walking interpreter is run as well (it's slow).
+#
+#    bash $ python3 -m bench.pycode tests/Func/22_fib.wb
+#    bash $ python3 -m bench.pycode -interp tests/Programs/mandel_loop.wb
+
+from wabbit.parse import parse_file
+from wabbit.typecheck import check_program
+from wabbit.interp import interpret_program
+from wabbit.closures import run_program
+from wabbit.pycode import generate_python, run_python
+from .util import timed
+
+def run_translated(model, filename):
+    run_python(generate_python(model), filename)
+
+def main(filename, interp=False):
+    model = parse_file(filename)
+    if not check_program(model):
+        raise SystemExit(1)
+
+    engines = [ ('closures', run_program, (model,)),
+                ('python', run_translated, (model, filename)) ]
+    if interp:
+        engines.insert(0, ('interp', interpret_program, (model,)))
+
+    results = [ (name, *timed(func, *args)[1:]) for name, func, args in engines ]
+    base = results[0][2]
+    for name, output, elapsed in results:
+        print(f'{name:10s} {elapsed:8.3f} s {base/elapsed:6.1f}x')
+    assert len({ output for _, output, _ in results }) == 1, 'Outputs differ'
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:2] == ['-interp']:
+        main(sys.argv[2], interp=True)
+    else:
+        main(sys.argv[1])
@@ -0,0 +1,87 @@
+# resolve.py
+#
+# Benchmark for name resolution (see wabbit/resolve.py).  Resolved
+# variables are found by indexing a frame with their address instead
+# of searching a ChainMap of scopes.
+#
+# The type checker and IR generator can work both ways (code that
+# hasn't been resolved, like the statements handled by the stream
+# compiler, is still looked up in the scopes), so for each file
+# both are timed on the same program with and without resolution.
+# Times with resolution include resolving.  Then the cost of a single
+# lookup is compared:  a ChainMap with as many scopes as a variable
+# used in the body of a nested loop sees, and a frame.
+#
+#    bash $ python3 -m bench.resolve tests/Programs/mandel_loop.wb
+#
+# To time the interpreter against the one that used scopes, run
+# "python3 -m wabbit.interp" on a loop-heavy script in a checkout of
+# the earlier version.
+
+from collections import ChainMap
+
+from wabbit.model import Function, Struct, Enum
+from wabbit.parse import parse_file
+from wabbit.typecheck import (new_environment, declare_toplevel, check,
+                              check_function_body, check_program)
+from wabbit.ircode import generate_ircode
+from .util import timed
+
+# Best time of a few runs of func(model) on fresh models, made by
+# prepare(model) after parsing
+def timed_fresh(func, filename, prepare=None):
+    def setup():
+        model = parse_file(filename)
+        if prepare:
+            prepare(model)
+        return (model,)
+    return timed(func, setup=setup, repeat=5)[2]
+
+# check_program() without resolving, so that every name is looked up
+# in the scopes
+def check_scopes(model):
+    env = new_environment()
+    declare_toplevel(model.statements, env)
+    for stmt in model.statements:
+        if not isinstance(stmt, (Function, Struct, Enum)):
+            check(stmt, env)
+    for stmt in model.statements:
+        if isinstance(stmt, Function):
+            check_function_body(stmt, env)
+    return not env['$errors']
+
+def lookups(lookup, count):
+    for _ in range(count):
+        lookup()
+
+def per_lookup(lookup, count=1000000):
+    return timed(lookups, lookup, count)[2] / count
+
+def main(filenames):
+    print(f'{"file":32s} {"check":>17s} {"ircode":>17s}')
+    for filename in filenames:
+        check_before = timed_fresh(check_scopes, filename)
+        check_after = timed_fresh(check_program, filename)
+        ir_before = timed_fresh(generate_ircode, filename, prepare=check_scopes)
+        ir_after = timed_fresh(generate_ircode, filename, prepare=check_program)
+        print(f'{filename[-32:]:32s} {check_before*1e3:6.1f} -> {check_after*1e3:6.1f}ms '
+              f'{ir_before*1e3:6.1f} -> {ir_after*1e3:6.1f}ms')
+
+    # A global used in the body of a loop nested in another loop within a
+    # function: the block scopes of both loops and the function, then
+    # the globals
+    env = ChainMap({ 'x': 1 }).new_child().new_child().new_child().new_child()
+    frames = ([ None ] * 8, [ 1 ])
+    address = (1, 0)
+    def scopes():
+        return env['x']
+    def resolved():
+        depth, slot = address
+        return frames[depth][slot]
+    before = per_lookup(scopes)
+    after = per_lookup(resolved)
+    print(f'lookup: {before*1e9:.0f}ns -> {after*1e9:.0f}ns ({before/after:.1f}x)')
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1:] or [ 'tests/Programs/mandel_loop.wb' ])
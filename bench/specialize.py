@@ -0,0 +1,37 @@
+# specialize.py
+#
+# Benchmark for the specialized operations of the interpreter (see
+# specialize() in wabbit/interp.py).  Each program is run twice by the
+# interpreter:  once without checking it, so that every operator runs
+# the generic code (testing the operator and the types of its
+# operands), and once after check_program(), so that operators and
+# conversions use the functions picked for their types.  Output is
+# discarded, but must be the same.
+#
+#    bash $ python3 -m bench.specialize tests/Programs/mandel_loop.wb
+#
+# With -stack, the interpreter with an explicit stack is used instead.
+
+from wabbit.parse import parse_file
+from wabbit.typecheck import check_program
+from wabbit import interp, stackinterp
+from .util import timed
+
+def main(filenames, stack=False):
+    run = stackinterp.interpret_program if stack else interp.interpret_program
+    for filename in filenames:
+        _, expected, generic = timed(run, parse_file(filename))
+        model = parse_file(filename)
+        if not check_program(model):
+            continue
+        _, output, specialized = timed(run, model)
+        assert output == expected
+        print(f'{filename}: generic {generic:.2f}s, specialized {specialized:.2f}s '
+              f'({generic/specialized:.2f}x)')
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:2] == ['-stack']:
+        main(sys.argv[2:], stack=True)
+    else:
+        main(sys.argv[1:])
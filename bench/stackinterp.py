@@ -0,0 +1,53 @@
+# stackinterp.py
+#
+# Benchmark for the interpreter with an explicit stack (see
+# wabbit/stackinterp.py).  First, a recursive function is run with
+# recursion of increasing depth by both interpreters.  The recursive
+# interpreter (interp.py) fails once Python's recursion limit is
+# reached.  Then the programs given on the command line are timed with
+# both (output is discarded).
+#
+#    bash $ python3 -m bench.stackinterp tests/Func/22_fib.wb
+
+from wabbit.parse import parse_file, parse_source
+from wabbit import interp, stackinterp
+from .util import timed
+
+recursive = '''
+func sum(n int) int {
+    if n == 0 {
+        return 0;
+    }
+    return n + sum(n - 1);
+}
+print sum(%d);
+'''
+
+# Returns (time, output), or (None, None) if Python's recursion limit
+# was reached
+def attempt(run, model):
+    try:
+        _, output, elapsed = timed(run, model)
+    except RecursionError:
+        return None, None
+    return elapsed, output
+
+def main(filenames):
+    print(f'{"depth":>8s} {"interp":>9s} {"stack":>9s}')
+    for depth in (100, 1000, 10000, 100000, 1000000):
+        model = parse_source(recursive % depth)
+        results = [ attempt(run, model) for run in (interp.interpret_program,
+                                                  stackinterp.interpret_program) ]
+        times = [ f'{t:8.2f}s' if t is not None else '   failed' for t, _ in results ]
+        print(f'{depth:8d} {times[0]} {times[1]}')
+
+    for filename in filenames:
+        model = parse_file(filename)
+        before, expected = attempt(interp.interpret_program, model)
+        after, output = attempt(stackinterp.interpret_program, model)
+        assert output == expected
+        print(f'{filename}: interp {before:.2f}s, stack {after:.2f}s')
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1:])
@@ -0,0 +1,29 @@
+# synth.py
+#
+# Utilities for making large synthetic Wabbit programs for the
+# benchmarks in this directory.  Real programs in tests/ are small.
+# To get inputs of a useful size, a sample program is repeated until
+# the desired size is reached.
+
+import os
+import tempfile
+
+def replicate(filename, size):
+    '''
+    Return source text consisting of the contents of filename repeated
+    until it is at least size bytes long.
+    '''
+    with open(filename) as file:
+        text = file.read()
+    copies = max(1, size // len(text) + 1)
+    return text * copies
+
+def write_temp(text, suffix='.wb'):
+    '''
+    Write text to a temporary file and return its name.  The caller is
+    responsible for removing it.
+    '''
+    fd, filename = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(fd, 'w') as file:
+        file.write(text)
+    return filename
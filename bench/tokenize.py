@@ -0,0 +1,87 @@
+# tokenize.py
+#
+# Throughput benchmark for wabbit.tokenize.  Compares the two ways of
+# feeding the tokenizer:
+#
+#    text  - read the whole file into a str, then tokenize()
+#    mmap  - tokenize_file(), which scans a memory-mapped file as bytes
+#
+# Reports tokens/sec, MB/sec, and peak Python memory for each.
+#
+# A second table compares the cost of keeping every token around (as
+# the parser or an editor would) as a list of Token objects versus a
+# columnar TokenStream:
+#
+#    list   - list(tokenize_file())
+#    stream - tokenize_stream_file()
+#
+#    bash $ python3 -m bench.tokenize tests/Programs/mandel.wb 20
+#
+# The second argument is the size (in MB) of the synthetic input.
+
+import os
+import tracemalloc
+
+from wabbit.tokenize import tokenize, tokenize_file, tokenize_stream_file
+from .synth import replicate, write_temp
+from .util import timed
+
+def tokenize_text(filename):
+    with open(filename) as file:
+        text = file.read()
+    return tokenize(text)
+
+def count(tokens):
+    ntokens = 0
+    for tok in tokens:
+        ntokens += 1
+    return ntokens
+
+def measure(label, make_tokens, filename, nbytes):
+    # Timing and memory are measured in separate runs because
+    # tracemalloc slows down allocation-heavy code considerably.
+    ntokens, _, elapsed = timed(lambda: count(make_tokens(filename)))
+
+    tracemalloc.start()
+    count(make_tokens(filename))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{label:6s} {ntokens:10d} tokens {elapsed:8.3f}s '
+          f'{ntokens/elapsed:12.0f} tok/s {nbytes/elapsed/1e6:8.2f} MB/s '
+          f'peak {peak/1e6:8.2f} MB')
+
+def token_list(filename):
+    return list(tokenize_file(filename))
+
+def measure_retained(label, build, filename, nbytes):
+    tokens, _, elapsed = timed(build, filename)
+    ntokens = len(tokens)
+    del tokens
+
+    tracemalloc.start()
+    tokens = build(filename)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tokens
+    print(f'{label:6s} {ntokens:10d} tokens {elapsed:8.3f}s '
+          f'{ntokens/elapsed:12.0f} tok/s {current/ntokens:8.1f} bytes/token '
+          f'total {current/1e6:8.2f} MB')
+
+def main(filename, megabytes=10):
+    text = replicate(filename, int(megabytes * 1e6))
+    tempname = write_temp(text)
+    del text
+    try:
+        nbytes = os.path.getsize(tempname)
+        print(f'Input: {nbytes/1e6:.1f} MB ({filename} replicated)')
+        measure('text', tokenize_text, tempname, nbytes)
+        measure('mmap', tokenize_file, tempname, nbytes)
+        print('Retained tokens:')
+        measure_retained('list', token_list, tempname, nbytes)
+        measure_retained('stream', tokenize_stream_file, tempname, nbytes)
+    finally:
+        os.remove(tempname)
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else 10)
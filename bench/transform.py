@@ -0,0 +1,54 @@
+# transform.py
+#
+# Benchmark for the model transforms (see wabbit/transform.py).  Each
+# program is compiled to IR as is, after constant folding only and
+# after folding and dead code elimination (all of transform()), and
+# the number of IR instructions is compared.  The IR is what the LLVM,
+# WebAssembly and IR-interpreter backends start from.  Also shown are
+# the number of statements removed as dead code and the length of the
+# Python code made by pycode.py before and after transform().
+#
+#    bash $ python3 -m bench.transform tests/Programs/mandel_loop.wb
+
+import io
+import contextlib
+
+from wabbit.parse import parse_file
+from wabbit.typecheck import check_program
+from wabbit.ircode import generate_ircode
+from wabbit.pycode import generate_python
+from wabbit.transform import fold, eliminate_dead_code
+
+# IR instructions and Python code length for a program after the
+# given stage (0 = none, 1 = folding, 2 = folding and dead code
+# elimination).  Returns the number of statements removed as well.
+def compile_file(filename, stage):
+    model = parse_file(filename)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not check_program(model):
+            return None
+    removed = 0
+    if stage >= 1:
+        model = fold(model, { })
+    if stage >= 2:
+        removed = eliminate_dead_code(model)
+    try:
+        ir = sum(len(func.code) for func in generate_ircode(model).functions)
+    except RuntimeError:
+        ir = None              # Structs and enums aren't supported by the IR
+    return ir, len(generate_python(model)), removed
+
+def main(filenames):
+    print(f'{"":36s} {"IR":>6s} {"folded":>7s} {"dead":>6s} {"stmts":>6s} {"Python":>7s} {"after":>6s}')
+    for filename in filenames:
+        before = compile_file(filename, 0)
+        if before is None:
+            continue
+        folded = compile_file(filename, 1)
+        after = compile_file(filename, 2)
+        ir = [ f'{n:6d}' if n is not None else '     -' for n in (before[0], folded[0], after[0]) ]
+        print(f'{filename:36s} {ir[0]} {ir[1]:>7s} {ir[2]} {after[2]:6d} {before[1]:7d} {after[1]:6d}')
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1:])
@@ -0,0 +1,34 @@
+# util.py
+#
+# Timing shared by the benchmarks in this directory.  The machines
+# these run on are noisy, so anything short is run several times and
+# the best time is kept.
+
+import contextlib
+import io
+import time
+
+def timed(func, *args, repeat=1, setup=None):
+    '''
+    Run func(*args) with anything it prints captured and return
+    (result, output, seconds).  func is run repeat times and seconds is
+    the best time.  With repeat=None, it is run as many times as fit in
+    about a second (once if it takes longer than a tenth of that).  The
+    result and output are from the last run.  If setup is given, it is
+    called (untimed) before every run and returns the arguments to use.
+    '''
+    best = None
+    total = 0.0
+    runs = 0
+    while runs < (repeat or 1) or (repeat is None and total < 1.0 and best < 0.1):
+        if setup:
+            args = setup()
+        output = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(output):
+            result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        total += elapsed
+        runs += 1
+    return result, output.getvalue(), best
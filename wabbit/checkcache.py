@@ -0,0 +1,207 @@
+# checkcache.py
+#
+# Incremental type checking
+#
+# check_program() resolves and checks every function body on every run.
+# In a large program where only a few functions change from one build
+# to the next, nearly all of that work gives the same answer as last
+# time.  A CheckCache remembers the result of resolving and checking
+# each function body (its frame size, the addresses and types given to
+# its nodes and the errors found) and hands it back when the same
+# function turns up again in the same surroundings.
+#
+# A result is found by the digest the parser gives each function (see
+# digest_tokens() in parse.py), made from its tokens and their lines
+# relative to the first.  It is only used if the signatures of the
+# top-level names the function mentions haven't changed since:
+#
+#    function      - types of its parameters and result
+#    struct/enum   - names and types of its fields or choices
+#    global        - its type and address
+#
+# Type names in a signature are followed too, since "p.x" depends on
+# the fields of the struct that p happens to be.  The names are kept
+# with the result, so finding it takes no walk over the function.
+# Editing the body of a function only invalidates that function.
+# Changing a signature invalidates the functions that use it.  Names
+# are compared by what they refer to at the top level, so a local
+# variable that shadows a global may cause an unneeded check, but never
+# a wrong result.  Functions that didn't come from the parser (and so
+# have no digest) are always checked.
+#
+# Errors are stored with line numbers relative to the function, so a
+# function that just moves around in the file is still reused.
+#
+# Putting a result back still takes one pass over the nodes of the
+# function (see parcheck.function_nodes()), but that is about a third
+# of the work of resolving and checking it (see bench/checkcache.py).
+#
+#     cache = CheckCache.load('prog.cache')       # Empty if there's no file
+#     check_program(model, cache=cache)
+#     print(cache.stats)                          # { 'reused': 998, 'checked': 2 }
+#     cache.save('prog.cache')
+
+import json
+import hashlib
+
+from .model import *
+from .typecheck import BuiltinType
+from .parcheck import check_one, check_parallel, put_back, function_nodes
+
+class CheckCache:
+    def __init__(self, results=None):
+        self.results = results if results is not None else { }   # Digest -> result
+        self.used = set()         # Digests looked up or stored since loading
+        self.stats = { 'reused': 0, 'checked': 0 }
+
+    # Addresses come back from JSON as lists
+    @classmethod
+    def load(cls, filename):
+        try:
+            with open(filename) as file:
+                results = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return cls()
+        for result in results.values():
+            result['addresses'] = [ tuple(address) if isinstance(address, list) else address
+                                    for address in result['addresses'] ]
+        return cls(results)
+
+    # Only results used since loading are saved.  The rest belong to
+    # functions that have changed or gone away.
+    def save(self, filename):
+        with open(filename, 'w') as file:
+            json.dump({ digest: self.results[digest] for digest in self.used }, file)
+
+    # Resolve and check the bodies of functions (pass 3 of
+    # check_program()), reusing earlier results where possible.  With
+    # jobs > 1, the rest are checked in parallel (see parcheck.py).
+    def check_functions(self, functions, env, resolver, jobs=1):
+        signatures = Signatures(env)
+        errors = env['$errors']
+        missing = [ ]
+        for func in functions:
+            digest = getattr(func, 'digest', None)
+            result = self.results.get(digest)
+            if result is not None and result['signatures'] == signatures.digest(result['names']):
+                self.used.add(digest)
+                put_back(func, function_nodes(func), result['size'], result['addresses'], result['types'])
+                lineno = getattr(func, 'lineno', 0)
+                errors.extend((lineno + offset, message) for offset, message in result['errors'])
+            else:
+                missing.append(func)
+        if jobs > 1 and len(missing) > 1:
+            checked = zip(missing, check_parallel(missing, env, resolver, jobs))
+            checked = [ (func, function_nodes(func), result) for func, result in checked ]
+            for func, nodes, result in checked:
+                put_back(func, nodes, *result[:3])
+        else:
+            checked = [ (func, *check_one(func, env, resolver)) for func in missing ]
+        for func, nodes, result in checked:
+            errors.extend(result[3])
+            self.store(func, nodes, result, signatures)
+        self.stats = { 'reused': len(functions) - len(missing), 'checked': len(missing) }
+
+    def store(self, func, nodes, result, signatures):
+        digest = getattr(func, 'digest', None)
+        if digest is None:
+            return
+        size, addresses, types, func_errors = result
+        names = sorted(mentioned(nodes))
+        lineno = getattr(func, 'lineno', 0)
+        self.results[digest] = {
+            'names': names,
+            'signatures': signatures.digest(names),
+            'size': size,
+            'addresses': addresses,
+            'types': types,
+            'errors': [ [ line - lineno, message ] for line, message in func_errors ],
+        }
+        self.used.add(digest)
+
+# The names mentioned by the nodes of a function that might refer to
+# something at the top level
+def mentioned(nodes):
+    names = set()
+    for node in nodes:
+        if isinstance(node, (Name, Call)):
+            names.add(node.name)
+        elif isinstance(node, EnumValue):
+            names.add(node.enum)
+        elif isinstance(node, (Variable, Const, Parameter)):
+            if node.type is not None:
+                names.add(node.type)
+        elif isinstance(node, Function):
+            names.add(node.rettype)
+    return names
+
+# Signatures of the top-level names of a program, made as needed.  Maps
+# name -> signature (as bytes for the digest).
+class Signatures(dict):
+    def __init__(self, env):
+        self.toplevel = dict(env)
+        self.closures = { }       # Name -> names it depends on
+        self.digests = { }        # Tuple of names -> digest
+
+    def __missing__(self, name):
+        self[name] = value = repr((name, signature(self.toplevel.get(name)))).encode()
+        return value
+
+    # Digest of the signatures that code mentioning names depends on.
+    # Functions often mention the same names, so digests are kept.
+    def digest(self, names):
+        key = tuple(names)
+        value = self.digests.get(key)
+        if value is None:
+            digest = hashlib.blake2b(digest_size=16)
+            for name in sorted(self.closure(names)):
+                digest.update(self[name])
+            value = self.digests[key] = digest.hexdigest()
+        return value
+
+    # Top-level names that code mentioning names depends on:  the names
+    # and the types named in their signatures (and so on)
+    def closure(self, names):
+        result = set()
+        for name in names:
+            deps = self.closures.get(name)
+            if deps is None:
+                deps = self.closures[name] = self.dependencies(name)
+            result |= deps
+        return result
+
+    def dependencies(self, name):
+        names = set()
+        pending = [ name ]
+        while pending:
+            name = pending.pop()
+            if name not in names:
+                names.add(name)
+                pending.extend(signature_types(self.toplevel.get(name)))
+        return names
+
+# Globals include their address since the addresses given to the names
+# in a function are kept with its result
+def signature(decl):
+    if isinstance(decl, Function):
+        return ('func', [ param.type for param in decl.parameters ], decl.rettype)
+    elif isinstance(decl, Struct):
+        return ('struct', [ (field.name, field.type) for field in decl.fields ])
+    elif isinstance(decl, Enum):
+        return ('enum', [ (choice.name, choice.type) for choice in decl.choices ])
+    elif isinstance(decl, (Variable, Const)):
+        return (type(decl).__name__, decl.type, getattr(decl, 'address', None))
+    elif isinstance(decl, BuiltinType):
+        return ('builtin',)
+    return None
+
+def signature_types(decl):
+    if isinstance(decl, Function):
+        return [ param.type for param in decl.parameters ] + [ decl.rettype ]
+    elif isinstance(decl, Struct):
+        return [ field.type for field in decl.fields ]
+    elif isinstance(decl, Enum):
+        return [ choice.type for choice in decl.choices if choice.type is not None ]
+    elif isinstance(decl, (Variable, Const)):
+        return [ decl.type ] if decl.type is not None else [ ]
+    return [ ]
@@ -0,0 +1,501 @@
+# closures.py
+#
+# Closure-compiling interpreter
+#
+# The interpreter in interp.py looks at every node again each time it
+# runs.  In a loop, that means finding the handler for each node,
+# testing which operator a BinOp has, looking names up in a ChainMap,
+# etc., over and over on every iteration.
+#
+# This module does all of that once.  Each node of a checked program
+# is turned into a Python closure that does just what that node does,
+# with the closures for its children already bound.  For example,
+# BinOp('+', Name('x'), Integer('1')) with x an int local becomes
+# something like:
+#
+#     def add(frame):
+#         return wrap(left(frame) + right(frame))
+#
+# where left() is "lambda frame: frame[3]" and right() is "lambda
+# frame: 1".  Running the program is then just calling closures.
+#
+# Values are the same as in interp.py (32-bit ints, one-character
+# strings for chars, StructInstance, EnumInstance, ...) and programs
+# print exactly the same output.  The differences are all in how
+# things are found:
+#
+#   - Variables are resolved when compiling, like in ircode.py.
+#     Globals live in a list shared by everything.  Every other
+#     variable gets a slot in the frame (a list) of the function it's
+#     declared in.  Top-level code outside of functions runs with its
+#     own frame.
+#
+#   - Statements return None when they complete normally, or one of
+#     BREAK, CONTINUE or RETURN.  Loops and function calls check for
+#     these (a returned value is left in the frame).  Control flow
+#     inside a compound expression can't be returned this way, so it's
+#     raised as a Signal exception instead.
+#
+#   - Operators are picked using the types filled in by the checker, so
+#     the model must have been checked first.
+#
+#     model = parse_file('prog.wb')
+#     if check_program(model):
+#         run_program(model)
+
+from collections import ChainMap
+
+from .model import *
+from .interp import StructInstance, EnumInstance, wrap32, idiv, format_value
+
+# Statement results other than None
+BREAK = 1
+CONTINUE = 2
+RETURN = 3
+
+class Signal(Exception):
+    def __init__(self, status):
+        self.status = status
+
+# A compiled function.  Frames hold the parameters, then the slot for
+# the return value, then all other locals.
+class CompiledFunction:
+    def __init__(self, name, nparams):
+        self.name = name
+        self.nparams = nparams
+        self.ret = nparams
+        self.body = None
+        self.padding = [ None ]
+
+    def call(self, args):
+        frame = args + self.padding
+        try:
+            status = self.body(frame)
+        except Signal as signal:
+            status = signal.status
+        return frame[self.ret] if status == RETURN else ()
+
+# Holds what's needed while compiling.  scope maps names to
+# ('local', slot), ('global', slot) or the model node of a function,
+# struct or enum.
+class ClosureCompiler:
+    def __init__(self):
+        self.globals = [ ]
+        self.scope = ChainMap()
+        self.functions = { }
+        self.frame = None          # CompiledFunction for the code being compiled
+
+    # Variables declared in the outermost scope are globals
+    def declare(self, name):
+        if len(self.scope.maps) == 1:
+            self.scope[name] = ('global', len(self.globals))
+            self.globals.append(None)
+        else:
+            self.scope[name] = ('local', len(self.frame.padding) + self.frame.nparams)
+            self.frame.padding.append(None)
+        return self.scope[name]
+
+    def function(self, name):
+        if name not in self.functions:
+            decl = self.scope[name]
+            self.functions[name] = CompiledFunction(name, len(decl.parameters))
+        return self.functions[name]
+
+    def new_scope(self):
+        self.scope = self.scope.new_child()
+
+    def end_scope(self):
+        self.scope = self.scope.parents
+
+# Compile a checked Program.  Returns a function that runs it.
+def compile_program(model):
+    compiler = ClosureCompiler()
+    for stmt in model.statements:
+        if isinstance(stmt, (Function, Struct, Enum)):
+            compiler.scope[stmt.name] = stmt
+
+    # Top-level code runs like a function with no parameters
+    init = CompiledFunction('_init', 0)
+    compiler.frame = init
+    init.body = compile_block([ stmt for stmt in model.statements
+                                if not isinstance(stmt, (Function, Struct, Enum)) ], compiler)
+
+    for stmt in model.statements:
+        if isinstance(stmt, Function):
+            compile_function(stmt, compiler)
+
+    main = compiler.functions.get('main') if isinstance(compiler.scope.get('main'), Function) else None
+    def run():
+        init.call([ ])
+        if main:
+            main.call([ ])
+    return run
+
+def run_program(model):
+    compile_program(model)()
+
+def compile_function(node, compiler):
+    func = compiler.function(node.name)
+    compiler.frame = func
+    compiler.scope = ChainMap(compiler.scope.maps[-1]).new_child()
+    for n, param in enumerate(node.parameters):
+        compiler.scope[param.name] = ('local', n)
+    func.body = compile_block(node.body, compiler)
+    compiler.scope = ChainMap(compiler.scope.maps[-1])
+
+# Make the closure for a node
+def compile(node, compiler):
+    return compilers[type(node)](node, compiler)
+
+def compile_unknown(node, compiler):
+    raise RuntimeError(f"Can't compile {node}")
+
+# ---- Expressions.  Closures return the value of the expression.
+
+def constant(value):
+    return lambda frame: value
+
+def compile_integer(node, compiler):
+    return constant(wrap32(int(node.value)))
+
+def compile_float(node, compiler):
+    return constant(float(node.value))
+
+def compile_char(node, compiler):
+    return constant(node.value)
+
+def compile_bool(node, compiler):
+    return constant(node.value)
+
+def compile_unit(node, compiler):
+    return constant(())
+
+def compile_name(node, compiler):
+    scope, slot = compiler.scope[node.name]
+    if scope == 'local':
+        return lambda frame: frame[slot]
+    values = compiler.globals
+    return lambda frame: values[slot]
+
+def compile_attribute(node, compiler):
+    value = compile(node.value, compiler)
+    name = node.name
+    return lambda frame: value(frame).fields[name]
+
+def compile_unaryop(node, compiler):
+    operand = compile(node.operand, compiler)
+    if node.op == '-':
+        if node.type == 'int':
+            return lambda frame: wrap32(-operand(frame))
+        return lambda frame: -operand(frame)
+    elif node.op == '!':
+        return lambda frame: not operand(frame)
+    return operand
+
+# Arithmetic on ints wraps around to 32 bits.  The wrap is written out
+# in place rather than calling wrap32() since these run a lot.
+def compile_binop(node, compiler):
+    left = compile(node.left, compiler)
+    right = compile(node.right, compiler)
+    op = node.op
+    if op == '&&':
+        return lambda frame: left(frame) and right(frame)
+    elif op == '||':
+        return lambda frame: left(frame) or right(frame)
+
+    if node.left.type == 'int':
+        if op == '+':
+            return lambda frame: ((left(frame) + right(frame) + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+        elif op == '-':
+            return lambda frame: ((left(frame) - right(frame) + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+        elif op == '*':
+            return lambda frame: ((left(frame) * right(frame) + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+        elif op == '/':
+            return lambda frame: idiv(left(frame), right(frame))
+    if op == '+':
+        return lambda frame: left(frame) + right(frame)
+    elif op == '-':
+        return lambda frame: left(frame) - right(frame)
+    elif op == '*':
+        return lambda frame: left(frame) * right(frame)
+    elif op == '/':
+        return lambda frame: left(frame) / right(frame)
+    elif op == '<':
+        return lambda frame: left(frame) < right(frame)
+    elif op == '<=':
+        return lambda frame: left(frame) <= right(frame)
+    elif op == '>':
+        return lambda frame: left(frame) > right(frame)
+    elif op == '>=':
+        return lambda frame: left(frame) >= right(frame)
+    elif op == '==':
+        return lambda frame: left(frame) == right(frame)
+    elif op == '!=':
+        return lambda frame: left(frame) != right(frame)
+    raise RuntimeError(f'Unsupported operator {op}')
+
+def compile_call(node, compiler):
+    args = [ compile(arg, compiler) for arg in node.arguments ]
+    if node.name == 'int':
+        arg, = args
+        if node.arguments[0].type == 'char':
+            return lambda frame: ord(arg(frame))
+        return lambda frame: wrap32(int(arg(frame)))
+    elif node.name == 'float':
+        arg, = args
+        return lambda frame: float(arg(frame))
+    elif node.name == 'char':
+        arg, = args
+        if node.arguments[0].type == 'int':
+            return lambda frame: chr(arg(frame) & 0xFF)
+        return arg
+    elif node.name in ('bool', 'unit'):
+        return args[0]
+
+    decl = compiler.scope[node.name]
+    if isinstance(decl, Struct):
+        name = decl.name
+        fields = [ field.name for field in decl.fields ]
+        return lambda frame: StructInstance(name, dict(zip(fields, [ arg(frame) for arg in args ])))
+
+    call = compiler.function(node.name).call
+    if len(args) == 0:
+        return lambda frame: call([ ])
+    elif len(args) == 1:
+        arg0, = args
+        return lambda frame: call([ arg0(frame) ])
+    elif len(args) == 2:
+        arg0, arg1 = args
+        return lambda frame: call([ arg0(frame), arg1(frame) ])
+    return lambda frame: call([ arg(frame) for arg in args ])
+
+def compile_enumvalue(node, compiler):
+    enum, choice = node.enum, node.choice
+    if node.value is None:
+        return lambda frame: EnumInstance(enum, choice)
+    value = compile(node.value, compiler)
+    return lambda frame: EnumInstance(enum, choice, value(frame))
+
+# The first case that matches is used.  Nothing after a '_' case can match.
+def compile_match(node, compiler):
+    value = compile(node.value, compiler)
+    cases = { }
+    default = None
+    for case in node.cases:
+        compiler.new_scope()
+        slot = compiler.declare(case.binding)[1] if case.binding is not None else None
+        compiled = (slot, compile(case.value, compiler))
+        compiler.end_scope()
+        if case.choice == '_':
+            default = compiled
+            break
+        cases.setdefault(case.choice, compiled)
+
+    def match(frame):
+        instance = value(frame)
+        case = cases.get(instance.choice, default)
+        if case is None:
+            raise RuntimeError(f'No match for {instance}')
+        slot, body = case
+        if slot is not None:
+            frame[slot] = instance.value
+        return body(frame)
+    return match
+
+def compile_compound(node, compiler):
+    compiler.new_scope()
+    last = node.statements[-1] if node.statements else None
+    if isinstance(last, ExprStatement):
+        block = compile_block(node.statements[:-1], compiler)
+        result = compile(last.expression, compiler)
+    else:
+        block = compile_block(node.statements, compiler)
+        result = constant(())
+    compiler.end_scope()
+
+    def compound(frame):
+        status = block(frame)
+        if status is not None:
+            raise Signal(status)
+        return result(frame)
+    return compound
+
+# ---- Statements.  Closures return None or BREAK, CONTINUE or RETURN.
+
+def compile_block(statements, compiler):
+    stmts = tuple(compile(stmt, compiler) for stmt in statements
+                  if not isinstance(stmt, (Function, Struct, Enum)))
+    if not stmts:
+        return lambda frame: None
+    elif len(stmts) == 1:
+        return stmts[0]
+
+    def block(frame):
+        for stmt in stmts:
+            status = stmt(frame)
+            if status is not None:
+                return status
+        return None
+    return block
+
+def compile_print(node, compiler):
+    value = compile(node.value, compiler)
+    valtype = node.value.type
+    if valtype == 'char':
+        def print_value(frame):
+            print(value(frame), end='')
+    elif valtype in ('int', 'float'):
+        def print_value(frame):
+            print(value(frame))
+    else:
+        def print_value(frame):
+            print(format_value(value(frame)))
+    return print_value
+
+def compile_assignment(node, compiler):
+    value = compile(node.value, compiler)
+    if isinstance(node.location, Attribute):
+        target = compile(node.location.value, compiler)
+        name = node.location.name
+        def assign(frame):
+            target(frame).fields[name] = value(frame)
+        return assign
+
+    scope, slot = compiler.scope[node.location.name]
+    values = compiler.globals
+    if scope == 'local':
+        def assign(frame):
+            frame[slot] = value(frame)
+    else:
+        def assign(frame):
+            values[slot] = value(frame)
+    return assign
+
+def compile_variable(node, compiler):
+    if node.value is not None:
+        value = compile(node.value, compiler)
+    else:
+        value = default_value(node.type, compiler)
+    scope, slot = compiler.declare(node.name)
+    values = compiler.globals
+    if scope == 'local':
+        def define(frame):
+            frame[slot] = value(frame)
+    else:
+        def define(frame):
+            values[slot] = value(frame)
+    return define
+
+# Closure making the initial value of a variable declared without a
+# value.  Each structure gets new instances of its fields.
+def default_value(typename, compiler):
+    if typename == 'int':
+        return constant(0)
+    elif typename == 'float':
+        return constant(0.0)
+    elif typename == 'char':
+        return constant('\x00')
+    elif typename == 'bool':
+        return constant(False)
+    elif typename == 'unit':
+        return constant(())
+    struct = compiler.scope[typename]
+    fields = [ (field.name, default_value(field.type, compiler)) for field in struct.fields ]
+    name = struct.name
+    return lambda frame: StructInstance(name, { field: value(frame) for field, value in fields })
+
+def compile_if(node, compiler):
+    test = compile(node.test, compiler)
+    compiler.new_scope()
+    consequence = compile_block(node.consequence, compiler)
+    compiler.end_scope()
+    compiler.new_scope()
+    alternative = compile_block(node.alternative, compiler)
+    compiler.end_scope()
+
+    def if_(frame):
+        if test(frame):
+            return consequence(frame)
+        return alternative(frame)
+    return if_
+
+def compile_while(node, compiler):
+    test = compile(node.test, compiler)
+    compiler.new_scope()
+    body = compile_block(node.body, compiler)
+    compiler.end_scope()
+
+    def while_(frame):
+        while test(frame):
+            try:
+                status = body(frame)
+            except Signal as signal:
+                status = signal.status
+            if status is not None:
+                if status == BREAK:
+                    break
+                elif status == RETURN:
+                    return status
+        return None
+    return while_
+
+def compile_break(node, compiler):
+    return lambda frame: BREAK
+
+def compile_continue(node, compiler):
+    return lambda frame: CONTINUE
+
+def compile_return(node, compiler):
+    value = compile(node.value, compiler)
+    ret = compiler.frame.ret
+    def return_(frame):
+        frame[ret] = value(frame)
+        return RETURN
+    return return_
+
+def compile_exprstatement(node, compiler):
+    expression = compile(node.expression, compiler)
+    def statement(frame):
+        expression(frame)
+    return statement
+
+compilers = Dispatch({
+    # Expressions
+    Integer: compile_integer,
+    Float: compile_float,
+    Char: compile_char,
+    Bool: compile_bool,
+    Unit: compile_unit,
+    Name: compile_name,
+    Attribute: compile_attribute,
+    UnaryOp: compile_unaryop,
+    BinOp: compile_binop,
+    Call: compile_call,
+    EnumValue: compile_enumvalue,
+    Match: compile_match,
+    Compound: compile_compound,
+
+    # Statements
+    Print: compile_print,
+    Assignment: compile_assignment,
+    (Variable, Const): compile_variable,
+    If: compile_if,
+    While: compile_while,
+    Break: compile_break,
+    Continue: compile_continue,
+    Return: compile_return,
+    ExprStatement: compile_exprstatement,
+}, default=compile_unknown)
+
+# Sample main program
+def main(filename):
+    from .parse import parse_file
+    from .typecheck import check_program
+    model = parse_file(filename)
+    if not check_program(model):
+        raise SystemExit(1)
+    run_program(model)
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1])
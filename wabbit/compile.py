@@ -7,3 +7,242 @@
 #    python3 -m wabbit.compile -wasm prog.wb
 #
 # This would be a kind of final step for the project.
+#
+# Pass manager
+# ------------
+# Compiling a program is a sequence of passes, each taking what the one
+# before produced:
+#
+#    parse     filename -> model          (parse.py)
+#    check     model -> model             (typecheck.py, exits on errors)
+#    fold      model -> model             (transform.py:  constant folding)
+#    inline    model -> model             (transform.py:  inlining)
+#    loops     model -> model             (transform.py:  loop optimization)
+#    dce       model -> model             (transform.py:  dead code elimination)
+#    ircode    model -> IRModule          (ircode.py)
+#    iropt     IRModule -> IRModule       (iropt.py)
+#    irrun     IRModule -> None           (irrun.py:  runs the program)
+#    llvm      IRModule -> LLVM assembly  (llvm.py)
+#    wasm      IRModule -> Wasm binary    (wasm.py)
+#    python    model -> Python source     (pycode.py)
+#
+# A pipeline is just a list of pass names (see pipelines below).  The
+# optimizations are the same steps transform() takes, as separate
+# passes.  A different set can be given with -passes:
+#
+#    python3 -m wabbit.compile -llvm -passes fold,dce prog.wb
+#
+# With -time-passes, a report goes to stderr showing for each pass the
+# wall time, the size of what it was given and what it made (model
+# nodes, IR instructions, lines or bytes of output) and the peak
+# memory it allocated (traced by tracemalloc).  Tracing memory slows
+# everything down, so the times are only good for comparing passes
+# with each other.
+#
+#    bash $ python3 -m wabbit.compile -time-passes -llvm tests/Programs/mandel_loop.wb
+#    pass            time        before         after    peak mem
+#    parse          3.3ms             -     126 nodes      43.8kB
+#    check          1.0ms     126 nodes     126 nodes       5.8kB
+#    fold           0.2ms     126 nodes     116 nodes       1.9kB
+#    ...
+#    iropt          7.7ms    133 instrs    117 instrs      28.6kB
+#    llvm          41.5ms    117 instrs     137 lines    1025.6kB
+#    total         60.5ms
+#
+# (The llvm pass includes importing llvmlite.)
+#
+# The main() functions of irrun.py, llvm.py and wasm.py run their
+# pipelines from here and take -time-passes as well.
+
+import sys
+import time
+import tracemalloc
+
+from .model import Program, walk
+from .parse import parse_file
+from .typecheck import check_program
+from .transform import fold, inline_functions, optimize_loops, eliminate_dead_code
+from .ircode import generate_ircode
+from .iropt import optimize_ircode
+from .irrun import IRMachine
+from .wasm import generate_wasm, encode_module
+from .pycode import generate_python
+
+# ---- Passes
+
+def check_pass(model):
+    if not check_program(model):
+        raise SystemExit(1)
+    return model
+
+def fold_pass(model):
+    return fold(model, { })
+
+def inline_pass(model):
+    inline_functions(model)
+    return model
+
+def loops_pass(model):
+    optimize_loops(model)
+    return model
+
+def dce_pass(model):
+    eliminate_dead_code(model)
+    return model
+
+def irrun_pass(module):
+    IRMachine(module).run()
+
+# llvm.py is only imported when used since it needs llvmlite
+def llvm_pass(module):
+    from .llvm import generate_llvm
+    return str(generate_llvm(module))
+
+def wasm_pass(module):
+    return encode_module(generate_wasm(module))
+
+passes = {
+    'parse': parse_file,
+    'check': check_pass,
+    'fold': fold_pass,
+    'inline': inline_pass,
+    'loops': loops_pass,
+    'dce': dce_pass,
+    'ircode': generate_ircode,
+    'iropt': optimize_ircode,
+    'irrun': irrun_pass,
+    'llvm': llvm_pass,
+    'wasm': wasm_pass,
+    'python': generate_python,
+}
+
+frontend = [ 'parse', 'check' ]
+optimizations = [ 'fold', 'inline', 'fold', 'loops', 'dce' ]
+
+def make_pipeline(backend, optimizations=optimizations):
+    if backend == 'python':
+        return frontend + optimizations + [ 'python' ]
+    return frontend + optimizations + [ 'ircode', 'iropt', backend ]
+
+pipelines = {
+    'check': frontend,
+    'run': make_pipeline('irrun'),
+    'llvm': make_pipeline('llvm'),
+    'wasm': make_pipeline('wasm'),
+    'python': make_pipeline('python'),
+}
+
+# Run the passes of a pipeline (a list of names) starting from value
+# (a filename for a pipeline starting with parse).  Returns what the
+# last pass made.  If timer is given, each pass is run through it.
+def run_pipeline(value, pipeline, timer=None):
+    for name in pipeline:
+        if timer is not None:
+            value = timer.run(name, passes[name], value)
+        else:
+            value = passes[name](value)
+    return value
+
+# Size of what a pass made, as (count, unit)
+def measure(value):
+    if isinstance(value, Program):
+        return sum(1 for _ in walk(value)), 'nodes'
+    elif hasattr(value, 'functions') and hasattr(value, 'globals'):
+        return sum(len(func.code) for func in value.functions), 'instrs'
+    elif isinstance(value, str):
+        return value.count('\n'), 'lines'
+    elif isinstance(value, bytes):
+        return len(value), 'bytes'
+    return None
+
+# Runs passes and records (name, seconds, size before, size after, peak
+# bytes allocated) for each.  Memory is counted from the start of each
+# pass, so memory held by the model from earlier passes isn't included.
+class PassTimer:
+    def __init__(self):
+        self.records = [ ]
+        self.size = None          # Size of the value passed along
+
+    def run(self, name, function, value):
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            result = function(value)
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] - base
+            if not tracing:
+                tracemalloc.stop()
+        size = measure(result)
+        self.records.append((name, elapsed, self.size, size, peak))
+        self.size = size
+        return result
+
+    def report(self):
+        lines = [ f'{"pass":10s} {"time":>9s} {"before":>13s} {"after":>13s} {"peak mem":>11s}' ]
+        for name, elapsed, before, after, peak in self.records:
+            lines.append(f'{name:10s} {format_time(elapsed):>9s} {format_size(before):>13s} '
+                         f'{format_size(after):>13s} {peak/1000:9.1f}kB')
+        total = sum(record[1] for record in self.records)
+        lines.append(f'{"total":10s} {format_time(total):>9s}')
+        return '\n'.join(lines)
+
+def format_time(seconds):
+    return f'{seconds*1000:.1f}ms' if seconds < 10 else f'{seconds:.2f}s'
+
+def format_size(size):
+    return f'{size[0]} {size[1]}' if size is not None else '-'
+
+# Run a pipeline on a file, printing the timing report to stderr if
+# time_passes is set.  Returns what the last pass made.  The report is
+# printed even if a pass fails.
+def compile_file(filename, pipeline, time_passes=False):
+    if not time_passes:
+        return run_pipeline(filename, pipeline)
+    timer = PassTimer()
+    try:
+        return run_pipeline(filename, pipeline, timer)
+    finally:
+        print(timer.report(), file=sys.stderr)
+
+outputs = {
+    'llvm': ('out.ll', 'w'),
+    'wasm': ('out.wasm', 'wb'),
+}
+
+def main(filename, backend='run', passes=None, time_passes=False):
+    if passes is None or backend == 'check':
+        pipeline = pipelines[backend]
+    else:
+        unknown = [ name for name in passes if name not in optimizations ]
+        if unknown:
+            raise SystemExit(f'Unknown optimization pass {unknown[0]}')
+        pipeline = make_pipeline('irrun' if backend == 'run' else backend, passes)
+    result = compile_file(filename, pipeline, time_passes)
+    if backend in outputs:
+        outname, mode = outputs[backend]
+        with open(outname, mode) as file:
+            file.write(result)
+        print(f'Wrote {outname}')
+    elif backend == 'python':
+        print(result)
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = { }
+    while len(args) > 1 and args[0].startswith('-'):
+        if args[0] == '-time-passes':
+            options['time_passes'] = True
+        elif args[0] == '-passes':
+            options['passes'] = [ name for name in args[1].split(',') if name ]
+            args = args[1:]
+        elif args[0][1:] in pipelines:
+            options['backend'] = args[0][1:]
+        else:
+            raise SystemExit(f'Unknown option {args[0]}')
+        args = args[1:]
+    main(args[0], **options)
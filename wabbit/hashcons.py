@@ -0,0 +1,302 @@
+# hashcons.py
+#
+# Hash-consing of model nodes
+#
+# Generated programs repeat the same subexpressions over and over
+# (constants, x*x - y*y, ...).  A HashCons keeps one copy of every
+# distinct subtree.  Building or sharing a node that's structurally
+# identical to one seen before gives back the earlier node instead, so
+# a tree becomes a DAG in which each distinct subtree exists once.
+#
+# Only expressions that can't change meaning from one place to another
+# are shared:
+#
+#   - Before type checking, a subtree is shared only if it's "closed":
+#     literals and unary/binary operators applied to closed operands.
+#     These mean the same thing wherever they appear.  Names, calls,
+#     field accesses and enum values depend on what's declared around
+#     them, so they are left alone.  Since the checker reports errors
+#     by line number, closed subtrees are only shared within a line
+#     until they've been checked.
+#
+#   - After type checking, any expression whose type is known may be
+#     shared with others of the same structure and type, wherever they
+#     are.  Name('x') of type int in one function and Name('x') of
+#     type int in another become the same node if they also have the
+#     same address (see resolve.py), that is, the same slot in the
+#     frame of their function.  The checker resolves names before
+#     checking.  Resolving the shared tree again (the interpreter
+#     does) gives every name the address it already has.
+#
+# Compound and Match are never shared (they declare names), nor is
+# anything with a type error.  Statements are never shared.  A shared
+# node keeps the line number of its first occurrence in the source.
+#
+# Because each distinct subtree is a single object, analyses only
+# need to be done once per subtree.  constant() (the value of a
+# closed expression) and type_of() (its type) are memoized by node.
+#
+#     hc = HashCons()
+#     two = hc.make(Integer, '2')
+#     expr = hc.make(BinOp, '*', two, two)      # 2 * 2
+#     assert hc.make(BinOp, '*', two, two) is expr
+#     hc.constant(expr)                         # -> 4
+#
+#     program = hc.share(parse_file('prog.wb'))  # Share a whole tree
+#
+# Arena.add() (model.py) stores a subtree that appears several times
+# only once, so a shared tree also makes for a smaller arena.
+
+from .model import *
+from .interp import wrap32, idiv
+from .typecheck import unary_ops, binary_ops
+
+literal_types = {
+    Integer: 'int',
+    Float: 'float',
+    Char: 'char',
+    Bool: 'bool',
+    Unit: 'unit',
+}
+
+# Expressions that are never shared
+unshared = (Compound, Match)
+
+class HashCons:
+    def __init__(self):
+        self.nodes = { }          # Key -> shared node
+        self.shared = { }         # id(shared node) -> key
+        self.closed = set()       # ids of shared nodes that are closed
+        self.types = { }          # id(closed node) -> type
+        self.constants = { }      # id(closed node) -> value (None if not constant)
+        self.hits = 0             # Nodes replaced by an existing node
+        self.misses = 0           # Distinct nodes
+
+    def __len__(self):
+        return len(self.nodes)
+
+    # Make a node (like cls(*fields)).  Any child nodes in fields should
+    # themselves have come from this HashCons.
+    def make(self, cls, *fields, lineno=None):
+        node = cls(*fields)
+        if lineno is not None:
+            node.lineno = lineno
+        return self.intern(node)
+
+    # Return the shared node equal to node.  If there isn't one yet,
+    # node becomes it.  Nodes that can't be shared are returned as is.
+    def intern(self, node):
+        key, nodetype = self.key(node)
+        if key is None:
+            return node
+        shared = self.nodes.get(key)
+        if shared is not None:
+            self.hits += 1
+            return shared
+        self.misses += 1
+        self.nodes[key] = node
+        self.shared[id(node)] = key
+        if nodetype is not None:
+            self.closed.add(id(node))
+            self.types[id(node)] = nodetype
+        return node
+
+    # Key identifying the structure of node along with the type of node
+    # if it's closed.  Returns (None, None) if the node can't be shared.
+    def key(self, node):
+        if not isinstance(node, Expression) or isinstance(node, unshared):
+            return None, None
+        cls = type(node)
+        fields = [ ]
+        children = [ ]
+        for name in cls._fields:
+            value = getattr(node, name)
+            if isinstance(value, Node):
+                if id(value) not in self.shared:
+                    return None, None
+                children.append(value)
+                value = id(value)
+            elif isinstance(value, list):
+                if any(id(item) not in self.shared for item in value):
+                    return None, None
+                value = tuple(id(item) for item in value)
+            fields.append(value)
+
+        nodetype = self.closed_type(node, children)
+        if nodetype is not None:
+            if nodetype == 'error':
+                return None, None
+            if not hasattr(node, 'type'):
+                return (cls, getattr(node, 'lineno', None), *fields), nodetype
+            return (cls, *fields), nodetype
+
+        # Open nodes can only be shared once the checker has typed them
+        checked = getattr(node, 'type', None)
+        if checked is None or checked == 'error':
+            return None, None
+        return (cls, checked, getattr(node, 'address', None), *fields), None
+
+    # Type of node if it's closed (given its shared children).  None if
+    # it's not closed.
+    def closed_type(self, node, children):
+        if type(node) in literal_types:
+            return literal_types[type(node)]
+        if not isinstance(node, (UnaryOp, BinOp)):
+            return None
+        if any(id(child) not in self.closed for child in children):
+            return None
+        types = [ self.types[id(child)] for child in children ]
+        if 'error' in types:
+            return 'error'
+        if isinstance(node, UnaryOp):
+            return unary_ops.get((node.op, *types), 'error')
+        return binary_ops.get((node.op, *types), 'error')
+
+    # Share all possible subtrees of a tree (any node or list of
+    # statements).  Fields are updated in place to refer to the shared
+    # nodes and the (possibly shared) root is returned.
+    def share(self, root):
+        replaced = { }
+        stack = [ (root, False) ]
+        while stack:
+            node, visited = stack.pop()
+            if not visited:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(children(node)))
+                continue
+            if isinstance(node, list):
+                node[:] = [ replaced.get(id(item), item) for item in node ]
+                continue
+            for name in node._fields:
+                value = getattr(node, name, None)
+                if isinstance(value, Node):
+                    setattr(node, name, replaced[id(value)])
+                elif isinstance(value, list):
+                    value[:] = [ replaced[id(item)] for item in value ]
+            replaced[id(node)] = self.intern(node)
+        return replaced.get(id(root), root)
+
+    # ---- Memoized analyses
+
+    def type_of(self, node):
+        '''
+        Type of a shared expression: the type of a closed expression or
+        the checked type of any other shared expression.  None if not
+        known.
+        '''
+        if id(node) in self.types:
+            return self.types[id(node)]
+        if id(node) in self.shared:
+            return getattr(node, 'type', None)
+        return None
+
+    def constant(self, node):
+        '''
+        Value of a shared closed expression, with the same semantics as
+        the interpreter (32-bit ints, division truncating towards zero).
+        None if node isn't closed or its value can't be computed
+        (division by zero).
+        '''
+        if id(node) not in self.closed:
+            return None
+        memo = self.constants
+        stack = [ node ]
+        while stack:
+            node = stack[-1]
+            if id(node) in memo:
+                stack.pop()
+                continue
+            pending = [ child for child in children(node) if id(child) not in memo ]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            memo[id(node)] = evaluate(node, memo)
+        return memo[id(node)]
+
+# Nodes (and lists) directly underneath node
+def children(node):
+    if isinstance(node, list):
+        return node
+    return [ value for value in (getattr(node, name, None) for name in node._fields)
+             if isinstance(value, (Node, list)) ]
+
+# Value of a closed node given the values of its operands
+def evaluate(node, values):
+    if isinstance(node, Integer):
+        return wrap32(int(node.value))
+    elif isinstance(node, Float):
+        return float(node.value)
+    elif isinstance(node, (Char, Bool)):
+        return node.value
+    elif isinstance(node, Unit):
+        return ()
+    elif isinstance(node, UnaryOp):
+        value = values[id(node.operand)]
+        if value is None:
+            return None
+        return fold_unary(node.op, value)
+    elif isinstance(node, BinOp):
+        left = values[id(node.left)]
+        right = values[id(node.right)]
+        if left is None or right is None:
+            return None
+        return fold_binary(node.op, left, right)
+    return None
+
+def fold_unary(op, value):
+    if op == '-':
+        return wrap32(-value) if type(value) is int else -value
+    elif op == '!':
+        return not value
+    return value
+
+def fold_binary(op, left, right):
+    if op == '&&':
+        return left and right
+    elif op == '||':
+        return left or right
+    elif op == '+':
+        result = left + right
+    elif op == '-':
+        result = left - right
+    elif op == '*':
+        result = left * right
+    elif op == '/':
+        if not right:
+            return None
+        if type(left) is int:
+            return idiv(left, right)
+        return left / right
+    elif op == '<':
+        return left < right
+    elif op == '<=':
+        return left <= right
+    elif op == '>':
+        return left > right
+    elif op == '>=':
+        return left >= right
+    elif op == '==':
+        return left == right
+    elif op == '!=':
+        return left != right
+    else:
+        return None
+    return wrap32(result) if type(result) is int else result
+
+# Sample main program.  Reports how much of a checked program is shared.
+def main(filename):
+    from .parse import parse_file
+    from .typecheck import check_program
+    model = parse_file(filename)
+    total = sum(1 for _ in walk(model))
+    if not check_program(model):
+        raise SystemExit(1)
+    hc = HashCons()
+    model = hc.share(model)
+    unique = len({ id(node) for node in walk(model) })
+    print(f'{total} nodes, {unique} distinct ({hc.hits} shared, {len(hc)} in table)')
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1])
@@ -0,0 +1,199 @@
+# incremental.py
+#
+# Incremental front end for editors and watch loops.
+#
+# When one line of a large program changes, there's no need to
+# tokenize and parse the whole file again.  A program is a sequence of
+# top-level statements (functions, structs, enums, globals, scripting
+# statements).  IncrementalParser remembers the source span of each
+# one along with its model.  On an edit, only the top-level statements
+# that touch the changed text are tokenized and parsed again.
+# Everything else is reused as-is, with offsets (and line numbers, if
+# the number of lines changed) shifted.
+#
+# If the damaged region doesn't parse cleanly on its own--for example,
+# an edit that deletes a closing brace or opens a comment that runs
+# into later code--the whole program is parsed from scratch instead.
+#
+#     parser = IncrementalParser(text)
+#     program = parser.update(new_text)
+#     print(parser.stats)
+#
+# If the edit is already known (as in an editor), edit(start, end,
+# replacement) avoids having to diff the old and new text.
+
+from .model import *
+from .tokenize import tokenize_stream
+from .parse import StreamCursor, parse_statement, expect
+
+# Information kept about each top-level statement
+class Declaration:
+    __slots__ = ('node', 'start', 'end', 'endline', 'nodes', 'located')
+
+    def __init__(self, node, start, end, endline, nodes):
+        self.node = node          # Model of the statement
+        self.start = start        # Source offset of the first token
+        self.end = end            # Source offset just past the last token
+        self.endline = endline    # Line number of the last token
+        self.nodes = nodes        # Number of model nodes
+        self.located = None       # Nodes with a lineno (made on demand)
+
+    # Adjust all line numbers after lines were added or removed above
+    def shift_lines(self, linedelta):
+        if self.located is None:
+            self.located = [node for node in walk(self.node) if hasattr(node, 'lineno')]
+        for node in self.located:
+            node.lineno += linedelta
+        self.endline += linedelta
+
+    def __repr__(self):
+        return f'Declaration({self.node.__class__.__name__}, {self.start}, {self.end})'
+
+# Parse top-level statements from text[start:end], returning a list
+# of Declarations.
+def parse_declarations(text, start=0, end=None, lineno=1):
+    stream = tokenize_stream(text, lineno, start, end)
+    tokens = StreamCursor(stream)
+    declarations = [ ]
+    while tokens.type != 'EOF':
+        first = tokens.n
+        node = parse_statement(tokens)
+        last = tokens.n - 1
+        declarations.append(Declaration(node,
+                                        stream.starts[first],
+                                        stream.ends[last],
+                                        stream.linenos[last],
+                                        sum(1 for _ in walk(node))))
+    expect(tokens, 'EOF')
+    return declarations
+
+# Length of the common prefix of two strings.  Found by binary search
+# on slice comparisons so the character comparisons happen in C.
+def common_prefix(a, b):
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def common_suffix(a, b, limit):
+    lo, hi = 0, min(len(a), len(b), limit)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a)-mid:len(a)-lo] == b[len(b)-mid:len(b)-lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+# Index of the first declaration at or after lo for which test(decl)
+# is true.  Declarations are in source order so a binary search works.
+def search(declarations, lo, test):
+    hi = len(declarations)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if test(declarations[mid]):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+class IncrementalParser:
+    def __init__(self, text):
+        self.declarations = parse_declarations(text)
+        self.text = text
+        self.statements = [decl.node for decl in self.declarations]
+        self.nodes = sum(decl.nodes for decl in self.declarations)
+        self.stats = { 'reused': 0, 'reparsed': len(self.declarations),
+                       'nodes_reused': 0, 'nodes_parsed': self.nodes,
+                       'full': True }
+
+    @property
+    def program(self):
+        return Program(list(self.statements))
+
+    # Replace the entire text.  The edited region is found by comparing
+    # the old and new text.
+    def update(self, text):
+        prefix = common_prefix(self.text, text)
+        suffix = common_suffix(self.text, text, min(len(self.text), len(text)) - prefix)
+        return self.edit(prefix, len(self.text) - suffix, text[prefix:len(text)-suffix])
+
+    # Replace self.text[start:end] with replacement
+    def edit(self, start, end, replacement):
+        old = self.text
+        text = old[:start] + replacement + old[end:]
+        delta = len(replacement) - (end - start)
+        declarations = self.declarations
+
+        # Find the top-level statements touching the damaged region.
+        # Statements that merely touch it are included since the edit
+        # might have joined tokens together.
+        i = search(declarations, 0, lambda decl: decl.end >= start)
+        j = search(declarations, i, lambda decl: decl.start > end)
+
+        # The region to reparse runs between the surrounding undamaged
+        # statements.
+        lo = declarations[i-1].end if i > 0 else 0
+        hi = declarations[j].start if j < len(declarations) else len(old)
+        lineno = declarations[i-1].endline if i > 0 else 1
+        try:
+            new = parse_declarations(text, lo, hi + delta, lineno)
+        except SyntaxError:
+            # Couldn't parse the region by itself. Parse everything.  If
+            # that fails too, the old state is left alone.
+            self.__init__(text)
+            return self.program
+        self.text = text
+
+        # Shift everything after the damaged region
+        linedelta = replacement.count('\n') - old.count('\n', start, end)
+        for n in range(j, len(declarations)):
+            decl = declarations[n]
+            decl.start += delta
+            decl.end += delta
+            if linedelta:
+                decl.shift_lines(linedelta)
+
+        nodes_removed = sum(decl.nodes for decl in declarations[i:j])
+        nodes_parsed = sum(decl.nodes for decl in new)
+        declarations[i:j] = new
+        self.statements[i:j] = [decl.node for decl in new]
+        self.nodes += nodes_parsed - nodes_removed
+        self.stats = { 'reused': len(declarations) - len(new),
+                       'reparsed': len(new),
+                       'nodes_reused': self.nodes - nodes_parsed,
+                       'nodes_parsed': nodes_parsed,
+                       'full': False }
+        return self.program
+
+# Watch a file, reparsing it incrementally whenever it changes
+def main(filename, interval=0.25):
+    import os
+    import time
+    with open(filename) as file:
+        parser = IncrementalParser(file.read())
+    print(f'{filename}: {parser.stats}')
+    mtime = os.path.getmtime(filename)
+    while True:
+        time.sleep(interval)
+        if os.path.getmtime(filename) == mtime:
+            continue
+        mtime = os.path.getmtime(filename)
+        with open(filename) as file:
+            text = file.read()
+        start = time.perf_counter()
+        try:
+            parser.update(text)
+        except SyntaxError as err:
+            print(f'{filename}: {err}')
+            continue
+        elapsed = time.perf_counter() - start
+        print(f'{filename}: {elapsed*1000:.3f}ms {parser.stats}')
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1])
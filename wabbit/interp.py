@@ -43,42 +43,493 @@
 # type_models.py to test programs involving functions and types.
 #
 
+import operator
+
 from .model import *
+from .resolve import resolve_program
+
+# Representation of values:
+#
+#    int    -> Python int (32-bit, wraps around on overflow)
+#    float  -> Python float
+#    char   -> Python str of length 1
+#    bool   -> Python bool
+#    unit   -> () (the empty tuple)
+#    struct -> StructInstance
+#    enum   -> EnumInstance
+#
+# Structures are mutable and are passed around by reference.
+
+class StructInstance:
+    def __init__(self, struct, fields):
+        self.struct = struct
+        self.fields = fields
+
+    def __repr__(self):
+        args = ', '.join(repr(value) for value in self.fields.values())
+        return f'{self.struct}({args})'
+
+class EnumInstance:
+    def __init__(self, enum, choice, value=None):
+        self.enum = enum
+        self.choice = choice
+        self.value = value
+
+    def __repr__(self):
+        value = f'({self.value!r})' if self.value is not None else ''
+        return f'{self.enum}::{self.choice}{value}'
+
+def wrap32(value):
+    return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+# Integer division truncates towards zero (like C)
+def idiv(left, right):
+    quotient = abs(left) // abs(right)
+    return wrap32(-quotient if (left < 0) != (right < 0) else quotient)
+
+def format_value(value):
+    if value is True:
+        return 'true'
+    elif value is False:
+        return 'false'
+    elif value == ():
+        return '()'
+    else:
+        return str(value)
+
+# ---- Specialized operations
+#
+# Once a program has been checked, the types of all operands are known.
+# specialize() picks the function for each operator and type conversion
+# ahead of time and records it as node.operation, so that running the
+# operation doesn't have to test the operator or the types of values.
+# Tables are keyed by (operator, operand type) and (target type, source
+# type).  Nodes whose operand types aren't known (the program wasn't
+# checked) or don't agree (the program has type errors) get None and
+# are run by the generic code.
+
+def add32(left, right):
+    return ((left + right + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+def sub32(left, right):
+    return ((left - right + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+def mul32(left, right):
+    return ((left * right + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+def neg32(value):
+    return ((0x80000000 - value) & 0xFFFFFFFF) - 0x80000000
+
+def same(value):
+    return value
 
-# Top level function that interprets an entire program. It creates the
-# initial environment that's used for storing variables.
+unary_operations = {
+    ('-', 'int'): neg32,
+    ('+', 'int'): same,
+    ('-', 'float'): operator.neg,
+    ('+', 'float'): same,
+    ('!', 'bool'): operator.not_,
+}
 
+binary_operations = {
+    ('+', 'int'): add32,
+    ('-', 'int'): sub32,
+    ('*', 'int'): mul32,
+    ('/', 'int'): idiv,
+    ('+', 'float'): operator.add,
+    ('-', 'float'): operator.sub,
+    ('*', 'float'): operator.mul,
+    ('/', 'float'): operator.truediv,
+}
+relations = { '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+              '==': operator.eq, '!=': operator.ne }
+for optype in ('int', 'float', 'char'):
+    for op, func in relations.items():
+        binary_operations[op, optype] = func
+for optype in ('bool', 'unit'):
+    binary_operations['==', optype] = operator.eq
+    binary_operations['!=', optype] = operator.ne
+
+conversions = {
+    ('int', 'int'): same,
+    ('int', 'float'): lambda value: wrap32(int(value)),
+    ('int', 'char'): ord,
+    ('float', 'float'): same,
+    ('float', 'int'): float,
+    ('char', 'char'): same,
+    ('char', 'int'): lambda value: chr(value & 0xFF),
+}
+
+def specialize(model):
+    for node in walk(model):
+        if isinstance(node, UnaryOp):
+            node.operation = unary_operations.get((node.op, getattr(node.operand, 'type', None)))
+        elif isinstance(node, BinOp):
+            lefttype = getattr(node.left, 'type', None)
+            if lefttype != getattr(node.right, 'type', None):
+                lefttype = None
+            node.operation = binary_operations.get((node.op, lefttype))
+        elif isinstance(node, Call):
+            argtype = getattr(node.arguments[0], 'type', None) if len(node.arguments) == 1 else None
+            node.operation = conversions.get((node.name, argtype))
+    return model
+
+# Control flow (break, continue, return) is implemented with exceptions
+class BreakException(Exception):
+    pass
+
+class ContinueException(Exception):
+    pass
+
+class ReturnException(Exception):
+    def __init__(self, value):
+        self.value = value
+
+# The environment.  Variables are found by the address given to them
+# by name resolution (see resolve.py):  (depth, slot) is
+# env.frames[depth][slot].  frames is the frame (list) of the running
+# function and the global frame.  Top-level code runs in the global
+# frame, so for it, both are the same list.  Functions, structs and
+# enums are kept by name in decls.
+class Environment:
+    __slots__ = ('frames', 'decls')
+
+    def __init__(self, frame, globals, decls):
+        self.frames = (frame, globals)
+        self.decls = decls
+
+# Top level function that interprets an entire program.  Names are
+# resolved and operations specialized first.
 def interpret_program(model):
-    # Make the initial environment (a dict).  The environment is
-    # where you will create and store variables.
-    env = { }
-    return interpret(model, env)
+    resolve_program(model)
+    specialize(model)
+    run_program(model)
 
-# Internal function to interpret a node in the environment.  You need
-# to expand to cover all of the classes in the model.py file. 
+# Run a program that's been resolved and specialized.  Functions,
+# structs and enums are entered first since they may be used before
+# they're defined.  If the program defines main(), it's called after
+# the top-level statements have run.
+def run_program(model):
+    globals = [ None ] * model.size
+    env = Environment(globals, globals, { })
+    interpret(model, env)
+    if isinstance(env.decls.get('main'), Function):
+        call_function(env.decls['main'], [ ], env)
 
+# Run the function for the class of node (see interpreters at the end)
 def interpret(node, env):
-    # Expand to check for different node types
-    if isinstance(node, Integer):
-        return interpret_integer(node, env)
+    return interpreters[type(node)](node, env)
 
-    elif isinstance(node, PrintStatement):
-        return interpret_print_statement(node, env)
+def interpret_list(node, env):
+    for stmt in node:
+        interpret(stmt, env)
+    return None
 
-    else:
-        raise RuntimeError(f"Can't interpret {node}")
+def interpret_unknown(node, env):
+    raise RuntimeError(f"Can't interpret {node}")
+
+# ---- Expressions
 
-# Each node in the model should have some function.  This
-# function should carry out the expected operation for that node.
 def interpret_integer(node, env):
-    return int(node.value)
-    
-def interpret_print_statement(node, env):
+    return wrap32(int(node.value))
+
+def interpret_float(node, env):
+    return float(node.value)
+
+def interpret_char(node, env):
+    return node.value
+
+def interpret_bool(node, env):
+    return node.value
+
+def interpret_unit(node, env):
+    return ()
+
+def interpret_name(node, env):
+    depth, slot = node.address
+    return env.frames[depth][slot]
+
+def interpret_attribute(node, env):
+    return interpret(node.value, env).fields[node.name]
+
+def interpret_unaryop(node, env):
+    operation = node.operation
+    if operation is not None:
+        return operation(interpret(node.operand, env))
+    value = interpret(node.operand, env)
+    if node.op == '-':
+        return wrap32(-value) if isinstance(value, int) else -value
+    elif node.op == '!':
+        return not value
+    else:
+        return value
+
+def interpret_binop(node, env):
+    operation = node.operation
+    if operation is not None:
+        return operation(interpret(node.left, env), interpret(node.right, env))
+
+    # Short-circuit evaluation
+    if node.op == '&&':
+        return interpret(node.left, env) and interpret(node.right, env)
+    elif node.op == '||':
+        return interpret(node.left, env) or interpret(node.right, env)
+
+    left = interpret(node.left, env)
+    right = interpret(node.right, env)
+    if node.op == '+':
+        result = left + right
+    elif node.op == '-':
+        result = left - right
+    elif node.op == '*':
+        result = left * right
+    elif node.op == '/':
+        if isinstance(left, int):
+            return idiv(left, right)
+        return left / right
+    elif node.op == '<':
+        return left < right
+    elif node.op == '<=':
+        return left <= right
+    elif node.op == '>':
+        return left > right
+    elif node.op == '>=':
+        return left >= right
+    elif node.op == '==':
+        return left == right
+    elif node.op == '!=':
+        return left != right
+    else:
+        raise RuntimeError(f'Unsupported operator {node.op}')
+    return wrap32(result) if isinstance(result, int) else result
+
+def interpret_call(node, env):
+    operation = node.operation
+    if operation is not None:
+        return operation(interpret(node.arguments[0], env))
+    args = [ interpret(arg, env) for arg in node.arguments ]
+    if node.name == 'int':
+        return wrap32(ord(args[0]) if isinstance(args[0], str) else int(args[0]))
+    elif node.name == 'float':
+        return float(args[0])
+    elif node.name == 'char':
+        return chr(args[0] & 0xFF) if isinstance(args[0], int) else args[0]
+    elif node.name in ('bool', 'unit'):
+        return args[0]
+
+    decl = env.decls[node.name]
+    if isinstance(decl, Struct):
+        return StructInstance(decl.name, { field.name: arg for field, arg in zip(decl.fields, args) })
+    else:
+        return call_function(decl, args, env)
+
+# Functions run with a new frame.  The parameters are its first slots.
+def call_function(func, args, env):
+    frame = args + [ None ] * (func.size - len(args))
+    fenv = Environment(frame, env.frames[1], env.decls)
+    try:
+        interpret(func.body, fenv)
+    except ReturnException as e:
+        return e.value
+    return ()
+
+def interpret_enumvalue(node, env):
+    value = interpret(node.value, env) if node.value is not None else None
+    return EnumInstance(node.enum, node.choice, value)
+
+def interpret_match(node, env):
     value = interpret(node.value, env)
-    print(value)
-                             
-                             
+    for case in node.cases:
+        if case.choice == value.choice or case.choice == '_':
+            if case.binding is not None:
+                depth, slot = case.address
+                env.frames[depth][slot] = value.value
+            return interpret(case.value, env)
+    raise RuntimeError(f'No match for {value}')
+
+def interpret_compound(node, env):
+    result = ()
+    for stmt in node.statements:
+        result = interpret(stmt, env)
+    if node.statements and isinstance(node.statements[-1], ExprStatement):
+        return result
+    return ()
+
+# ---- Statements
+
+def interpret_print(node, env):
+    value = interpret(node.value, env)
+    if isinstance(value, str):
+        print(value, end='')
+    else:
+        print(format_value(value))
+
+def interpret_assignment(node, env):
+    value = interpret(node.value, env)
+    if isinstance(node.location, Attribute):
+        interpret(node.location.value, env).fields[node.location.name] = value
+    else:
+        depth, slot = node.location.address
+        env.frames[depth][slot] = value
+
+def interpret_variable(node, env):
+    if node.value is not None:
+        value = interpret(node.value, env)
+    else:
+        value = default_value(node.type, env)
+    depth, slot = node.address
+    env.frames[depth][slot] = value
 
-        
-        
-        
+# Initial value of variables declared without a value
+def default_value(typename, env):
+    if typename == 'int':
+        return 0
+    elif typename == 'float':
+        return 0.0
+    elif typename == 'char':
+        return '\x00'
+    elif typename == 'bool':
+        return False
+    elif typename == 'unit':
+        return ()
+    struct = env.decls[typename]
+    return StructInstance(struct.name, { field.name: default_value(field.type, env)
+                                         for field in struct.fields })
+
+def interpret_if(node, env):
+    if interpret(node.test, env):
+        interpret(node.consequence, env)
+    else:
+        interpret(node.alternative, env)
+
+def interpret_while(node, env):
+    while interpret(node.test, env):
+        try:
+            interpret(node.body, env)
+        except BreakException:
+            break
+        except ContinueException:
+            pass
+
+def interpret_break(node, env):
+    raise BreakException()
+
+def interpret_continue(node, env):
+    raise ContinueException()
+
+def interpret_return(node, env):
+    raise ReturnException(interpret(node.value, env))
+
+def interpret_exprstatement(node, env):
+    return interpret(node.expression, env)
+
+# Functions, structs and enums are entered by interpret_program_node()
+def interpret_definition(node, env):
+    return None
+
+def interpret_program_node(node, env):
+    for stmt in node.statements:
+        if isinstance(stmt, (Function, Struct, Enum)):
+            env.decls[stmt.name] = stmt
+    interpret(node.statements, env)
+
+interpreters = Dispatch({
+    list: interpret_list,
+
+    # Expressions
+    Integer: interpret_integer,
+    Float: interpret_float,
+    Char: interpret_char,
+    Bool: interpret_bool,
+    Unit: interpret_unit,
+    Name: interpret_name,
+    Attribute: interpret_attribute,
+    UnaryOp: interpret_unaryop,
+    BinOp: interpret_binop,
+    Call: interpret_call,
+    EnumValue: interpret_enumvalue,
+    Match: interpret_match,
+    Compound: interpret_compound,
+
+    # Statements
+    Print: interpret_print,
+    Assignment: interpret_assignment,
+    (Variable, Const): interpret_variable,
+    If: interpret_if,
+    While: interpret_while,
+    Break: interpret_break,
+    Continue: interpret_continue,
+    Return: interpret_return,
+    ExprStatement: interpret_exprstatement,
+    (Function, Struct, Enum): interpret_definition,
+    Program: interpret_program_node,
+}, default=interpret_unknown)
+
+# ---- Profiling
+#
+# profile_program() runs a program like interpret_program() while a
+# Profiler (see profiler.py) watches.  interpret(), the handlers for
+# statements and blocks in interpreters and call_function() are
+# replaced by the profiler's versions for the run and put back
+# afterwards, so there's no cost when not profiling.  Each statement
+# and block runs one Python call deeper than usual, so deep recursion
+# hits Python's recursion limit sooner.
+def profile_program(model, profiler):
+    global interpreters, call_function, interpret
+    resolve_program(model)
+    specialize(model)
+    plain = interpreters, call_function, interpret
+    interpreters = Dispatch({ cls: profiler.wrap_block(handler) if cls in (list, Compound) else
+                                   handler if issubclass(cls, Expression) else
+                                   profiler.wrap(handler)
+                              for cls, handler in plain[0].items() },
+                            default=plain[0].default)
+    interpret = profiler.wrap_interpret(interpreters)
+    call_function = profiler.wrap_call(plain[1])
+    profiler.start(model)
+    try:
+        run_program(model)
+    finally:
+        profiler.stop()
+        interpreters, call_function, interpret = plain
+    return profiler
+
+# Sample main program.  The program is checked first (so that
+# operations can be specialized).  With closures=True, it's run by the
+# closure compiler (see closures.py) instead.  With stack=True, it's
+# run by the interpreter with an explicit stack (see stackinterp.py),
+# which handles deep recursion.  With profile set to a filename, it's
+# profiled:  a report goes to stderr and collapsed stacks (for flame
+# graphs) to the file.
+def main(filename, closures=False, stack=False, profile=None):
+    from .parse import parse_file
+    from .typecheck import check_program
+    model = parse_file(filename)
+    if not check_program(model):
+        raise SystemExit(1)
+    if profile:
+        import sys
+        from .profiler import Profiler
+        profiler = profile_program(model, Profiler())
+        with open(filename) as file:
+            print(profiler.report(file.read().splitlines()), file=sys.stderr)
+        profiler.write_collapsed(profile)
+    elif closures:
+        from .closures import run_program
+        run_program(model)
+    elif stack:
+        from . import stackinterp
+        stackinterp.interpret_program(model)
+    else:
+        interpret_program(model)
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:2] == ['-closures']:
+        main(sys.argv[2], closures=True)
+    elif sys.argv[1:2] == ['-stack']:
+        main(sys.argv[2], stack=True)
+    elif sys.argv[1:2] == ['-profile']:
+        main(sys.argv[3], profile=sys.argv[2])
+    else:
+        main(sys.argv[1])
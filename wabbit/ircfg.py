@@ -0,0 +1,417 @@
+# ircfg.py
+#
+# Basic blocks, control flow graph and SSA form for IR code (see ircode.py)
+#
+# The code of an IRFunction is a flat list of instructions.  To
+# optimize across labels, build_cfg() splits it into basic blocks.  A
+# block starts at a label (or at the start of the function) and ends
+# with a goto, cbranch or ret.  The operand stack is empty at every
+# label, so values only pass from one block to another in variables.
+#
+#     cfg = build_cfg(func)
+#     cfg.blocks                 # BasicBlocks in code order, entry first
+#     cfg.block[label]           # BasicBlock by label (the first is 'entry')
+#     block.code                 # Instructions (not the label).  The last one is
+#                                # a goto, cbranch or ret
+#     block.preds, block.succs   # Labels of the blocks before and after
+#
+# Blocks that can't be reached from the entry are left out.
+#
+# Dominators
+# ----------
+# Block A dominates block B if every path from the entry to B goes
+# through A.  build_cfg() finds the immediate dominator of every block
+# (cfg.idom[label]) and with it the dominator tree (block.children)
+# using "A Simple, Fast Dominance Algorithm" by Cooper, Harvey and
+# Kennedy.  cfg.order is the blocks in reverse postorder, so a block
+# comes after its dominators.  dominance_frontiers() gives, for each
+# block, the blocks where its dominance stops.  That's where SSA form
+# needs phi nodes.
+#
+# SSA form
+# --------
+# to_ssa() renames the local variables so that each one is stored
+# exactly once.  A value in SSA form is a string '%n' and
+# cfg.values[value] is the slot of the local it came from.  Loads and
+# stores take a value instead of a slot:
+#
+#     ('i32.const', 1)              ('i32.const', 1)
+#     ('local.store', 2)            ('local.store', '%5')
+#     ('local.load', 2)    ---->    ('local.load', '%5')
+#
+# Every local starts with a value of its own, cfg.initial[slot] (the
+# argument for parameters, zero otherwise).  Where different values of
+# a local meet, the block starts with a phi node (block.phis) that picks
+# the value according to the block that came before:
+#
+#     Phi('%9', { 'L3': '%5', 'L7': '%8' })
+#
+# Phi nodes are only placed where the local is used afterwards.
+# Globals are left alone since a call may change them.
+#
+# from_ssa() turns the graph back into code for the backends, which
+# all want a stack machine with slots.  Each value is given a slot,
+# the one it came from unless another value living at the same time
+# already has it.  Then another slot of the same type is used, or a new
+# one.  A phi node becomes copies at the end of the blocks before it.
+# All values are loaded onto the stack before any is stored, so the
+# copies of all phi nodes happen at once.  If the block before ends with
+# a cbranch, the copies go in a new block between the two.
+#
+#     cfg = to_ssa(build_cfg(func))
+#     ...                               # Optimize
+#     from_ssa(cfg)                     # Replaces func.code
+#
+# Code made by from_ssa() keeps the rules of ircode.py.  Going there
+# and back without changes leaves out unreachable code, but otherwise
+# gives the code it started from.  Code with superinstructions (made
+# last of all by iropt.py) can't be put in SSA form.
+
+entry = 'entry'
+
+terminators = { 'goto', 'cbranch', 'ret' }
+
+class BasicBlock:
+    __slots__ = ('label', 'phis', 'code', 'preds', 'succs', 'children')
+
+    def __init__(self, label):
+        self.label = label
+        self.phis = [ ]
+        self.code = [ ]
+        self.preds = [ ]
+        self.succs = [ ]
+        self.children = [ ]        # Labels of the blocks it immediately dominates
+
+    def __repr__(self):
+        return f'BasicBlock({self.label!r})'
+
+class Phi:
+    __slots__ = ('value', 'args')
+
+    def __init__(self, value, args):
+        self.value = value
+        self.args = args           # Maps the label of each block before to a value
+
+    def __repr__(self):
+        return f'Phi({self.value!r}, {self.args!r})'
+
+class ControlFlowGraph:
+    def __init__(self, func):
+        self.func = func
+        self.blocks = [ ]
+        self.block = { }
+        self.order = [ ]
+        self.idom = { }
+        self.values = None         # SSA value -> slot (in SSA form only)
+        self.initial = None        # Initial value of each slot (in SSA form only)
+
+    def add_block(self, label):
+        block = self.block[label] = BasicBlock(label)
+        self.blocks.append(block)
+        return block
+
+    def new_value(self, slot):
+        value = f'%{len(self.values)}'
+        self.values[value] = slot
+        return value
+
+    # Does block a dominate block b?
+    def dominates(self, a, b):
+        while b != a:
+            if b == entry:
+                return False
+            b = self.idom[b]
+        return True
+
+    def dump(self):
+        print(f':::: CFG {self.func.name}')
+        for block in self.blocks:
+            print(f'  {block.label}:  preds={block.preds} idom={self.idom.get(block.label)} '
+                  f'children={block.children}')
+            for phi in block.phis:
+                args = ', '.join(f'{label}: {value}' for label, value in phi.args.items())
+                print(f'     {phi.value} = phi({args})')
+            for instr in block.code:
+                print('    ', instr)
+
+def successors(instr):
+    if instr[0] == 'goto':
+        return [ instr[1] ]
+    elif instr[0] == 'cbranch':
+        return list(dict.fromkeys(instr[1:]))
+    return [ ]
+
+def build_cfg(func):
+    cfg = ControlFlowGraph(func)
+    blocks = [ BasicBlock(entry) ]
+    for instr in func.code:
+        if instr[0] == 'label':
+            blocks.append(BasicBlock(instr[1]))
+        elif not blocks[-1].code or blocks[-1].code[-1][0] not in terminators:
+            blocks[-1].code.append(instr)
+        # Anything else follows a terminator and is never run
+    for block, after in zip(blocks, blocks[1:]):
+        if not block.code or block.code[-1][0] not in terminators:
+            block.code.append(('goto', after.label))
+    labels = { block.label: block for block in blocks }
+
+    # Keep the blocks that can be reached from the entry.  Their
+    # postorder is found on the way.
+    postorder = [ ]
+    seen = { entry }
+    stack = [ (entry, iter(successors(blocks[0].code[-1]))) ]
+    while stack:
+        label, succs = stack[-1]
+        for succ in succs:
+            if succ not in seen:
+                seen.add(succ)
+                stack.append((succ, iter(successors(labels[succ].code[-1]))))
+                break
+        else:
+            postorder.append(label)
+            stack.pop()
+
+    for block in blocks:
+        if block.label in seen:
+            cfg.blocks.append(block)
+            cfg.block[block.label] = block
+    for block in cfg.blocks:
+        block.succs = successors(block.code[-1])
+        for succ in block.succs:
+            cfg.block[succ].preds.append(block.label)
+    cfg.order = postorder[::-1]
+    find_dominators(cfg)
+    return cfg
+
+# Immediate dominators (Cooper, Harvey and Kennedy).  Blocks are
+# numbered in reverse postorder.  The dominators of a block are found
+# by walking up the dominator tree from each of its predecessors until
+# the paths meet, repeating until nothing changes.
+def find_dominators(cfg):
+    number = { label: n for n, label in enumerate(cfg.order) }
+    idom = { entry: entry }
+    changed = True
+    while changed:
+        changed = False
+        for label in cfg.order[1:]:
+            new = None
+            for pred in cfg.block[label].preds:
+                if pred not in idom:
+                    continue
+                if new is None:
+                    new = pred
+                    continue
+                other = pred
+                while other != new:
+                    while number[other] > number[new]:
+                        other = idom[other]
+                    while number[new] > number[other]:
+                        new = idom[new]
+            if idom.get(label) != new:
+                idom[label] = new
+                changed = True
+    cfg.idom = idom
+    for block in cfg.blocks:
+        block.children = [ ]
+    for label in cfg.order[1:]:
+        cfg.block[idom[label]].children.append(label)
+    return idom
+
+def dominance_frontiers(cfg):
+    frontiers = { block.label: set() for block in cfg.blocks }
+    for block in cfg.blocks:
+        if len(block.preds) > 1:
+            for pred in block.preds:
+                runner = pred
+                while runner != cfg.idom[block.label]:
+                    frontiers[runner].add(block.label)
+                    runner = cfg.idom[runner]
+    return frontiers
+
+# Liveness of the locals (slots, or values in SSA form).  Returns
+# (live_in, live_out) by label.  The arguments of a phi node are live at
+# the end of the blocks they come from, not at the start of the block
+# with the phi node.
+def find_liveness(cfg):
+    uses = { }
+    defs = { }
+    for block in cfg.blocks:
+        used = set()
+        defined = { phi.value for phi in block.phis }
+        for instr in block.code:
+            if instr[0] == 'local.load' and instr[1] not in defined:
+                used.add(instr[1])
+            elif instr[0] == 'local.store':
+                defined.add(instr[1])
+        uses[block.label] = used
+        defs[block.label] = defined
+    live_in = { block.label: set() for block in cfg.blocks }
+    live_out = { block.label: set() for block in cfg.blocks }
+    changed = True
+    while changed:
+        changed = False
+        for label in reversed(cfg.order):
+            out = set()
+            for succ in cfg.block[label].succs:
+                out |= live_in[succ]
+                out.update(phi.args[label] for phi in cfg.block[succ].phis)
+            live = uses[label] | (out - defs[label])
+            if live != live_in[label] or out != live_out[label]:
+                live_in[label] = live
+                live_out[label] = out
+                changed = True
+    return live_in, live_out
+
+def to_ssa(cfg):
+    func = cfg.func
+    cfg.values = { }
+    cfg.initial = [ cfg.new_value(slot) for slot in range(len(func.locals)) ]
+
+    # Place phi nodes at the dominance frontiers of the blocks storing
+    # each local (and the frontiers of those), where it's live
+    live_in, live_out = find_liveness(cfg)
+    frontiers = dominance_frontiers(cfg)
+    stores = [ set() for _ in func.locals ]
+    for block in cfg.blocks:
+        for instr in block.code:
+            if instr[0] == 'local.store':
+                stores[instr[1]].add(block.label)
+    for slot, labels in enumerate(stores):
+        work = list(labels)
+        placed = set()
+        while work:
+            for label in frontiers[work.pop()]:
+                if label not in placed and slot in live_in[label]:
+                    placed.add(label)
+                    cfg.block[label].phis.append(Phi(cfg.new_value(slot), { }))
+                    work.append(label)
+
+    # Rename walking down the dominator tree.  stacks[slot] holds the
+    # values of each local, the current one last.  Each entry of work
+    # is (label, None) to rename a block or (None, slots) to pop the
+    # values it pushed afterwards.
+    stacks = [ [ value ] for value in cfg.initial ]
+    work = [ (entry, None) ]
+    while work:
+        label, pushed = work.pop()
+        if label is None:
+            for slot in pushed:
+                stacks[slot].pop()
+            continue
+        block = cfg.block[label]
+        pushed = [ ]
+        for phi in block.phis:
+            slot = cfg.values[phi.value]
+            stacks[slot].append(phi.value)
+            pushed.append(slot)
+        for n, instr in enumerate(block.code):
+            if instr[0] == 'local.load':
+                block.code[n] = ('local.load', stacks[instr[1]][-1])
+            elif instr[0] == 'local.store':
+                value = cfg.new_value(instr[1])
+                stacks[instr[1]].append(value)
+                pushed.append(instr[1])
+                block.code[n] = ('local.store', value)
+        for succ in block.succs:
+            for phi in cfg.block[succ].phis:
+                phi.args[label] = stacks[cfg.values[phi.value]][-1]
+        work.append((None, pushed))
+        work.extend((child, None) for child in reversed(block.children))
+    return cfg
+
+# Values that are live at the same time (they can't share a slot).
+# Returns a set of neighbours for each value.
+def find_interference(cfg):
+    live_in, live_out = find_liveness(cfg)
+    graph = { value: set() for value in cfg.values }
+    for block in cfg.blocks:
+        live = set(live_out[block.label])
+        for instr in reversed(block.code):
+            if instr[0] == 'local.store':
+                live.discard(instr[1])
+                for other in live:
+                    graph[instr[1]].add(other)
+                    graph[other].add(instr[1])
+            elif instr[0] == 'local.load':
+                live.add(instr[1])
+        # Phi nodes are all defined at once at the start of the block
+        defined = [ phi.value for phi in block.phis ]
+        live.update(defined)
+        for value in defined:
+            for other in live:
+                if other != value:
+                    graph[value].add(other)
+                    graph[other].add(value)
+    return graph
+
+# Give each value a slot.  Initial values keep theirs.  Others get the
+# slot they came from, or else a slot of the same type that no value
+# living at the same time has.
+def assign_slots(cfg):
+    func = cfg.func
+    graph = find_interference(cfg)
+    slots = { value: slot for slot, value in enumerate(cfg.initial) }
+    for value, origin in cfg.values.items():
+        if value in slots:
+            continue
+        taken = { slots[other] for other in graph[value] if other in slots }
+        irtype = func.locals[origin][1]
+        if origin not in taken:
+            slots[value] = origin
+            continue
+        for slot, (name, ty) in enumerate(func.locals):
+            if ty == irtype and slot not in taken:
+                slots[value] = slot
+                break
+        else:
+            slots[value] = func.alloc_local(f'${len(func.locals)}', irtype)
+    return slots
+
+def from_ssa(cfg):
+    slots = assign_slots(cfg)
+
+    # Copies for the phi nodes of block label coming from block pred
+    def copies(label, pred):
+        moves = [ (slots[phi.args[pred]], slots[phi.value]) for phi in cfg.block[label].phis ]
+        moves = [ (source, dest) for source, dest in moves if source != dest ]
+        return ([ ('local.load', source) for source, dest in moves ] +
+                [ ('local.store', dest) for source, dest in reversed(moves) ])
+
+    code = [ ]
+    edges = [ ]
+    for block in cfg.blocks:
+        if block.label != entry:
+            code.append(('label', block.label))
+        for instr in block.code[:-1]:
+            if instr[0] in ('local.load', 'local.store'):
+                instr = (instr[0], slots[instr[1]])
+            code.append(instr)
+        last = block.code[-1]
+        if last[0] == 'goto':
+            code.extend(copies(last[1], block.label))
+        elif last[0] == 'cbranch':
+            targets = { }
+            for label in successors(last):
+                moves = copies(label, block.label)
+                if moves:
+                    targets[label] = f'{block.label}.{label}'
+                    edges.append(('label', targets[label]))
+                    edges.extend(moves)
+                    edges.append(('goto', label))
+            last = ('cbranch', targets.get(last[1], last[1]), targets.get(last[2], last[2]))
+        code.append(last)
+    cfg.func.code = code + edges
+    return cfg.func
+
+# Sample main program.  Shows the SSA form of each function of the
+# program after the usual optimizations.
+def main(filename):
+    from .compile import compile_file, pipelines
+
+    module = compile_file(filename, pipelines['run'][:-1])
+    for func in module.functions:
+        to_ssa(build_cfg(func)).dump()
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1])
@@ -218,16 +218,94 @@
 #
 # -----------------------------------------------------------------------------
 
+from collections import ChainMap
 from .model import *
 
-# Mapping of Wabbit types to IR datatypes
+# Mapping of Wabbit types to IR datatypes.  The unit type has only
+# one possible value, but it is still carried around as an i32 (0) so
+# that every expression produces exactly one value.
 typemap = {
     'int': 'i32',
     'float': 'f64',
     'char': 'i8',
     'bool': 'i1',
+    'unit': 'i32',
     }
 
+# Runtime functions used to print each type of value
+printfuncs = {
+    'int': '_printi',
+    'float': '_printf',
+    'char': '_printc',
+    'bool': '_printb',
+    'unit': '_printu',
+    }
+
+# Instructions needed for type conversions.  Maps (target, source) to
+# a list of instructions.
+conversions = {
+    ('int', 'int'): [ ],
+    ('int', 'float'): [ ('f64.to_i32',) ],
+    ('int', 'char'): [ ('i8.to_i32',) ],
+    ('float', 'float'): [ ],
+    ('float', 'int'): [ ('i32.to_f64',) ],
+    ('char', 'char'): [ ],
+    ('char', 'int'): [ ('i32.to_i8',) ],
+    }
+
+# Instruction names for the binary operators
+binary_ops = {
+    '+': 'add',
+    '-': 'sub',
+    '*': 'mul',
+    '/': 'div',
+    '<': 'lt',
+    '<=': 'le',
+    '>': 'gt',
+    '>=': 'ge',
+    '==': 'eq',
+    '!=': 'ne',
+    }
+
+# Summary of the instruction set.  The IR is a stack machine.  Every
+# expression pushes exactly one value.
+#
+#     ('i32.const', value)     ('f64.const', value)
+#     ('i8.const', value)      ('i1.const', value)
+#     ('{ty}.add',)  ('{ty}.sub',)  ('{ty}.mul',)  ('{ty}.div',)    ty: i32, f64
+#     ('{ty}.neg',)                                                 ty: i32, f64
+#     ('i32.shl',)                              # Shift left (see iropt.py)
+#     ('{ty}.lt',) ('{ty}.le',) ('{ty}.gt',) ('{ty}.ge',)           ty: i32, f64, i8
+#     ('{ty}.eq',) ('{ty}.ne',)                                     ty: i32, f64, i8, i1
+#     ('i1.not',)
+#     ('i32.to_f64',) ('f64.to_i32',) ('i8.to_i32',) ('i32.to_i8',)
+#     ('local.load', slot)     ('local.store', slot)
+#     ('global.load', slot)    ('global.store', slot)
+#     ('drop',)                                 # Discard top of stack
+#     ('label', name)
+#     ('goto', name)
+#     ('cbranch', truelabel, falselabel)        # Pops an i1 test
+#     ('call', funcname)                        # Pops arguments, pushes result
+#     ('call_ext', funcname)                    # Runtime function. Pops one argument
+#     ('ret',)                                  # Pops return value
+#
+# The peephole optimizer (iropt.py) also makes superinstructions.  op
+# is the name of one of the binary instructions above (for cbranch.op
+# and cbranch.op_const, a comparison):
+#
+#     ('local.tee', slot)                       # local.store, local.load
+#     ('op.const', op, value)                   # const, op
+#     ('op.local_const', op, slot, value)       # local.load, const, op
+#     ('cbranch.op', op, truelabel, falselabel)                 # op, cbranch
+#     ('cbranch.op_const', op, value, truelabel, falselabel)    # const, op, cbranch
+#
+# Control flow is kept simple for the benefit of backends:  the operand
+# stack is always empty at a label and every label is preceded by
+# a goto, cbranch (of any kind) or ret.  Integer arithmetic wraps around at 32 bits
+# and division truncates towards zero.
+#
+# Structures and enums are not supported by the IR.
+
 # IRModule is a container for everything that gets created
 class IRModule:
     def __init__(self):
@@ -267,7 +345,8 @@ class IRFunction:
         self.rettype = rettype
         self.index = index
 
-        # Local variables.  Should record names and types
+        # Local variables.  Should record names and types.  The
+        # function arguments occupy the first slots.
         self.locals = [ ]
 
         # Generated code
@@ -296,47 +375,328 @@ class IRFunction:
 # includes information about the current module, function,
 # and environment.  The environment is used to track variable
 # names much like the interpreter and type-checker projects.
+# Each name maps to a tuple (scope, slot, irtype) where scope is
+# 'global' or 'local'.  If names have been resolved (see resolve.py),
+# the same tuples are also kept in frames by address, and names are
+# looked up there instead.  frames is (frame of the function, global
+# frame), or None for code that hasn't been resolved.
 
 class IRContext:
     def __init__(self, module):
         self.module = module
-        self.current = self.module.new_function('_init', [], 'i32')
-        self.env = ChainMap()
+        self.init = self.current = self.module.new_function('_init', [], 'i32')
+        self.globals = ChainMap()
+        self.env = self.globals
+        self.frames = None
+        self.loops = [ ]
+        self.has_main = False
         self.n = 0
 
     def new_label(self):
         self.n += 1
         return f'L{self.n}'
 
+    def new_temp(self, irtype):
+        return self.current.alloc_local(f'${len(self.current.locals)}', irtype)
+
     def append(self, instruction):
         # Append a new instruction to the current instruction
         self.current.append(instruction)
 
-# Top level function for generating IR from the model.
+    # Variables declared in the outermost scope of _init() are globals.
+    # Everything else is local to the current function.
+    def declare(self, name, type, address=None):
+        irtype = typemap[type]
+        if self.env is self.globals:
+            entry = ('global', self.module.alloc_global(name, irtype), irtype)
+        else:
+            entry = ('local', self.current.alloc_local(name, irtype), irtype)
+        self.env[name] = entry
+        if address is not None and self.frames is not None:
+            self.frames[address[0]][address[1]] = entry
+        return entry
+
+    def lookup(self, node):
+        address = getattr(node, 'address', None)
+        if address is not None and self.frames is not None:
+            return self.frames[address[0]][address[1]]
+        return self.env[node.name]
+
+# Top level function for generating IR from the model.  Top-level
+# statements are generated into _init() first so that all globals are
+# known by the time function bodies (which may use them) are generated.
 def generate_ircode(model):
     module = IRModule()
     context = IRContext(module)
-    generate(model, context)
+    if getattr(model, 'size', None) is not None:
+        globals = [ None ] * model.size
+        context.frames = (globals, globals)
+    for stmt in model.statements:
+        if not isinstance(stmt, (Function, Struct, Enum)):
+            generate(stmt, context)
+    for stmt in model.statements:
+        if isinstance(stmt, Function):
+            generate_function(stmt, context)
+    finish_module(context)
+    return module
+
+# Terminate the _init function.  If the program has no main(), create
+# one that runs _init().  Returns the new main() (if any).
+def finish_module(context):
+    context.init.append(('i32.const', 0))
+    context.init.append(('ret',))
+    if not context.has_main:
+        func = context.module.new_function('main', [], 'i32')
+        func.code.extend([ ('call', '_init'), ('drop',), ('i32.const', 0), ('ret',) ])
+        return func
 
-    # Note: You might have to terminate the _init function
+# Internal function for creating instructions.  Runs the function for
+# the class of node (see generators at the end).
+def generate(node, context):
+    generators[type(node)](node, context)
+
+def generate_list(node, context):
+    for stmt in node:
+        generate(stmt, context)
+
+def generate_unknown(node, context):
+    raise RuntimeError(f"Can't generate code for {node}")
+
+# Does evaluating an expression involve labels?  If so, values that
+# were already pushed have to be saved in temporaries first.
+def has_control(node):
+    return any(isinstance(child, (If, While, Match, Break, Continue, Return))
+               or (isinstance(child, BinOp) and child.op in ('&&', '||'))
+               for child in walk(node))
+
+def generate_values(nodes, context):
+    if any(has_control(node) for node in nodes[1:]):
+        temps = [ ]
+        for node in nodes:
+            generate(node, context)
+            temps.append(context.new_temp(typemap[node.type]))
+            context.append(('local.store', temps[-1]))
+        for temp in temps:
+            context.append(('local.load', temp))
+    else:
+        for node in nodes:
+            generate(node, context)
+
+def generate_integer(node, context):
+    context.append(('i32.const', int(node.value)))
+
+def generate_float(node, context):
+    context.append(('f64.const', float(node.value)))
+
+def generate_char(node, context):
+    context.append(('i8.const', ord(node.value)))
+
+def generate_bool(node, context):
+    context.append(('i1.const', int(node.value)))
+
+def generate_unit(node, context):
     context.append(('i32.const', 0))
-    context.append(('ret',))
 
-    # You might have to create a main() function if none exists.
-    ...
-    
-    # Return the final IRModule.  It will contain all of the generated code.
-    return module
+def generate_name(node, context):
+    scope, slot, irtype = context.lookup(node)
+    context.append((f'{scope}.load', slot))
 
-# Internal function for creating instructions
-def generate(node, context):
-    if isinstance(node, Integer):
-        context.current.append(('i32.const', int(node.value)))
+def generate_unaryop(node, context):
+    generate(node.operand, context)
+    if node.op == '-':
+        context.append((f'{typemap[node.type]}.neg',))
+    elif node.op == '!':
+        context.append(('i1.not',))
 
-    elif isinstance(node, Float):
-        context.current.append(('f64.const', float(node.value)))
+def generate_binop(node, context):
+    if node.op in ('&&', '||'):
+        generate_shortcircuit(node, context)
+        return
+    generate_values([node.left, node.right], context)
+    context.append((f'{typemap[node.left.type]}.{binary_ops[node.op]}',))
 
-    # ... more nodes follow
+# Short-circuit evaluation.  The result is put in a temporary since
+# the operand stack must be empty at labels.
+def generate_shortcircuit(node, context):
+    result = context.new_temp('i1')
+    rlabel = context.new_label()
+    slabel = context.new_label()
+    done = context.new_label()
+    generate(node.left, context)
+    if node.op == '&&':
+        context.append(('cbranch', rlabel, slabel))
+    else:
+        context.append(('cbranch', slabel, rlabel))
+    context.append(('label', rlabel))
+    generate(node.right, context)
+    context.append(('local.store', result))
+    context.append(('goto', done))
+    context.append(('label', slabel))
+    context.append(('i1.const', int(node.op == '||')))
+    context.append(('local.store', result))
+    context.append(('goto', done))
+    context.append(('label', done))
+    context.append(('local.load', result))
 
+def generate_call(node, context):
+    generate_values(node.arguments, context)
+    if node.name in typemap:
+        for instr in conversions[node.name, node.arguments[0].type]:
+            context.append(instr)
     else:
-        RuntimeError(f"Can't generate code for {node}")
+        context.append(('call', node.name))
+
+def generate_compound(node, context):
+    context.env = context.env.new_child()
+    generate(node.statements[:-1], context)
+    last = node.statements[-1] if node.statements else None
+    if isinstance(last, ExprStatement):
+        generate(last.expression, context)
+    else:
+        generate(last or [ ], context)
+        context.append(('i32.const', 0))
+    context.env = context.env.parents
+
+def generate_print(node, context):
+    generate(node.value, context)
+    context.append(('call_ext', printfuncs[node.value.type]))
+
+def generate_assignment(node, context):
+    if not isinstance(node.location, Name):
+        raise RuntimeError(f"Can't generate code for {node}")
+    generate(node.value, context)
+    scope, slot, irtype = context.lookup(node.location)
+    context.append((f'{scope}.store', slot))
+
+# Variables always get initialized.  Without a value, this is zero
+# (a variable declared in a loop is new on each iteration).
+def generate_variable(node, context):
+    if node.type not in typemap:
+        raise RuntimeError(f"Can't generate code for {node}")
+    if node.value is not None:
+        generate(node.value, context)
+    else:
+        context.append((f'{typemap[node.type]}.const', 0))
+    scope, slot, irtype = context.declare(node.name, node.type, getattr(node, 'address', None))
+    context.append((f'{scope}.store', slot))
+
+def generate_if(node, context):
+    then = context.new_label()
+    otherwise = context.new_label()
+    done = context.new_label()
+    generate(node.test, context)
+    context.append(('cbranch', then, otherwise))
+    context.append(('label', then))
+    generate_block(node.consequence, context)
+    context.append(('goto', done))
+    context.append(('label', otherwise))
+    generate_block(node.alternative, context)
+    context.append(('goto', done))
+    context.append(('label', done))
+
+def generate_while(node, context):
+    test = context.new_label()
+    body = context.new_label()
+    done = context.new_label()
+    context.append(('goto', test))
+    context.append(('label', test))
+    generate(node.test, context)
+    context.append(('cbranch', body, done))
+    context.append(('label', body))
+    context.loops.append((test, done))
+    generate_block(node.body, context)
+    context.loops.pop()
+    context.append(('goto', test))
+    context.append(('label', done))
+
+def generate_break(node, context):
+    context.append(('goto', context.loops[-1][1]))
+    context.append(('label', context.new_label()))
+
+def generate_continue(node, context):
+    context.append(('goto', context.loops[-1][0]))
+    context.append(('label', context.new_label()))
+
+def generate_return(node, context):
+    generate(node.value, context)
+    context.append(('ret',))
+    context.append(('label', context.new_label()))
+
+def generate_exprstatement(node, context):
+    generate(node.expression, context)
+    context.append(('drop',))
+
+def generate_block(statements, context):
+    context.env = context.env.new_child()
+    generate(statements, context)
+    context.env = context.env.parents
+
+# Functions get their own IRFunction.  Parameters occupy the first
+# local slots.  A final return is always added so that control can't
+# fall off the end (it's unreachable if the body always returns).
+def generate_function(node, context):
+    argtypes = [ typemap.get(param.type) for param in node.parameters ]
+    if None in argtypes or node.rettype not in typemap:
+        raise RuntimeError(f"Can't generate code for {node.name}()")
+    func = context.module.new_function(node.name, argtypes, typemap[node.rettype])
+    saved = context.current, context.env, context.frames
+    context.current = func
+    context.env = context.globals.new_child()
+    if context.frames is not None and getattr(node, 'size', None) is not None:
+        context.frames = ([ None ] * node.size, context.frames[1])
+    else:
+        context.frames = None
+    for param, argtype in zip(node.parameters, argtypes):
+        context.declare(param.name, param.type, getattr(param, 'address', None))
+    if node.name == 'main':
+        # A user-supplied main() runs _init() first
+        context.has_main = True
+        func.append(('call', '_init'))
+        func.append(('drop',))
+    generate(node.body, context)
+    context.append((f'{func.rettype}.const', 0))
+    context.append(('ret',))
+    context.current, context.env, context.frames = saved
+    return func
+
+generators = Dispatch({
+    list: generate_list,
+
+    # Expressions
+    Integer: generate_integer,
+    Float: generate_float,
+    Char: generate_char,
+    Bool: generate_bool,
+    Unit: generate_unit,
+    Name: generate_name,
+    UnaryOp: generate_unaryop,
+    BinOp: generate_binop,
+    Call: generate_call,
+    Compound: generate_compound,
+
+    # Statements
+    Print: generate_print,
+    Assignment: generate_assignment,
+    (Variable, Const): generate_variable,
+    If: generate_if,
+    While: generate_while,
+    Break: generate_break,
+    Continue: generate_continue,
+    Return: generate_return,
+    ExprStatement: generate_exprstatement,
+    Function: generate_function,
+}, default=generate_unknown)
+
+# Sample main program
+def main(filename):
+    from .parse import parse_file
+    from .typecheck import check_program
+    model = parse_file(filename)
+    if not check_program(model):
+        raise SystemExit(1)
+    module = generate_ircode(model)
+    module.dump()
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1])
@@ -0,0 +1,537 @@
+# iropt.py
+#
+# Optimizations on IR code (see ircode.py)
+#
+# These work on the instructions of IRFunctions after generate_ircode()
+# and before a backend (irrun.py, llvm.py, wasm.py) gets them.  Value
+# numbering and dead value removal work on the SSA form of a function
+# (see ircfg.py).
+#
+#     module = generate_ircode(model)
+#     optimize_ircode(module)
+#
+# Value numbering
+# ---------------
+# Every value computed by the code is given a number, so that values
+# that are known to be the same get the same number:  the same
+# operation applied to values with the same numbers (either order for
+# add, mul, eq and ne), a load of a local stored with a value and a
+# load of a global since it was last stored or a call made.  The
+# operand stack is followed along the code of each block to number
+# what's on it.  Blocks are numbered walking down the dominator tree,
+# so a value computed in one block is known in the blocks it dominates.
+#
+# A calculation whose value has been computed before is replaced by a
+# load of a local holding it:
+#
+#     ('local.load', '%1')
+#     ('local.load', '%1')
+#     ('f64.mul',)                  ---->    ('local.load', '%3')
+#     ('local.load', '%2')
+#     ('f64.add',)
+#
+# If the value was stored in a local, that local is used.  Otherwise, a
+# new local is stored where the value was first computed, if what it
+# saves is more than the store and load this takes.  Loads of a global
+# that is known to hold the value are replaced as well and so are loads
+# of a local that's a copy of another.  At a block where paths meet, a
+# global keeps its number only if no path from the immediate dominator
+# stores it or calls a function.
+#
+# Dead values
+# -----------
+# A value that's stored but never loaded again (after value numbering
+# this is often the case for copies) is dropped along with whatever
+# computed it, unless that has an effect.  Phi nodes for such values go
+# as well.  Integer division is kept since it can trap.
+#
+# Strength reduction
+# ------------------
+# An integer multiplication by a power of two is turned into a shift:
+#
+#     ('i32.const', 8)              ('i32.const', 3)
+#     ('i32.mul',)        ---->     ('i32.shl',)
+#
+# The result is the same, wraparound included.  transform() puts the
+# literal of "8 * x" on the right, so that is caught too.  Division by
+# a power of two is left alone.  Division truncates towards zero, so a
+# shift would need a correction for negative numbers, making it longer
+# than the i32.div it replaces (LLVM does that itself anyway).
+#
+# Peephole optimization and superinstructions
+# -------------------------------------------
+# Last, short runs of instructions are rewritten using the table of
+# rules at the end.  Some runs are just wasted effort (a local loaded
+# and stored back, a constant pushed and dropped, adding 0, branching
+# on a constant) and go away.  Others are fused into superinstructions
+# that do the work of several instructions at once.  Each one carries
+# the binary instruction it stands for (see the summary in ircode.py):
+#
+#     ('local.store', 2)
+#     ('local.load', 2)             ('local.tee', 2)
+#
+#     ('local.load', 0)
+#     ('i32.const', 1)     ---->    ('op.local_const', 'i32.add', 0, 1)
+#     ('i32.add',)
+#
+#     ('f64.const', 4.0)
+#     ('f64.gt',)          ---->    ('cbranch.op_const', 'f64.gt', 4.0, 'L10', 'L11')
+#     ('cbranch', 'L10', 'L11')
+#
+# The IR machine (irrun.py) runs each with a single dispatch.  wasm.py
+# has local.tee built in.  Otherwise, llvm.py and wasm.py turn them
+# back into what they stand for (see expand()).  Jumps to a block that
+# only jumps on are sent straight to where it goes, and blocks nothing
+# jumps to any more are removed.
+
+from .ircfg import build_cfg, to_ssa, from_ssa
+
+def optimize_ircode(module):
+    for func in module.functions:
+        optimize_function(func)
+    return module
+
+def optimize_function(func):
+    cfg = to_ssa(build_cfg(func))
+    ValueNumbering(cfg).run()
+    remove_dead_values(cfg)
+    from_ssa(cfg)
+    reduce_strength(func.code)
+    peephole(func.code)
+    return func
+
+# Instructions that compute a value from what they pop, and nothing else
+unary_names = { 'neg', 'not', 'to_f64', 'to_i32', 'to_i8' }
+binary_names = { 'add', 'sub', 'mul', 'div', 'shl', 'lt', 'le', 'gt', 'ge', 'eq', 'ne' }
+commutative = { 'add', 'mul', 'eq', 'ne' }
+relations = { 'lt', 'le', 'gt', 'ge', 'eq', 'ne', 'not' }
+
+# Number of values popped by an instruction that only pushes a value
+# computed from them (None for any other instruction)
+def operands(op):
+    ty, _, name = op.partition('.')
+    if name == 'const' or op in ('local.load', 'global.load'):
+        return 0
+    elif name in unary_names:
+        return 1
+    elif name in binary_names:
+        return 2
+    return None
+
+# IR type of the value pushed by such an instruction
+def result_type(cfg, instr):
+    ty, _, name = instr[0].partition('.')
+    if instr[0] == 'local.load':
+        return cfg.func.locals[cfg.values[instr[1]]][1]
+    elif instr[0] == 'global.load':
+        return cfg.func.module.globals[instr[1]][1]
+    elif name in relations:
+        return 'i1'
+    elif name.startswith('to_'):
+        return name[3:]
+    return ty
+
+# A value that is known at some point in the code.  value is the local
+# holding it (None if none does yet).  label and end give the
+# instruction where it was first computed.
+class Available:
+    __slots__ = ('value', 'label', 'end')
+
+    def __init__(self, value, label=None, end=None):
+        self.value = value
+        self.label = label
+        self.end = end
+
+class ValueNumbering:
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.numbers = { }           # Expression -> value number
+        self.value_numbers = { }     # SSA value -> value number
+        self.available = { }         # Value number -> Available
+        self.exits = { }             # Label -> global versions at the end of the block
+        self.replacements = { block.label: [ ] for block in cfg.blocks }
+        self.holders = { block.label: { } for block in cfg.blocks }
+        self.versions = 0
+
+    def number(self, key):
+        return self.numbers.setdefault(key, len(self.numbers))
+
+    # A number for a value nothing is known about
+    def unknown(self):
+        return self.number(('unknown', len(self.numbers)))
+
+    def version(self):
+        self.versions += 1
+        return self.versions
+
+    def run(self):
+        for value in self.cfg.initial:
+            self.value_numbers[value] = number = self.unknown()
+            self.available[number] = Available(value)
+        # Same walk as to_ssa():  (label, None) to number a block and
+        # (None, added) to forget what it made available afterwards
+        work = [ ('entry', None) ]
+        while work:
+            label, added = work.pop()
+            if label is None:
+                for number, previous in reversed(added):
+                    if previous is None:
+                        del self.available[number]
+                    else:
+                        self.available[number] = previous
+                continue
+            added = self.number_block(label)
+            self.choose_replacements(label)
+            work.append((None, added))
+            work.extend((child, None) for child in reversed(self.cfg.block[label].children))
+        for block in self.cfg.blocks:
+            self.rewrite(block)
+
+    # Versions of the globals at the start of a block.  versions[slot]
+    # changes whenever the global might, versions[None] is for globals
+    # not stored since the last call.
+    def entry_versions(self, block):
+        if block.label == 'entry':
+            return { None: self.version() }
+        versions = dict(self.exits[self.cfg.idom[block.label]])
+        if len(block.preds) > 1:
+            changed = self.clobbered(block)
+            if changed is None:
+                return { None: self.version() }
+            for slot in changed:
+                versions[slot] = self.version()
+        return versions
+
+    # Globals that may be stored on the way from the immediate dominator
+    # of a block to the block (None if there's a call)
+    def clobbered(self, block):
+        idom = self.cfg.idom[block.label]
+        stored = set()
+        seen = set()
+        work = list(block.preds)
+        while work:
+            label = work.pop()
+            if label == idom or label in seen:
+                continue
+            seen.add(label)
+            for instr in self.cfg.block[label].code:
+                if instr[0] == 'call':
+                    return None
+                elif instr[0] == 'global.store':
+                    stored.add(instr[1])
+            work.extend(self.cfg.block[label].preds)
+        return stored
+
+    def make_available(self, number, available, added):
+        added.append((number, self.available.get(number)))
+        self.available[number] = available
+
+    # Number the values on the stack in a block.  Each entry of the
+    # stack is (number, start) where start is the index of the first
+    # instruction computing it, or None if the instructions from there
+    # can't be taken out (they include something with an effect).
+    # Records (number, start, Available) for each instruction finishing
+    # a value in self.entries.  Returns the values made available.
+    def number_block(self, label):
+        block = self.cfg.block[label]
+        versions = self.entry_versions(block)
+        added = [ ]
+        for phi in block.phis:
+            self.value_numbers[phi.value] = number = self.unknown()
+            self.make_available(number, Available(phi.value), added)
+
+        stack = [ ]
+        effect = -1                  # Index of the last instruction with an effect
+        self.entries = [ None ] * len(block.code)
+        for n, instr in enumerate(block.code):
+            op = instr[0]
+            count = operands(op)
+            if count is not None and len(stack) >= count:
+                args = stack[len(stack)-count:]
+                del stack[len(stack)-count:]
+                if op == 'local.load':
+                    number = self.value_numbers.get(instr[1])
+                    if number is None:
+                        number = self.value_numbers[instr[1]] = self.unknown()
+                elif op == 'global.load':
+                    number = self.number((op, instr[1], versions.get(instr[1], versions[None])))
+                elif count == 0:
+                    number = self.number((op, repr(instr[1])))
+                else:
+                    numbers = [ arg[0] for arg in args ]
+                    if op.partition('.')[2] in commutative:
+                        numbers.sort()
+                    number = self.number((op, *numbers))
+                start = args[0][1] if args else n
+                if any(arg[1] is None for arg in args) or (start is not None and start <= effect):
+                    start = None
+                stack.append((number, start))
+                self.entries[n] = (number, start, self.available.get(number))
+                if number not in self.available:
+                    self.make_available(number, Available(None, label, n), added)
+                continue
+
+            effect = n
+            if op == 'local.store' and stack:
+                number = stack.pop()[0]
+                self.value_numbers[instr[1]] = number
+                if self.available.get(number, Available(None)).value is None:
+                    self.make_available(number, Available(instr[1]), added)
+            elif op == 'global.store' and stack:
+                versions[instr[1]] = self.version()
+                self.numbers[('global.load', instr[1], versions[instr[1]])] = stack.pop()[0]
+            elif op == 'call':
+                # The number of arguments isn't known here, so nothing
+                # on the stack is known afterwards
+                stack.clear()
+                stack.append((self.unknown(), None))
+                versions = { None: self.version() }
+            elif op in ('call_ext', 'drop', 'ret', 'cbranch') and stack:
+                stack.pop()
+            elif op != 'goto':
+                stack.clear()
+        self.exits[label] = versions
+        return added
+
+    # Pick the calculations in a block to replace by loads.  Going
+    # backwards from the end finds the largest ones first.
+    def choose_replacements(self, label):
+        code = self.cfg.block[label].code
+        n = len(code) - 1
+        while n >= 0:
+            entry = self.entries[n]
+            if entry is not None and entry[1] is not None and entry[2] is not None:
+                number, start, available = entry
+                holder = available.value
+                if holder is None and n - start >= 3:
+                    holder = self.make_holder(number, available)
+                if (holder is not None and code[n] != ('local.load', holder)
+                    and (n > start or code[n][0] in ('global.load', 'local.load'))):
+                    self.replacements[label].append((start, n, holder))
+                    n = start - 1
+                    continue
+            n -= 1
+
+    # Store a value in a new local where it was first computed
+    def make_holder(self, number, available):
+        cfg = self.cfg
+        irtype = result_type(cfg, cfg.block[available.label].code[available.end])
+        slot = cfg.func.alloc_local(f'${len(cfg.func.locals)}', irtype)
+        available.value = cfg.new_value(slot)
+        self.value_numbers[available.value] = number
+        self.holders[available.label][available.end] = available.value
+        return available.value
+
+    def rewrite(self, block):
+        starts = { start: (end, value) for start, end, value in self.replacements[block.label] }
+        holders = self.holders[block.label]
+        if not starts and not holders:
+            return
+        code = [ ]
+        n = 0
+        while n < len(block.code):
+            if n in starts:
+                end, value = starts[n]
+                code.append(('local.load', value))
+                assert not any(n <= index < end for index in holders)
+            else:
+                end = n
+                code.append(block.code[n])
+            if end in holders:
+                code.append(('local.store', holders[end]))
+                code.append(('local.load', holders[end]))
+            n = end + 1
+        block.code = code
+
+# Remove values that are never used (see above)
+def remove_dead_values(cfg):
+    changed = True
+    while changed:
+        uses = dict.fromkeys(cfg.values, 0)
+        for block in cfg.blocks:
+            for phi in block.phis:
+                for value in phi.args.values():
+                    uses[value] += 1
+            for instr in block.code:
+                if instr[0] == 'local.load':
+                    uses[instr[1]] += 1
+
+        changed = False
+        for block in cfg.blocks:
+            phis = [ phi for phi in block.phis if uses[phi.value] ]
+            if len(phis) < len(block.phis):
+                block.phis = phis
+                changed = True
+
+            # Stack entries are the index of the first instruction
+            # computing a value, or None if those can't be removed
+            stack = [ ]
+            effect = -1
+            removed = set()
+            for n, instr in enumerate(block.code):
+                op = instr[0]
+                count = operands(op)
+                if count is not None and len(stack) >= count:
+                    args = stack[len(stack)-count:]
+                    del stack[len(stack)-count:]
+                    start = args[0] if args else n
+                    if None in args or op.endswith('.div') or (start is not None and start <= effect):
+                        start = None
+                    stack.append(start)
+                    continue
+                effect = n
+                if (op == 'drop' or (op == 'local.store' and not uses[instr[1]])) and stack:
+                    start = stack.pop()
+                    if start is not None:
+                        removed.update(range(start, n + 1))
+                    elif op == 'local.store':
+                        block.code[n] = ('drop',)
+                        changed = True
+                elif op == 'call':
+                    stack.clear()
+                    stack.append(None)
+                elif op in ('local.store', 'global.store', 'call_ext', 'ret', 'cbranch') and stack:
+                    stack.pop()
+                elif op != 'goto':
+                    stack.clear()
+            if removed:
+                block.code = [ instr for n, instr in enumerate(block.code) if n not in removed ]
+                changed = True
+    return cfg
+
+# The power of two that value is (None if it isn't one greater than 1)
+def log2(value):
+    if isinstance(value, int) and value > 1 and value & (value - 1) == 0:
+        return value.bit_length() - 1
+    return None
+
+def reduce_strength(code):
+    for n in range(1, len(code)):
+        if code[n] == ('i32.mul',) and code[n-1][0] == 'i32.const':
+            shift = log2(code[n-1][1])
+            if shift is not None:
+                code[n-1] = ('i32.const', shift)
+                code[n] = ('i32.shl',)
+
+# Peephole optimization (see above)
+
+terminators = { 'goto', 'cbranch', 'ret', 'cbranch.op', 'cbranch.op_const' }
+consts = { 'i32.const', 'f64.const', 'i8.const', 'i1.const' }
+compares = { f'{ty}.{name}' for ty in ('i32', 'f64', 'i8') for name in ('lt', 'le', 'gt', 'ge', 'eq', 'ne') }
+compares |= { 'i1.eq', 'i1.ne' }
+binops = compares | { f'{ty}.{name}' for ty in ('i32', 'f64') for name in ('add', 'sub', 'mul', 'div') }
+binops.add('i32.shl')
+
+# Instructions that do nothing to a value with a constant on the right
+identities = { ('i32.add', 0), ('i32.sub', 0), ('i32.shl', 0), ('i32.mul', 1), ('i32.div', 1), ('f64.mul', 1.0) }
+
+def const_op(op):
+    return f'{op.partition(".")[0]}.const'
+
+# The instructions a superinstruction stands for
+def expand(instr):
+    op = instr[0]
+    if op == 'op.const':
+        return [ (const_op(instr[1]), instr[2]), (instr[1],) ]
+    elif op == 'op.local_const':
+        return [ ('local.load', instr[2]), (const_op(instr[1]), instr[3]), (instr[1],) ]
+    elif op == 'cbranch.op':
+        return [ (instr[1],), ('cbranch', instr[2], instr[3]) ]
+    elif op == 'cbranch.op_const':
+        return [ (const_op(instr[1]), instr[2]), (instr[1],), ('cbranch', instr[3], instr[4]) ]
+    return [ instr ]
+
+def expand_code(code):
+    for instr in code:
+        yield from expand(instr)
+
+# Each rule is (ops, rewrite).  ops has the instruction names (a name
+# or a set of them) that consecutive instructions must have.  rewrite
+# is called with the instructions and gives the replacement, or None to
+# leave them alone.  Rules are tried in order.
+rules = [
+    (('local.load', 'local.store'),
+     lambda load, store: [ ] if load[1] == store[1] else None),
+    (('local.store', 'local.load'),
+     lambda store, load: [ ('local.tee', store[1]) ] if store[1] == load[1] else None),
+    (({ 'local.load', 'global.load' } | consts, 'drop'),
+     lambda load, drop: [ ]),
+    (('i1.not', 'cbranch'),
+     lambda inverse, branch: [ ('cbranch', branch[2], branch[1]) ]),
+    (('i1.const', 'cbranch'),
+     lambda const, branch: [ ('goto', branch[1] if const[1] else branch[2]) ]),
+    ((consts, binops),
+     lambda const, op: [ ] if (op[0], const[1]) in identities else [ ('op.const', op[0], const[1]) ]),
+    (('local.load', 'op.const'),
+     lambda load, op: [ ('op.local_const', op[1], load[1], op[2]) ]),
+    ((compares, 'cbranch'),
+     lambda compare, branch: [ ('cbranch.op', compare[0], branch[1], branch[2]) ]),
+    (('op.const', 'cbranch'),
+     lambda op, branch: ([ ('cbranch.op_const', op[1], op[2], branch[1], branch[2]) ]
+                         if op[1] in compares else None)),
+]
+
+# Rules by the name of the first instruction
+first_rules = { }
+for ops, rewrite in rules:
+    ops = tuple({ op } if isinstance(op, str) else op for op in ops)
+    for op in ops[0]:
+        first_rules.setdefault(op, [ ]).append((ops, rewrite))
+longest = max(len(ops) for ops, rewrite in rules)
+
+def peephole(code):
+    thread_jumps(code)
+    n = 0
+    while n < len(code):
+        for ops, rewrite in first_rules.get(code[n][0], ()):
+            window = code[n:n+len(ops)]
+            if len(window) == len(ops) and all(instr[0] in names for instr, names in zip(window, ops)):
+                replacement = rewrite(*window)
+                if replacement is not None:
+                    code[n:n+len(ops)] = replacement
+                    # The replacement may start a rule with what's before it
+                    n = max(n - longest + 1, 0)
+                    break
+        else:
+            n += 1
+    remove_unused_blocks(code)
+    return code
+
+# Labels an instruction jumps to.  They're the last two items of any
+# kind of cbranch.
+def jump_targets(instr):
+    if instr[0] == 'goto':
+        return instr[1:]
+    elif instr[0].startswith('cbranch'):
+        return instr[-2:]
+    return ()
+
+def thread_jumps(code):
+    forward = { code[n][1]: code[n+1][1] for n in range(len(code) - 1)
+                if code[n][0] == 'label' and code[n+1][0] == 'goto' }
+    def target(label):
+        seen = set()
+        while label in forward and label not in seen:
+            seen.add(label)
+            label = forward[label]
+        return label
+    for n, instr in enumerate(code):
+        if instr[0] == 'goto':
+            code[n] = ('goto', target(instr[1]))
+        elif instr[0].startswith('cbranch'):
+            code[n] = instr[:-2] + (target(instr[-2]), target(instr[-1]))
+
+# Remove blocks that nothing jumps to and that can't be fallen into
+def remove_unused_blocks(code):
+    changed = True
+    while changed:
+        used = { label for instr in code for label in jump_targets(instr) }
+        keep = [ ]
+        skipping = False
+        for instr in code:
+            if instr[0] == 'label':
+                skipping = instr[1] not in used and bool(keep) and keep[-1][0] in terminators
+            if not skipping:
+                keep.append(instr)
+        changed = len(keep) < len(code)
+        code[:] = keep
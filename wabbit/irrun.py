@@ -4,25 +4,168 @@
 # simulator that directly runs your IR Code as defined in the
 # ircode.py file.
 
+import sys
+
+# Values are Python ints and floats.  i32 arithmetic wraps around
+# and division truncates towards zero, like the compiled code.
+def wrap32(value):
+    return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+def idiv(left, right):
+    quotient = abs(left) // abs(right)
+    return wrap32(-quotient if (left < 0) != (right < 0) else quotient)
+
+binary_ops = {
+    'i32.add': lambda x, y: wrap32(x + y),
+    'i32.sub': lambda x, y: wrap32(x - y),
+    'i32.mul': lambda x, y: wrap32(x * y),
+    'i32.div': idiv,
+    'i32.shl': lambda x, y: wrap32(x << y),
+    'f64.add': lambda x, y: x + y,
+    'f64.sub': lambda x, y: x - y,
+    'f64.mul': lambda x, y: x * y,
+    'f64.div': lambda x, y: x / y,
+    }
+
+for ty in ('i32', 'f64', 'i8', 'i1'):
+    binary_ops[f'{ty}.eq'] = lambda x, y: int(x == y)
+    binary_ops[f'{ty}.ne'] = lambda x, y: int(x != y)
+for ty in ('i32', 'f64', 'i8'):
+    binary_ops[f'{ty}.lt'] = lambda x, y: int(x < y)
+    binary_ops[f'{ty}.le'] = lambda x, y: int(x <= y)
+    binary_ops[f'{ty}.gt'] = lambda x, y: int(x > y)
+    binary_ops[f'{ty}.ge'] = lambda x, y: int(x >= y)
+
+unary_ops = {
+    'i32.neg': lambda x: wrap32(-x),
+    'f64.neg': lambda x: -x,
+    'i1.not': lambda x: 1 - x,
+    'i32.to_f64': float,
+    'f64.to_i32': lambda x: wrap32(int(x)),
+    'i8.to_i32': lambda x: x,
+    'i32.to_i8': lambda x: x & 0xFF,
+    }
+
+# Runtime library
+runtime = {
+    '_printi': lambda x, out: print(x, file=out),
+    '_printf': lambda x, out: print(x, file=out),
+    '_printb': lambda x, out: print('true' if x else 'false', file=out),
+    '_printc': lambda x, out: print(chr(x), end='', file=out),
+    '_printu': lambda x, out: print('()', file=out),
+    }
+
+zero = { 'i32': 0, 'f64': 0.0, 'i8': 0, 'i1': 0 }
+
 class IRMachine:
-    pass       # You define
+    def __init__(self, module, out=None):
+        self.module = module
+        self.out = out or sys.stdout
+        self.globals = [ zero[ty] for name, ty in module.globals ]
+        self.functions = { }
+        for func in module.functions:
+            self.add_function(func)
+
+    # Functions can be added one at a time.  The machine only keeps
+    # the code and label table, not the IRFunction itself.  A jump goes
+    # to the instruction after the label.
+    def add_function(self, func):
+        labels = { instr[1]: n + 1 for n, instr in enumerate(func.code) if instr[0] == 'label' }
+        initial = [ zero[ty] for name, ty in func.locals ]
+        self.functions[func.name] = (tuple(func.code), labels, initial, len(func.argtypes))
+
+    def add_globals(self, globals):
+        self.globals.extend(zero[ty] for name, ty in globals[len(self.globals):])
+
+    def run(self):
+        return self.call('main', [ ])
+
+    def call(self, name, args):
+        code, labels, initial, nargs = self.functions[name]
+        locals = list(initial)
+        locals[:nargs] = args
+        globals = self.globals
+        stack = [ ]
+        pc = 0
+        while True:
+            instr = code[pc]
+            pc += 1
+            op = instr[0]
+            if op in binary_ops:
+                right = stack.pop()
+                stack[-1] = binary_ops[op](stack[-1], right)
+            elif op in unary_ops:
+                stack[-1] = unary_ops[op](stack[-1])
+            # Superinstructions (see iropt.py)
+            elif op == 'op.local_const':
+                stack.append(binary_ops[instr[1]](locals[instr[2]], instr[3]))
+            elif op == 'op.const':
+                stack[-1] = binary_ops[instr[1]](stack[-1], instr[2])
+            elif op == 'cbranch.op_const':
+                pc = labels[instr[3] if binary_ops[instr[1]](stack.pop(), instr[2]) else instr[4]]
+            elif op == 'cbranch.op':
+                right = stack.pop()
+                pc = labels[instr[2] if binary_ops[instr[1]](stack.pop(), right) else instr[3]]
+            elif op == 'local.tee':
+                locals[instr[1]] = stack[-1]
+            elif op == 'local.load':
+                stack.append(locals[instr[1]])
+            elif op == 'local.store':
+                locals[instr[1]] = stack.pop()
+            elif op == 'global.load':
+                stack.append(globals[instr[1]])
+            elif op == 'global.store':
+                globals[instr[1]] = stack.pop()
+            elif op.endswith('.const'):
+                stack.append(instr[1])
+            elif op == 'label':
+                pass
+            elif op == 'goto':
+                pc = labels[instr[1]]
+            elif op == 'cbranch':
+                pc = labels[instr[1] if stack.pop() else instr[2]]
+            elif op == 'call':
+                nargs = self.functions[instr[1]][3]
+                args = stack[len(stack)-nargs:]
+                del stack[len(stack)-nargs:]
+                stack.append(self.call(instr[1], args))
+            elif op == 'call_ext':
+                runtime[instr[1]](stack.pop(), self.out)
+            elif op == 'drop':
+                stack.pop()
+            elif op == 'ret':
+                return stack.pop()
+            else:
+                raise RuntimeError(f'Bad instruction {instr}')
         
-def main(filename):
-    from .parse import parse_file
-    from .typecheck import check_program
-    from .ircode import generate_ircode
-    from .transform import transform
-    
-    model = parse_file(filename)
-    check_program(model)
-    model = transform(model)
-    irmodule = generate_ircode(model)
-
-    # You'll have to adapt this as needed to make it work
-    machine = IRMachine(irmodule)
+def main(filename, stream=False, time_passes=False):
+    from .compile import compile_file, pipelines
+
+    if stream:
+        return main_stream(filename)
+
+    compile_file(filename, pipelines['run'], time_passes)
+
+# Functions are loaded into the machine as they're produced.  Nothing
+# runs until all of them are available.
+def main_stream(filename):
+    from .ircode import IRModule
+    from .stream import compile_file
+
+    machine = IRMachine(IRModule())
+    compiler = compile_file(filename)
+    for func in compiler:
+        machine.add_globals(compiler.module.globals)
+        machine.add_function(func)
+    if compiler.errors:
+        raise SystemExit(1)
     machine.run()
 
 if __name__ == '__main__':
     import sys
-    main(sys.argv[1])
-    
+    if sys.argv[1:2] == ['-stream']:
+        main(sys.argv[2], stream=True)
+    elif sys.argv[1:2] == ['-time-passes']:
+        main(sys.argv[2], time_passes=True)
+    else:
+        main(sys.argv[1])
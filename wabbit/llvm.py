@@ -16,15 +16,68 @@
 
 from llvmlite import ir
 
+from .iropt import expand_code
+
 # Define LLVM types corresponding to IR types
 i32_type = ir.IntType(32)
 f64_type = ir.DoubleType()
 i1_type = ir.IntType(1)
 i8_type = ir.IntType(8)
+void_type = ir.VoidType()
+
+types = {
+    'i32': i32_type,
+    'f64': f64_type,
+    'i1': i1_type,
+    'i8': i8_type,
+    }
+
+# Runtime functions (see runtime.c).  Booleans and characters are
+# widened to an int when passed to C.
+runtime = {
+    '_printi': i32_type,
+    '_printf': f64_type,
+    '_printb': i32_type,
+    '_printc': i32_type,
+    '_printu': i32_type,
+    }
 
-# The LLVM module/environment that Wabbit is populating
+# The LLVM module/environment that Wabbit is populating.  Functions
+# are declared (by name) before any code is converted so that calls
+# can refer to functions that come later.  Everything except main()
+# is internal to the module.
 class WabbitLLVMModule:
-    pass
+    def __init__(self, name='wabbit'):
+        self.module = ir.Module(name)
+        self.globals = [ ]
+        self.functions = { }
+        for name, argtype in runtime.items():
+            self.functions[name] = ir.Function(self.module, ir.FunctionType(void_type, [argtype]), name=name)
+
+    def declare_globals(self, globals):
+        # Declare any globals not seen before
+        for name, irtype in globals[len(self.globals):]:
+            gvar = ir.GlobalVariable(self.module, types[irtype], name=name)
+            gvar.initializer = ir.Constant(types[irtype], 0)
+            gvar.linkage = 'internal'
+            self.globals.append(gvar)
+
+    def declare_functions(self, signatures):
+        # Declare any (name, argtypes, rettype) signatures not seen before
+        for name, argtypes, rettype in signatures[len(self.functions) - len(runtime):]:
+            self.declare_function(name, argtypes, rettype)
+
+    def declare_function(self, name, argtypes, rettype):
+        if name not in self.functions:
+            functype = ir.FunctionType(types[rettype], [ types[ty] for ty in argtypes ])
+            self.functions[name] = ir.Function(self.module, functype, name=name)
+            if name != 'main':
+                # Keep Wabbit names from clashing with C library names
+                self.functions[name].linkage = 'internal'
+        return self.functions[name]
+
+    def __str__(self):
+        return str(self.module)
 
 # Top-level function
 def generate_llvm(irmodule):
@@ -34,28 +87,161 @@ def generate_llvm(irmodule):
 
 def convert_module(irmodule, llmod):
     # Convert an IRModule to an LLVM Module
-    ...
+    llmod.declare_globals(irmodule.globals)
+    for func in irmodule.functions:
+        llmod.declare_function(func.name, func.argtypes, func.rettype)
+    for func in irmodule.functions:
+        convert_function(func, llmod)
+
+# Instructions that map directly onto a builder method
+binary_ops = {
+    'i32.add': 'add', 'i32.sub': 'sub', 'i32.mul': 'mul', 'i32.div': 'sdiv',
+    'i32.shl': 'shl',
+    'f64.add': 'fadd', 'f64.sub': 'fsub', 'f64.mul': 'fmul', 'f64.div': 'fdiv',
+    }
+
+relations = {
+    'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>=', 'eq': '==', 'ne': '!=',
+    }
+
+conversions = {
+    'i32.to_f64': ('sitofp', f64_type),
+    'f64.to_i32': ('fptosi', i32_type),
+    'i8.to_i32': ('zext', i32_type),
+    'i32.to_i8': ('trunc', i8_type),
+    }
+
+# Convert the code of one IRFunction.  The stack of the IR machine
+# only exists at compile time--it holds LLVM values.  Locals are
+# allocated on the LLVM stack in the entry block.  Superinstructions
+# other than local.tee are expanded first.
+def convert_function(irfunc, llmod):
+    func = llmod.declare_function(irfunc.name, irfunc.argtypes, irfunc.rettype)
+    builder = ir.IRBuilder(func.append_basic_block('entry'))
+    locals = [ builder.alloca(types[ty], name=name.lstrip('$') or None) for name, ty in irfunc.locals ]
+    for arg, slot in zip(func.args, locals):
+        builder.store(arg, slot)
+    for slot, (name, ty) in zip(locals[len(func.args):], irfunc.locals[len(func.args):]):
+        builder.store(ir.Constant(types[ty], 0), slot)
+    blocks = { instr[1]: func.append_basic_block(instr[1])
+               for instr in irfunc.code if instr[0] == 'label' }
+    stack = [ ]
+    for instr in expand_code(irfunc.code):
+        op = instr[0]
+        ty, _, name = op.partition('.')
+        if op == 'label':
+            if not builder.block.is_terminated:
+                builder.branch(blocks[instr[1]])
+            builder.position_at_end(blocks[instr[1]])
+        elif builder.block.is_terminated:
+            # Unreachable code following a goto or return
+            continue
+        elif op in binary_ops:
+            right = stack.pop()
+            stack.append(getattr(builder, binary_ops[op])(stack.pop(), right))
+        elif op.endswith('.const'):
+            stack.append(ir.Constant(types[ty], instr[1]))
+        elif name in relations:
+            right = stack.pop()
+            left = stack.pop()
+            if ty == 'f64':
+                compare = builder.fcmp_unordered if name == 'ne' else builder.fcmp_ordered
+            elif ty == 'i32':
+                compare = builder.icmp_signed
+            else:
+                compare = builder.icmp_unsigned
+            stack.append(compare(relations[name], left, right))
+        elif op == 'i32.neg':
+            stack.append(builder.neg(stack.pop()))
+        elif op == 'f64.neg':
+            stack.append(builder.fneg(stack.pop()))
+        elif op == 'i1.not':
+            stack.append(builder.not_(stack.pop()))
+        elif op in conversions:
+            method, totype = conversions[op]
+            stack.append(getattr(builder, method)(stack.pop(), totype))
+        elif op == 'local.load':
+            stack.append(builder.load(locals[instr[1]]))
+        elif op == 'local.store':
+            builder.store(stack.pop(), locals[instr[1]])
+        elif op == 'local.tee':
+            builder.store(stack[-1], locals[instr[1]])
+        elif op == 'global.load':
+            stack.append(builder.load(llmod.globals[instr[1]]))
+        elif op == 'global.store':
+            builder.store(stack.pop(), llmod.globals[instr[1]])
+        elif op == 'goto':
+            builder.branch(blocks[instr[1]])
+        elif op == 'cbranch':
+            builder.cbranch(stack.pop(), blocks[instr[1]], blocks[instr[2]])
+        elif op == 'call':
+            callee = llmod.functions[instr[1]]
+            nargs = len(callee.args)
+            args = stack[len(stack)-nargs:]
+            del stack[len(stack)-nargs:]
+            stack.append(builder.call(callee, args))
+        elif op == 'call_ext':
+            arg = stack.pop()
+            if arg.type in (i1_type, i8_type):
+                arg = builder.zext(arg, i32_type)
+            builder.call(llmod.functions[instr[1]], [ arg ])
+        elif op == 'drop':
+            stack.pop()
+        elif op == 'ret':
+            builder.ret(stack.pop())
+        else:
+            raise RuntimeError(f"Can't convert {instr}")
+    return func
+
+# Streaming output.  Each function is written out as soon as it has
+# been converted and then reduced to a declaration, so only one
+# function body is ever held in memory.  Globals and declarations are
+# written at the end (LLVM doesn't care about the order).
+def write_function(irfunc, llmod, file):
+    func = convert_function(irfunc, llmod)
+    file.write(str(func))
+    file.write('\n')
+    func.blocks = [ ]
+
+def write_declarations(llmod, file):
+    for gvar in llmod.globals:
+        file.write(f'{gvar}\n')
+    for func in llmod.functions.values():
+        if func.is_declaration and func.name in runtime:
+            file.write(f'{func}\n')
 
 # Sample main program that runs the compiler
-def main(filename):
-    from .parse import parse_file
-    from .typecheck import check_program
-    from .ircode import generate_ircode
-    from .transform import transform
-    
-    model = parse_file(filename)
-    check_program(model)
-    model = transform(model)
-    irmodule = generate_ircode(model)
-    llmodule = generate_llvm(irmodule)
-    
+def main(filename, stream=False, time_passes=False):
+    from .compile import compile_file, pipelines
+
+    if stream:
+        return main_stream(filename)
+
+    llcode = compile_file(filename, pipelines['llvm'], time_passes)
     with open('out.ll', 'w') as file:
-        file.write(str(llmodule))
+        file.write(llcode)
     print('Wrote out.ll')
 
-if __name__ == '__main__':
-    import sys
-    main(sys.argv[1])
-
+def main_stream(filename):
+    from .stream import compile_file
 
+    llmod = WabbitLLVMModule()
+    with open('out.ll', 'w') as file:
+        compiler = compile_file(filename)
+        for irfunc in compiler:
+            llmod.declare_globals(compiler.module.globals)
+            llmod.declare_functions(compiler.signatures)
+            write_function(irfunc, llmod, file)
+        write_declarations(llmod, file)
+    if compiler.errors:
+        raise SystemExit(1)
+    print('Wrote out.ll')
 
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:2] == ['-stream']:
+        main(sys.argv[2], stream=True)
+    elif sys.argv[1:2] == ['-time-passes']:
+        main(sys.argv[2], time_passes=True)
+    else:
+        main(sys.argv[1])
@@ -42,24 +42,150 @@
 # use basic data structures. You can add usability enhancements later.
 # -----------------------------------------------------------------------------
 
+from array import array
+
 # The following classes are used for the expression example in script_models.py.
 # Feel free to modify as appropriate.  You don't even have to use classes
 # if you want to go in a different direction with it.
 
-class Integer:
+# All nodes use __slots__.  A program can have millions of nodes and
+# slots take a fraction of the memory of a per-instance __dict__.  The
+# slots of a class are the fields given to __init__().  Other attributes
+# are filled in later:  lineno (set by the parser), for expressions,
+# type (set by the type checker), the annotations made by name
+# resolution (resolve.py):  address on names and declarations and size
+# on functions and programs, operation on operators and calls
+# (interp.specialize()) and digest on functions (a digest of their
+# tokens, set by the parser and used by checkcache.py).  Until then,
+# they don't exist, just like a normal attribute that was never
+# assigned.
+
+# Slots that hold annotations rather than fields
+annotations = ('address', 'size', 'operation', 'digest')
+
+class Node:
+    __slots__ = ('lineno',)
+
+    # _fields is the names of the fields of each class (its __slots__
+    # other than annotations)
+    def __init_subclass__(cls):
+        if '_fields' not in cls.__dict__:
+            cls._fields = tuple(name for name in cls.__dict__.get('__slots__', ())
+                                if name not in annotations)
+
+class Expression(Node):
+    __slots__ = ('type',)
+
+class Integer(Expression):
     '''
     Example: 42
     '''
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
     def __repr__(self):
         return f'Integer({self.value})'
 
-class BinOp:
+class Float(Expression):
+    '''
+    Example: 3.14159
+    '''
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return f'Float({self.value})'
+
+class Char(Expression):
+    '''
+    Example: 'h'
+    '''
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return f'Char({self.value!r})'
+
+class Bool(Expression):
+    '''
+    Example: true
+    '''
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return f'Bool({self.value})'
+
+class Unit(Expression):
+    '''
+    Example: ()
+    '''
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'Unit()'
+
+class Name(Expression):
+    '''
+    Example: x
+
+    A named location.  Used both to load a value (in an expression)
+    and as the target of an assignment.
+    '''
+    __slots__ = ('name', 'address')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f'Name({self.name})'
+
+class Attribute(Expression):
+    '''
+    Example: p.x
+
+    Structure field access.  Like Name, it may also be the target of
+    an assignment.
+    '''
+    __slots__ = ('value', 'name')
+
+    def __init__(self, value, name):
+        self.value = value
+        self.name = name
+
+    def __repr__(self):
+        return f'Attribute({self.value}, {self.name})'
+
+class UnaryOp(Expression):
+    '''
+    Example: -operand
+    '''
+    __slots__ = ('op', 'operand', 'operation')
+
+    def __init__(self, op, operand):
+        self.op = op
+        self.operand = operand
+
+    def __repr__(self):
+        return f'UnaryOp({self.op}, {self.operand})'
+
+class BinOp(Expression):
     '''
     Example: left + right
+
+    Also used for relations (left < right) and the logical
+    operators (left && right).
     '''
+    __slots__ = ('op', 'left', 'right', 'operation')
+
     def __init__(self, op, left, right):
         self.op = op
         self.left = left
@@ -68,16 +194,802 @@ class BinOp:
     def __repr__(self):
         return f'BinOp({self.op}, {self.left}, {self.right})'
 
+class Call(Expression):
+    '''
+    Example: name(arg1, arg2)
+
+    Function calls, structure creation (Point(2, 3)) and type
+    conversions (float(x)) all look the same syntactically.
+    '''
+    __slots__ = ('name', 'arguments', 'operation')
+
+    def __init__(self, name, arguments):
+        self.name = name
+        self.arguments = arguments
+
+    def __repr__(self):
+        return f'Call({self.name}, {self.arguments})'
+
+class EnumValue(Expression):
+    '''
+    Example: MaybeNumber::Integer(42)
+             Color::Red            (value is None)
+    '''
+    __slots__ = ('enum', 'choice', 'value')
+
+    def __init__(self, enum, choice, value=None):
+        self.enum = enum
+        self.choice = choice
+        self.value = value
+
+    def __repr__(self):
+        return f'EnumValue({self.enum}, {self.choice}, {self.value})'
+
+class Match(Expression):
+    '''
+    Example: match value { cases }
+    '''
+    __slots__ = ('value', 'cases')
+
+    def __init__(self, value, cases):
+        self.value = value
+        self.cases = cases
+
+    def __repr__(self):
+        return f'Match({self.value}, {self.cases})'
+
+class MatchCase(Node):
+    '''
+    Example: Some(binding) => value;
+             No => value;           (binding is None)
+             _ => value;            (default)
+    '''
+    __slots__ = ('choice', 'binding', 'value', 'address')
+
+    def __init__(self, choice, binding, value):
+        self.choice = choice
+        self.binding = binding
+        self.value = value
+
+    def __repr__(self):
+        return f'MatchCase({self.choice}, {self.binding}, {self.value})'
+
+class Compound(Expression):
+    '''
+    Example: { statement1; statement2; expression; }
+    '''
+    __slots__ = ('statements',)
+
+    def __init__(self, statements):
+        self.statements = statements
+
+    def __repr__(self):
+        return f'Compound({self.statements})'
+
+class Print(Node):
+    '''
+    Example: print value;
+    '''
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return f'Print({self.value})'
+
+class Assignment(Node):
+    '''
+    Example: location = value;
+    '''
+    __slots__ = ('location', 'value')
+
+    def __init__(self, location, value):
+        self.location = location
+        self.value = value
+
+    def __repr__(self):
+        return f'Assignment({self.location}, {self.value})'
+
+class Variable(Node):
+    '''
+    Example: var name type = value;
+
+    type or value (but not both) may be None.
+    '''
+    __slots__ = ('name', 'type', 'value', 'address')
+
+    def __init__(self, name, type, value):
+        self.name = name
+        self.type = type
+        self.value = value
+
+    def __repr__(self):
+        return f'Variable({self.name}, {self.type}, {self.value})'
+
+class Const(Node):
+    '''
+    Example: const name type = value;
+
+    type may be None.
+    '''
+    __slots__ = ('name', 'type', 'value', 'address')
+
+    def __init__(self, name, type, value):
+        self.name = name
+        self.type = type
+        self.value = value
+
+    def __repr__(self):
+        return f'Const({self.name}, {self.type}, {self.value})'
+
+class If(Node):
+    '''
+    Example: if test { consequence } else { alternative }
+
+    consequence and alternative are lists of statements.
+    '''
+    __slots__ = ('test', 'consequence', 'alternative')
+
+    def __init__(self, test, consequence, alternative):
+        self.test = test
+        self.consequence = consequence
+        self.alternative = alternative
+
+    def __repr__(self):
+        return f'If({self.test}, {self.consequence}, {self.alternative})'
+
+class While(Node):
+    '''
+    Example: while test { body }
+    '''
+    __slots__ = ('test', 'body')
+
+    def __init__(self, test, body):
+        self.test = test
+        self.body = body
+
+    def __repr__(self):
+        return f'While({self.test}, {self.body})'
+
+class Break(Node):
+    '''
+    Example: break;
+    '''
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'Break()'
+
+class Continue(Node):
+    '''
+    Example: continue;
+    '''
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'Continue()'
+
+class Return(Node):
+    '''
+    Example: return value;
+    '''
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return f'Return({self.value})'
+
+class ExprStatement(Node):
+    '''
+    Example: expression;
+
+    An expression used as a statement.  Its value is discarded unless
+    it's the last statement of a compound expression.
+    '''
+    __slots__ = ('expression',)
+
+    def __init__(self, expression):
+        self.expression = expression
+
+    def __repr__(self):
+        return f'ExprStatement({self.expression})'
+
+class Parameter(Node):
+    '''
+    Example: name type
+    '''
+    __slots__ = ('name', 'type', 'address')
+
+    def __init__(self, name, type):
+        self.name = name
+        self.type = type
+
+    def __repr__(self):
+        return f'Parameter({self.name}, {self.type})'
+
+class Function(Node):
+    '''
+    Example: func name(parameters) rettype { body }
+    '''
+    __slots__ = ('name', 'parameters', 'rettype', 'body', 'size', 'digest')
+
+    def __init__(self, name, parameters, rettype, body):
+        self.name = name
+        self.parameters = parameters
+        self.rettype = rettype
+        self.body = body
+
+    def __repr__(self):
+        return f'Function({self.name}, {self.parameters}, {self.rettype}, {self.body})'
+
+class StructField(Node):
+    '''
+    Example: name type;
+    '''
+    __slots__ = ('name', 'type')
+
+    def __init__(self, name, type):
+        self.name = name
+        self.type = type
+
+    def __repr__(self):
+        return f'StructField({self.name}, {self.type})'
+
+class Struct(Node):
+    '''
+    Example: struct name { fields }
+    '''
+    __slots__ = ('name', 'fields')
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def __repr__(self):
+        return f'Struct({self.name}, {self.fields})'
+
+class EnumChoice(Node):
+    '''
+    Example: name;
+             name(type);
+    '''
+    __slots__ = ('name', 'type')
+
+    def __init__(self, name, type):
+        self.name = name
+        self.type = type
+
+    def __repr__(self):
+        return f'EnumChoice({self.name}, {self.type})'
+
+class Enum(Node):
+    '''
+    Example: enum name { choices }
+    '''
+    __slots__ = ('name', 'choices')
+
+    def __init__(self, name, choices):
+        self.name = name
+        self.choices = choices
+
+    def __repr__(self):
+        return f'Enum({self.name}, {self.choices})'
+
+class Program(Node):
+    '''
+    A complete program.  A list of top-level statements.
+    '''
+    __slots__ = ('statements', 'size')
+
+    def __init__(self, statements):
+        self.statements = statements
+
+    def __repr__(self):
+        return f'Program({self.statements})'
+
 # ------ Debugging function to convert a model into source code (for easier viewing)
 
-def to_source(node):
-    if isinstance(node, Integer):
-        return repr(node.value)
-    elif isinstance(node, BinOp):
-        return f'{to_source(node.left)} {node.op} {to_source(node.right)}'
+def to_source(node, indent=''):
+    return sources[type(node)](node, indent)
+
+def source_program(node, indent):
+    return ''.join(to_source(stmt) for stmt in node.statements)
+
+def source_list(node, indent):
+    return ''.join(to_source(stmt, indent) for stmt in node)
+
+def source_unknown(node, indent):
+    raise RuntimeError(f"Can't convert {node} to source")
+
+# Expressions
+
+def source_integer(node, indent):
+    return str(node.value)
+
+def source_float(node, indent):
+    return str(node.value)
+
+def source_char(node, indent):
+    return repr(node.value)
+
+def source_bool(node, indent):
+    return 'true' if node.value else 'false'
+
+def source_unit(node, indent):
+    return '()'
+
+def source_name(node, indent):
+    return node.name
+
+def source_attribute(node, indent):
+    return f'{to_source(node.value)}.{node.name}'
+
+def source_unaryop(node, indent):
+    return f'{node.op}{operand_source(node.operand)}'
+
+def source_binop(node, indent):
+    return f'{operand_source(node.left)} {node.op} {operand_source(node.right)}'
+
+def source_call(node, indent):
+    args = ', '.join(to_source(arg) for arg in node.arguments)
+    return f'{node.name}({args})'
+
+def source_enumvalue(node, indent):
+    value = f'({to_source(node.value)})' if node.value is not None else ''
+    return f'{node.enum}::{node.choice}{value}'
+
+def source_match(node, indent):
+    cases = ''.join(f'{indent}    {to_source(case, indent + "    ")}\n' for case in node.cases)
+    return f'match {to_source(node.value)} {{\n{cases}{indent}}}'
+
+def source_matchcase(node, indent):
+    binding = f'({node.binding})' if node.binding is not None else ''
+    return f'{node.choice}{binding} => {to_source(node.value, indent)};'
+
+def source_compound(node, indent):
+    return f'{{\n{to_source(node.statements, indent + "    ")}{indent}}}'
+
+# Statements
+
+def source_print(node, indent):
+    return f'{indent}print {to_source(node.value, indent)};\n'
+
+def source_assignment(node, indent):
+    return f'{indent}{to_source(node.location)} = {to_source(node.value, indent)};\n'
+
+def source_variable(node, indent):
+    kind = 'var' if isinstance(node, Variable) else 'const'
+    type = f' {node.type}' if node.type else ''
+    value = f' = {to_source(node.value, indent)}' if node.value is not None else ''
+    return f'{indent}{kind} {node.name}{type}{value};\n'
+
+def source_if(node, indent):
+    source = f'{indent}if {to_source(node.test)} {{\n{to_source(node.consequence, indent + "    ")}{indent}}}'
+    if node.alternative:
+        source += f' else {{\n{to_source(node.alternative, indent + "    ")}{indent}}}'
+    return source + '\n'
+
+def source_while(node, indent):
+    return f'{indent}while {to_source(node.test)} {{\n{to_source(node.body, indent + "    ")}{indent}}}\n'
+
+def source_break(node, indent):
+    return f'{indent}break;\n'
+
+def source_continue(node, indent):
+    return f'{indent}continue;\n'
+
+def source_return(node, indent):
+    return f'{indent}return {to_source(node.value, indent)};\n'
+
+def source_exprstatement(node, indent):
+    return f'{indent}{to_source(node.expression, indent)};\n'
+
+def source_parameter(node, indent):
+    return f'{node.name} {node.type}'
+
+def source_function(node, indent):
+    params = ', '.join(to_source(param) for param in node.parameters)
+    return f'{indent}func {node.name}({params}) {node.rettype} {{\n{to_source(node.body, indent + "    ")}{indent}}}\n'
+
+def source_structfield(node, indent):
+    return f'{indent}{node.name} {node.type};\n'
+
+def source_struct(node, indent):
+    return f'{indent}struct {node.name} {{\n{to_source(node.fields, indent + "    ")}{indent}}}\n'
+
+def source_enumchoice(node, indent):
+    type = f'({node.type})' if node.type else ''
+    return f'{indent}{node.name}{type};\n'
+
+def source_enum(node, indent):
+    return f'{indent}enum {node.name} {{\n{to_source(node.choices, indent + "    ")}{indent}}}\n'
+
+# Nested operators are parenthesized so that the output reads back in
+# with the same structure.
+def operand_source(node):
+    if isinstance(node, BinOp):
+        return f'({to_source(node)})'
+    else:
+        return to_source(node)
+
+# ------ Dispatch tables
+#
+# The tree walkers (check(), interpret(), generate(), to_source())
+# find the function that handles a node by looking up the node's class
+# in a Dispatch table:
+#
+#     checkers = Dispatch({ Integer: check_integer, ... }, default=check_unknown)
+#
+#     def check(node, env):
+#         return checkers[type(node)](node, env)
+#
+# A lookup is a single dict access no matter how many kinds of node
+# there are, where a chain of isinstance() tests gets slower the
+# further down the chain a class is.  A class that isn't in the table
+# (for instance, an arena view, which is a subclass of a model class)
+# is looked up by its base classes the first time it's seen and the
+# answer is added to the table.  If nothing matches, the default
+# handler is used.
+
+class Dispatch(dict):
+    def __init__(self, handlers, default):
+        super().__init__()
+        for classes, handler in handlers.items():
+            for cls in classes if isinstance(classes, tuple) else (classes,):
+                self[cls] = handler
+        self.default = default
+
+    def __missing__(self, cls):
+        handler = next((self[base] for base in cls.__mro__[1:] if base in self), self.default)
+        self[cls] = handler
+        return handler
+
+sources = Dispatch({
+    Program: source_program,
+    list: source_list,
+    Integer: source_integer,
+    Float: source_float,
+    Char: source_char,
+    Bool: source_bool,
+    Unit: source_unit,
+    Name: source_name,
+    Attribute: source_attribute,
+    UnaryOp: source_unaryop,
+    BinOp: source_binop,
+    Call: source_call,
+    EnumValue: source_enumvalue,
+    Match: source_match,
+    MatchCase: source_matchcase,
+    Compound: source_compound,
+    Print: source_print,
+    Assignment: source_assignment,
+    (Variable, Const): source_variable,
+    If: source_if,
+    While: source_while,
+    Break: source_break,
+    Continue: source_continue,
+    Return: source_return,
+    ExprStatement: source_exprstatement,
+    Parameter: source_parameter,
+    Function: source_function,
+    StructField: source_structfield,
+    Struct: source_struct,
+    EnumChoice: source_enumchoice,
+    Enum: source_enum,
+}, default=source_unknown)
+
+# ------ Generic traversal
+
+# Yield node and every node underneath it (in no particular order).
+# Lists of statements are walked, but not yielded themselves.
+def walk(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+            continue
+        yield node
+        for name in node._fields:
+            value = getattr(node, name, None)
+            if isinstance(value, (list, Node)):
+                stack.append(value)
+
+# ------ Flat representation
+#
+# For very large programs, the model can also be stored in a flat
+# "arena" instead of as a tree of objects.  Every node gets an integer
+# id and its contents are kept in a few parallel arrays:
+#
+#    kinds     - Class of each node (an index into arena_classes)
+#    linenos   - Line number of each node (0 if unknown)
+#    types     - Type of each expression as filled in by the type
+#                checker (an index into the string pool, -1 if not set)
+#    offsets   - Where the fields of each node start in operands
+#    operands  - Encoded fields of all nodes
+#
+# Annotations (address, size, operation and digest) are only made on some
+# nodes and are kept in a dict, notes, keyed by (id, name).
+#
+# A node's fields are encoded in the order of its __slots__ according to
+# the layout string below:
+#
+#    N  - A node.  Its id (-1 for None)
+#    S  - A string.  An index into the string pool (-1 for None)
+#    B  - A bool.  0 or 1
+#    L  - A list of nodes.  The offset of the list in operands.  There,
+#         the number of items is followed by their ids.
+#
+# There are two ways to look at the nodes.  Code written for the arena
+# works on ids:  arena.walk(n) gives the ids of a node and everything
+# under it, and arena.get(n, name) reads one field.  Both go through
+# tables indexed by the kind of node and make no objects, so walking
+# an arena by id is about as fast as walking the tree of objects.
+#
+# Code written for the model (to_source(), the type checker,
+# interpreter, IR generator, etc.) works on views instead.
+# arena.node(n) returns a view object for node n that is an instance of
+# the original model class.  For example, the view of a BinOp is an
+# instance of BinOp and has attributes op, left and right.  Views are
+# made on demand as the tree is walked and hold nothing but the arena
+# and id, so that code works on the arena without any change, and no
+# per-node objects are kept around.  But a new view is made on every
+# access, so it runs about two to three times slower than on the tree
+# of objects (see bench/arena.py).  Building the arena while parsing is
+# also about twice as slow.  So, except for walking by id, the arena
+# only saves memory (it takes about a fifth of the tree) and costs time.
+
+layouts = {
+    Integer: 'S', Float: 'S', Char: 'S', Bool: 'B', Unit: '',
+    Name: 'S', Attribute: 'NS', UnaryOp: 'SN', BinOp: 'SNN',
+    Call: 'SL', EnumValue: 'SSN', Match: 'NL', MatchCase: 'SSN',
+    Compound: 'L', Print: 'N', Assignment: 'NN', Variable: 'SSN',
+    Const: 'SSN', If: 'NLL', While: 'NL', Break: '', Continue: '',
+    Return: 'N', ExprStatement: 'N', Parameter: 'SS', Function: 'SLSL',
+    StructField: 'SS', Struct: 'SL', EnumChoice: 'SS', Enum: 'SL',
+    Program: 'L',
+}
+
+arena_classes = list(layouts)
+
+# Tables indexed by the kind of node (the position of its class in
+# arena_classes):  where its node fields and list fields are in its
+# operands, and the position and layout letter of each field by name
+node_fields = [ tuple(i for i, kind in enumerate(layouts[cls]) if kind == 'N') for cls in arena_classes ]
+list_fields = [ tuple(i for i, kind in enumerate(layouts[cls]) if kind == 'L') for cls in arena_classes ]
+field_positions = [ { name: (i, kind) for i, (name, kind) in enumerate(zip(cls._fields, layouts[cls])) }
+                    for cls in arena_classes ]
+
+class Arena:
+    def __init__(self):
+        self.kinds = array('B')
+        self.linenos = array('I')
+        self.types = array('i')
+        self.offsets = array('I')
+        self.operands = array('i')
+        self.strings = [ ]
+        self.string_index = { }
+        self.notes = { }
+        self.codes = { cls: n for n, cls in enumerate(arena_classes) }
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def intern(self, text):
+        if text is None:
+            return -1
+        n = self.string_index.get(text)
+        if n is None:
+            n = self.string_index[text] = len(self.strings)
+            self.strings.append(text)
+        return n
+
+    def string(self, n):
+        return self.strings[n] if n >= 0 else None
+
+    def node(self, n):
+        if n < 0:
+            return None
+        view = object.__new__(views[self.kinds[n]])
+        view.arena = self
+        view.id = n
+        return view
+
+    def nodes(self, offset):
+        count = self.operands[offset]
+        return [ self.node(n) for n in self.operands[offset+1:offset+1+count] ]
+
+    def kind(self, n):
+        return arena_classes[self.kinds[n]]
+
+    # Field name of node n, without making a view.  Nodes come back as
+    # ids (-1 for None) and lists of nodes as lists of ids.
+    def get(self, n, name):
+        i, kind = field_positions[self.kinds[n]][name]
+        value = self.operands[self.offsets[n] + i]
+        if kind == 'S':
+            return self.string(value)
+        elif kind == 'B':
+            return bool(value)
+        elif kind == 'L':
+            return self.operands[value+1:value+1+self.operands[value]].tolist()
+        return value
+
+    # Ids of node n and everything underneath it, parents before their
+    # children (like walk(), without making views)
+    def walk(self, n):
+        kinds = self.kinds
+        offsets = self.offsets
+        operands = self.operands
+        stack = [ n ]
+        while stack:
+            n = stack.pop()
+            yield n
+            base = offsets[n]
+            kind = kinds[n]
+            for i in node_fields[kind]:
+                child = operands[base + i]
+                if child >= 0:
+                    stack.append(child)
+            for i in list_fields[kind]:
+                offset = operands[base + i]
+                stack.extend(operands[offset+1:offset+1+operands[offset]])
+
+    # Add a node and everything underneath it.  Returns the id of the
+    # node.  Children are added before their parents.  A subtree that
+    # appears more than once is only added once.
+    def add(self, root):
+        order = [ ]
+        ids = { }
+        stack = [ (root, False) ]
+        while stack:
+            node, visited = stack.pop()
+            if visited:
+                if id(node) not in ids:
+                    ids[id(node)] = None
+                    order.append(node)
+                continue
+            stack.append((node, True))
+            for name, kind in zip(node._fields, layouts[type(node)]):
+                value = getattr(node, name)
+                if kind == 'N' and value is not None:
+                    stack.append((value, False))
+                elif kind == 'L':
+                    stack.extend((item, False) for item in reversed(value))
+        for node in order:
+            ids[id(node)] = self.append(node, ids)
+        return ids[id(root)]
+
+    def append(self, node, ids):
+        cls = type(node)
+        n = len(self.kinds)
+        self.kinds.append(self.codes[cls])
+        self.linenos.append(getattr(node, 'lineno', 0))
+        self.types.append(self.intern(getattr(node, 'type', None)) if isinstance(node, Expression) else -1)
+        operands = self.operands
+        base = len(operands)
+        self.offsets.append(base)
+        layout = layouts[cls]
+        operands.extend([0] * len(layout))
+        for i, (name, kind) in enumerate(zip(cls._fields, layout)):
+            value = getattr(node, name)
+            if kind == 'N':
+                operands[base+i] = ids[id(value)] if value is not None else -1
+            elif kind == 'S':
+                operands[base+i] = self.intern(value)
+            elif kind == 'B':
+                operands[base+i] = int(value)
+            else:
+                operands[base+i] = len(operands)
+                operands.append(len(value))
+                operands.extend(ids[id(item)] for item in value)
+        for name in annotations:
+            value = getattr(node, name, None)
+            if value is not None:
+                self.notes[n, name] = value
+        return n
+
+    # Approximate memory used (in bytes) by the arrays and strings
+    def nbytes(self):
+        import sys
+        return (sum(a.itemsize * len(a) for a in (self.kinds, self.linenos, self.types,
+                                                   self.offsets, self.operands))
+                + sum(sys.getsizeof(text) for text in self.strings))
+
+# Base class of all views.  Views of the same node compare equal.
+class ArenaNode:
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return isinstance(other, ArenaNode) and self.arena is other.arena and self.id == other.id
+
+    def __hash__(self):
+        return hash((id(self.arena), self.id))
+
+def _field(i, kind):
+    if kind == 'N':
+        def get(self):
+            arena = self.arena
+            return arena.node(arena.operands[arena.offsets[self.id] + i])
+        def set(self, value):
+            self.arena.operands[self.arena.offsets[self.id] + i] = value.id if value is not None else -1
+    elif kind == 'S':
+        def get(self):
+            arena = self.arena
+            return arena.string(arena.operands[arena.offsets[self.id] + i])
+        def set(self, value):
+            self.arena.operands[self.arena.offsets[self.id] + i] = self.arena.intern(value)
+    elif kind == 'B':
+        def get(self):
+            arena = self.arena
+            return bool(arena.operands[arena.offsets[self.id] + i])
+        def set(self, value):
+            self.arena.operands[self.arena.offsets[self.id] + i] = int(value)
     else:
-        raise RuntimeError(f"Can't convert {node} to source")
+        def get(self):
+            arena = self.arena
+            return arena.nodes(arena.operands[arena.offsets[self.id] + i])
+        set = None
+    return property(get, set)
+
+def _get_lineno(self):
+    lineno = self.arena.linenos[self.id]
+    if not lineno:
+        raise AttributeError('lineno')
+    return lineno
+
+def _set_lineno(self, lineno):
+    self.arena.linenos[self.id] = lineno
+
+def _get_type(self):
+    n = self.arena.types[self.id]
+    if n < 0:
+        raise AttributeError('type')
+    return self.arena.strings[n]
+
+def _set_type(self, type):
+    self.arena.types[self.id] = self.arena.intern(type)
+
+def _note(name):
+    def get(self):
+        try:
+            return self.arena.notes[self.id, name]
+        except KeyError:
+            raise AttributeError(name) from None
+    def set(self, value):
+        self.arena.notes[self.id, name] = value
+    return property(get, set)
 
+def _make_view(cls):
+    namespace = { '__slots__': ('arena', 'id'), '__module__': __name__,
+                  '_fields': cls._fields, 'lineno': property(_get_lineno, _set_lineno) }
+    if issubclass(cls, Expression):
+        namespace['type'] = property(_get_type, _set_type)
+    for i, (name, kind) in enumerate(zip(cls._fields, layouts[cls])):
+        namespace[name] = _field(i, kind)
+    for name in annotations:
+        if name in cls.__slots__:
+            namespace[name] = _note(name)
+    return type(f'{cls.__name__}View', (cls, ArenaNode), namespace)
 
+views = [ _make_view(cls) for cls in arena_classes ]
 
-    
+# Make an arena from a sequence of top-level statements (for instance,
+# from parse_toplevel()) and return a view of the whole Program.
+# Statements are added one at a time, so only one of them needs to
+# exist as objects at any time.
+def flatten(statements):
+    arena = Arena()
+    ids = [ arena.add(stmt) for stmt in statements ]
+    code = arena.codes[Program]
+    arena.kinds.append(code)
+    arena.linenos.append(0)
+    arena.types.append(-1)
+    arena.offsets.append(len(arena.operands))
+    arena.operands.append(len(arena.operands) + 1)
+    arena.operands.append(len(ids))
+    arena.operands.extend(ids)
+    return arena.node(len(arena) - 1)
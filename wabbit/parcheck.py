@@ -0,0 +1,167 @@
+# parcheck.py
+#
+# Parallel type checking
+#
+# Once the top-level declarations have been checked (passes 1 and 2 of
+# check_program()), every function body can be checked on its own:
+# it only reads the declarations of globals, structs, enums and other
+# functions' signatures, and only writes to its own nodes and the list
+# of errors.  So pass 3 can be split across processes.
+#
+# Each worker is given the functions, the global declarations and the
+# resolver holding the global scope once, when it starts.  Pickling
+# model nodes is several times slower than checking them, so with the
+# "fork" start method (the default on Linux) they aren't sent at all:
+# the worker inherits them.  After that, workers are only sent the
+# positions of the functions to check, in chunks.
+#
+# A worker resolves the names in a body and checks it just as
+# check_program() would, then sends back what that added to the
+# function's nodes:  its frame size, the address and type of each node
+# (in walk() order) and its errors.  The parent only goes over the
+# nodes of each function once to put these back, which it does while
+# the workers are still busy with the functions after it.  Results are
+# put back in the order the functions appear in the program, so errors
+# are reported the same way whatever the number of workers.
+#
+#     check_program(model, jobs=4)
+#
+# The speedup is capped by design.  The top-level passes and resolving
+# the top-level statements run in the parent only, since every body
+# depends on them.  The results have to be unpickled and put back on
+# the parent's nodes, since those are the nodes the rest of the
+# compiler uses.  On the program of bench/parcheck.py (5000 functions),
+# that work is about a third of checking serially:  22 ms for the top
+# level and 81 ms for the results, out of 327 ms.  So no number of
+# workers makes checking more than about 3x quicker, and less once
+# starting the workers is counted.  On a single CPU, the workers only
+# compete with the parent, and -j 2 takes about 1.7 to 3 times as long
+# as -j 1 (bench/parcheck.py, 500 to 5000 functions).  Only one CPU was
+# available to measure any of this, so the speedup on several cores is
+# an estimate, not a measurement.
+#
+# With a CheckCache, the bodies not found in the cache are checked with
+# check_parallel() instead, which hands back the results themselves.
+# checkcache.py keeps them (and puts back the ones it finds with
+# put_back()).
+
+from concurrent.futures import ProcessPoolExecutor
+
+from .model import *
+from .resolve import resolve_function
+from .typecheck import new_environment, check_function_body
+
+# Resolve and check the bodies of functions using jobs worker processes.
+# The nodes of each function are listed before waiting for its result.
+def check_functions(functions, env, resolver, jobs):
+    errors = env['$errors']
+    with start_pool(functions, env, resolver, jobs) as pool:
+        results = pool.map(resolve_and_check, range(len(functions)),
+                           chunksize=chunksize(functions, jobs))
+        for func in functions:
+            nodes = function_nodes(func)
+            size, addresses, types, func_errors = next(results)
+            put_back(func, nodes, size, addresses, types)
+            errors.extend(func_errors)
+
+# Results of resolving and checking the bodies of functions (in the
+# same order), for checkcache.py
+def check_parallel(functions, env, resolver, jobs):
+    with start_pool(functions, env, resolver, jobs) as pool:
+        return list(pool.map(resolve_and_check, range(len(functions)),
+                             chunksize=chunksize(functions, jobs)))
+
+# Put the frame size and the addresses and types of the nodes (as
+# found by resolve_and_check()) back on a function
+def put_back(func, nodes, size, addresses, types):
+    func.size = size
+    for node, address, nodetype in zip(nodes, addresses, types):
+        if address is not False:
+            node.address = address
+        if nodetype is not None:
+            node.type = nodetype
+
+def start_pool(functions, env, resolver, jobs):
+    return ProcessPoolExecutor(jobs, initializer=start_worker,
+                               initargs=(functions, env.maps[0], env.frames, resolver))
+
+def chunksize(functions, jobs):
+    return max(1, len(functions) // (jobs * 4))
+
+# State of a worker process:  the functions to check, an environment
+# holding the global scope of the program and the resolver for the
+# function bodies
+worker_functions = None
+worker_env = None
+worker_resolver = None
+
+def start_worker(functions, scope, frames, resolver):
+    global worker_functions, worker_env, worker_resolver
+    worker_functions = functions
+    worker_env = new_environment()
+    worker_env.maps[0].update(scope)
+    worker_env.frames = frames
+    worker_resolver = resolver
+
+def resolve_and_check(index):
+    return check_one(worker_functions[index], worker_env, worker_resolver)[1]
+
+# Resolve and check the body of one function.  Returns its nodes (see
+# function_nodes()) and the result:  the frame size of the function, the
+# addresses and types given to its nodes (False and None where there's
+# none) and its errors, which are taken out of env.  Separate lists
+# make fewer objects for the parent to unpickle than a pair for each
+# node.
+def check_one(func, env, resolver):
+    resolve_function(func, resolver)
+    errors = env['$errors']
+    start = len(errors)
+    check_function_body(func, env)
+    func_errors = errors[start:]
+    del errors[start:]
+    nodes = function_nodes(func)
+    return nodes, (func.size, [ getattr(node, 'address', False) for node in nodes ],
+                   [ getattr(node, 'type', None) for node in nodes ], func_errors)
+
+# The nodes of a function in the order walk() yields them, as a list.
+# Only the fields that can hold nodes are looked at (see children
+# below), which makes this about twice as quick as walk().
+def function_nodes(node):
+    nodes = [ ]
+    stack = [ node ]
+    while stack:
+        node = stack.pop()
+        if node.__class__ is list:
+            stack.extend(node)
+            continue
+        nodes.append(node)
+        for name in children[node.__class__]:
+            value = getattr(node, name)
+            if value is not None:
+                stack.append(value)
+    return nodes
+
+# Fields of each kind of node found in a function that hold nodes or
+# lists of nodes (None if absent), in the order of _fields
+children = Dispatch({
+    (Integer, Float, Char, Bool, Unit, Name): (),
+    Attribute: ('value',),
+    UnaryOp: ('operand',),
+    BinOp: ('left', 'right'),
+    Call: ('arguments',),
+    EnumValue: ('value',),
+    Match: ('value', 'cases'),
+    MatchCase: ('value',),
+    Compound: ('statements',),
+    Print: ('value',),
+    Assignment: ('location', 'value'),
+    Variable: ('value',),
+    Const: ('value',),
+    If: ('test', 'consequence', 'alternative'),
+    While: ('test', 'body'),
+    (Break, Continue): (),
+    Return: ('value',),
+    ExprStatement: ('expression',),
+    Parameter: (),
+    Function: ('parameters', 'body'),
+}, default=None)
@@ -158,23 +158,542 @@
 # onto the programs in tests/Script to test more features.
 #
 
+import hashlib
+from array import array
+from ast import literal_eval
+
 from .model import *
-from .tokenize import tokenize
+from .tokenize import tokenize, tokenize_file, TokenStream, token_types
+
+# The parser reads tokens through a small "cursor" object that always
+# holds the current (lookahead) token.  There are two kinds of cursor.
+# TokenCursor works on any iterable of Token objects (for example, the
+# generator returned by tokenize()).  StreamCursor works directly on the
+# columns of a TokenStream--no Token objects are ever created and token
+# values are only sliced out of the source when the parser needs them.
+#
+# Both can also give a digest of the tokens between a mark() and the
+# current token (see digest_tokens() below).  TokenCursor has to keep
+# those tokens until then.  StreamCursor has them in the stream
+# already.
+
+class TokenCursor:
+    def __init__(self, tokens):
+        self.tokens = iter(tokens)
+        self.lineno = 1
+        self.recorded = None      # Tokens since the first open mark()
+        self.marks = 0            # Number of open marks
+        self.advance()
+
+    def advance(self):
+        self.token = tok = next(self.tokens, None)
+        if tok:
+            self.type = tok.type
+            self.value = tok.value
+            self.lineno = tok.lineno
+        else:
+            self.type = 'EOF'
+            self.value = None
+        if self.recorded is not None:
+            self.recorded.append(tok)
+
+    def mark(self):
+        if self.recorded is None:
+            self.recorded = [ self.token ]
+        self.marks += 1
+        return len(self.recorded) - 1
+
+    def digest(self, mark):
+        tokens = self.recorded[mark:-1]
+        self.marks -= 1
+        if not self.marks:
+            self.recorded = None
+        return digest_tokens(' '.join([ tok.value for tok in tokens ]).encode(),
+                             [ tok.lineno for tok in tokens ])
+
+class StreamCursor:
+    def __init__(self, stream):
+        self.stream = stream
+        self.types = stream.types
+        self.linenos = stream.linenos
+        self.ntokens = len(stream)
+        self.n = -1
+        self.lineno = 1
+        self.advance()
+
+    def advance(self):
+        self.n += 1
+        if self.n < self.ntokens:
+            self.type = token_types[self.types[self.n]]
+            self.lineno = self.linenos[self.n]
+        else:
+            self.type = 'EOF'
+
+    @property
+    def value(self):
+        return self.stream.value(self.n) if self.n < self.ntokens else None
+
+    def mark(self):
+        return self.n
+
+    # The value of every token is its text in the source, so the values
+    # are sliced straight out of the buffer
+    def digest(self, mark):
+        stream = self.stream
+        values = map(stream.buffer.__getitem__,
+                     map(slice, stream.starts[mark:self.n], stream.ends[mark:self.n]))
+        if isinstance(stream.buffer, str):
+            text = ' '.join(values).encode()
+        else:
+            text = b' '.join(values)
+        return digest_tokens(text, self.linenos[mark:self.n])
+
+# Digest of a run of tokens from their values (joined by spaces, as
+# UTF-8) and their line numbers.  Line numbers are taken relative to
+# the first token, so the same tokens get the same digest wherever they
+# are in the file.
+def digest_tokens(text, linenos):
+    first = linenos[0] if linenos else 0
+    digest = hashlib.blake2b(text, digest_size=16)
+    digest.update(array('I', [ lineno - first for lineno in linenos ]).tobytes())
+    return digest.hexdigest()
+
+def make_cursor(tokens):
+    if isinstance(tokens, TokenStream):
+        return StreamCursor(tokens)
+    else:
+        return TokenCursor(tokens)
+
+# Helper functions for matching tokens
+
+def peek(tokens, *types):
+    return tokens.type in types
+
+def accept(tokens, toktype):
+    # Consume the next token if it matches the given type.  Returns the
+    # token value (always non-empty) or None.
+    if tokens.type == toktype:
+        value = tokens.value
+        tokens.advance()
+        return value
+    return None
+
+def expect(tokens, toktype):
+    if tokens.type != toktype:
+        found = repr(tokens.value) if tokens.type != 'EOF' else 'end of input'
+        raise SyntaxError(f'{tokens.lineno}: Expected {toktype}, got {found}')
+    value = tokens.value
+    tokens.advance()
+    return value
+
+def located(node, lineno):
+    # Record the source line number on a node
+    node.lineno = lineno
+    return node
 
 # Top-level function that runs everything    
 def parse_source(text):
     tokens = tokenize(text)
-    model = parse_tokens(tokens)     # You need to implement this part
+    model = parse_tokens(tokens)
     return model
 
+# Parse a program from tokens.  tokens may be any iterable producing
+# Token objects or a TokenStream.
 def parse_tokens(tokens):
-    ...
+    tokens = make_cursor(tokens)
+    statements = parse_statements(tokens)
+    expect(tokens, 'EOF')
+    return Program(statements)
+
+# Parse a program one top-level statement at a time.  Tokens are only
+# read as far as needed, so later stages can start working on the
+# first statements while the rest of the input is still unread.
+def parse_toplevel(tokens):
+    tokens = make_cursor(tokens)
+    while not peek(tokens, 'EOF'):
+        yield parse_statement(tokens)
+
+# statements : { statement }
+def parse_statements(tokens):
+    statements = [ ]
+    while not peek(tokens, 'RBRACE', 'EOF'):
+        statements.append(parse_statement(tokens))
+    return statements
+
+# Parse statements enclosed in { }
+def parse_block(tokens):
+    expect(tokens, 'LBRACE')
+    statements = parse_statements(tokens)
+    expect(tokens, 'RBRACE')
+    return statements
+
+def parse_statement(tokens):
+    lineno = tokens.lineno
+    toktype = tokens.type
+    if toktype in statement_parsers:
+        node = statement_parsers[toktype](tokens)
+    else:
+        node = parse_expression_statement(tokens)
+    return located(node, lineno)
+
+# print_statement : PRINT expression SEMI
+def parse_print_statement(tokens):
+    expect(tokens, 'PRINT')
+    value = parse_expression(tokens)
+    expect(tokens, 'SEMI')
+    return Print(value)
 
-# Example of a main program
+# variable_definition : VAR NAME [ type ] [ ASSIGN expression ] SEMI
+def parse_variable_definition(tokens):
+    expect(tokens, 'VAR')
+    name = expect(tokens, 'NAME')
+    type = accept(tokens, 'NAME')
+    value = parse_expression(tokens) if accept(tokens, 'ASSIGN') else None
+    expect(tokens, 'SEMI')
+    return Variable(name, type, value)
+
+# const_definition : CONST NAME [ type ] ASSIGN expression SEMI
+def parse_const_definition(tokens):
+    expect(tokens, 'CONST')
+    name = expect(tokens, 'NAME')
+    type = accept(tokens, 'NAME')
+    expect(tokens, 'ASSIGN')
+    value = parse_expression(tokens)
+    expect(tokens, 'SEMI')
+    return Const(name, type, value)
+
+# func_definition : FUNC NAME LPAREN [ parameters ] RPAREN [ type ] LBRACE statements RBRACE
+# parameters : parameter { COMMA parameter }
+# parameter : NAME type
+def parse_func_definition(tokens):
+    mark = tokens.mark()
+    expect(tokens, 'FUNC')
+    name = expect(tokens, 'NAME')
+    expect(tokens, 'LPAREN')
+    parameters = [ ]
+    while not peek(tokens, 'RPAREN'):
+        lineno = tokens.lineno
+        pname = expect(tokens, 'NAME')
+        ptype = expect(tokens, 'NAME')
+        parameters.append(located(Parameter(pname, ptype), lineno))
+        if not accept(tokens, 'COMMA'):
+            break
+    expect(tokens, 'RPAREN')
+    rettype = accept(tokens, 'NAME') or 'unit'
+    body = parse_block(tokens)
+    func = Function(name, parameters, rettype, body)
+    func.digest = tokens.digest(mark)
+    return func
+
+# struct_definition : STRUCT NAME LBRACE { struct_field } RBRACE
+# struct_field : NAME type SEMI
+def parse_struct_definition(tokens):
+    expect(tokens, 'STRUCT')
+    name = expect(tokens, 'NAME')
+    expect(tokens, 'LBRACE')
+    fields = [ ]
+    while not peek(tokens, 'RBRACE'):
+        lineno = tokens.lineno
+        fname = expect(tokens, 'NAME')
+        ftype = expect(tokens, 'NAME')
+        expect(tokens, 'SEMI')
+        fields.append(located(StructField(fname, ftype), lineno))
+    expect(tokens, 'RBRACE')
+    return Struct(name, fields)
+
+# enum_definition : ENUM NAME LBRACE { enum_choice } RBRACE
+# enum_choice : NAME [ LPAREN type RPAREN ] SEMI
+def parse_enum_definition(tokens):
+    expect(tokens, 'ENUM')
+    name = expect(tokens, 'NAME')
+    expect(tokens, 'LBRACE')
+    choices = [ ]
+    while not peek(tokens, 'RBRACE'):
+        lineno = tokens.lineno
+        cname = expect(tokens, 'NAME')
+        ctype = None
+        if accept(tokens, 'LPAREN'):
+            ctype = expect(tokens, 'NAME')
+            expect(tokens, 'RPAREN')
+        expect(tokens, 'SEMI')
+        choices.append(located(EnumChoice(cname, ctype), lineno))
+    expect(tokens, 'RBRACE')
+    return Enum(name, choices)
+
+# if_statement : IF expression LBRACE statements RBRACE [ ELSE LBRACE statements RBRACE ]
+def parse_if_statement(tokens):
+    expect(tokens, 'IF')
+    test = parse_expression(tokens)
+    consequence = parse_block(tokens)
+    alternative = parse_block(tokens) if accept(tokens, 'ELSE') else [ ]
+    return If(test, consequence, alternative)
+
+# while_statement : WHILE expression LBRACE statements RBRACE
+def parse_while_statement(tokens):
+    expect(tokens, 'WHILE')
+    test = parse_expression(tokens)
+    body = parse_block(tokens)
+    return While(test, body)
+
+# break_statement : BREAK SEMI
+def parse_break_statement(tokens):
+    expect(tokens, 'BREAK')
+    expect(tokens, 'SEMI')
+    return Break()
+
+# continue_statement : CONTINUE SEMI
+def parse_continue_statement(tokens):
+    expect(tokens, 'CONTINUE')
+    expect(tokens, 'SEMI')
+    return Continue()
+
+# return_statement : RETURN [ expression ] SEMI
+def parse_return_statement(tokens):
+    lineno = tokens.lineno
+    expect(tokens, 'RETURN')
+    if peek(tokens, 'SEMI'):
+        value = located(Unit(), lineno)
+    else:
+        value = parse_expression(tokens)
+    expect(tokens, 'SEMI')
+    return Return(value)
+
+# assignment_statement : location ASSIGN expression SEMI
+#                      / expression SEMI
+#
+# A location is also an expression.  So, the left hand side is parsed
+# as an expression first.  If it's followed by '=', it must turn out to
+# be a location.
+def parse_expression_statement(tokens):
+    lineno = tokens.lineno
+    expression = parse_expression(tokens)
+    if accept(tokens, 'ASSIGN'):
+        if not isinstance(expression, (Name, Attribute)):
+            raise SyntaxError(f"{lineno}: Can't assign to {to_source(expression)}")
+        value = parse_expression(tokens)
+        expect(tokens, 'SEMI')
+        return Assignment(expression, value)
+    expect(tokens, 'SEMI')
+    return ExprStatement(expression)
+
+statement_parsers = {
+    'PRINT': parse_print_statement,
+    'VAR': parse_variable_definition,
+    'CONST': parse_const_definition,
+    'FUNC': parse_func_definition,
+    'STRUCT': parse_struct_definition,
+    'ENUM': parse_enum_definition,
+    'IF': parse_if_statement,
+    'WHILE': parse_while_statement,
+    'BREAK': parse_break_statement,
+    'CONTINUE': parse_continue_statement,
+    'RETURN': parse_return_statement,
+}
+
+# Expressions.
+#
+# expression : orterm { LOR orterm }
+# orterm : andterm { LAND andterm }
+# andterm : sumterm [ LT/LE/GT/GE/EQ/NE sumterm ]
+# sumterm : multerm { PLUS/MINUS multerm }
+# multerm : factor { TIMES/DIVIDE factor }
+# factor : PLUS factor / MINUS factor / LNOT factor
+#        / primary { DOT NAME }
+# primary : INTEGER / FLOAT / CHAR / TRUE / FALSE
+#         / LPAREN RPAREN
+#         / LPAREN expression RPAREN
+#         / LBRACE statements RBRACE
+#         / MATCH expression LBRACE { matchcase } RBRACE
+#         / NAME DCOLON NAME [ LPAREN expression RPAREN ]
+#         / NAME LPAREN [ expression { COMMA expression } ] RPAREN
+#         / NAME
+#
+# Rather than having one recursive function per level of precedence,
+# expressions are parsed by operator precedence using explicit stacks.
+# Finished expressions are pushed onto an operand stack.  Operators
+# wait on an operator stack until an operator of lower (or equal)
+# precedence shows up, at which point they are "reduced" into a BinOp
+# or UnaryOp.  Parentheses, function call arguments and enum values
+# push a marker onto the operator stack that stops reductions until the
+# closing ')' is seen.  Nesting depth is thus limited only by memory and
+# every token is handled in constant time.
+
+binary_precedence = {
+    'LOR': 1,
+    'LAND': 2,
+    'LT': 3, 'LE': 3, 'GT': 3, 'GE': 3, 'EQ': 3, 'NE': 3,
+    'PLUS': 4, 'MINUS': 4,
+    'TIMES': 5, 'DIVIDE': 5,
+}
+relation_precedence = 3
+unary_precedence = 6
+
+# Entries on the operator stack.  (kind, value, lineno, extra)
+BINARY = 0          # value is the op, extra is the precedence
+UNARY = 1           # value is the op
+PAREN = 2           # (expression)
+CALL = 3            # value is the function name, extra is the argument list
+ENUM = 4            # value is (enum, choice)
+
+def parse_expression(tokens):
+    operands = [ ]              # Parsed expressions
+    operators = [ ]             # Pending operators and open parentheses
+    relation = None             # Last relation reduced (to catch a < b < c)
+
+    # Reduce pending operators with precedence >= prec, stopping at
+    # an open parenthesis
+    def reduce(prec):
+        nonlocal relation
+        while operators:
+            kind, value, lineno, extra = operators[-1]
+            if kind == BINARY and extra >= prec:
+                right = operands.pop()
+                operands[-1] = located(BinOp(value, operands[-1], right), lineno)
+                if extra == relation_precedence:
+                    relation = operands[-1]
+            elif kind == UNARY:
+                operands[-1] = located(UnaryOp(value, operands[-1]), lineno)
+            else:
+                break
+            operators.pop()
+
+    # Alternate between expecting an operand and expecting an operator
+    while True:
+        # Operand position: any number of unary operators and open
+        # parentheses, then a primary
+        lineno = tokens.lineno
+        toktype = tokens.type
+        if toktype == 'PLUS' or toktype == 'MINUS' or toktype == 'LNOT':
+            operators.append((UNARY, accept(tokens, toktype), lineno, unary_precedence))
+            continue
+        elif toktype == 'LPAREN':
+            tokens.advance()
+            if accept(tokens, 'RPAREN'):
+                operands.append(located(Unit(), lineno))
+            else:
+                operators.append((PAREN, None, lineno, None))
+                continue
+        elif toktype == 'NAME':
+            name = accept(tokens, 'NAME')
+            if accept(tokens, 'DCOLON'):
+                choice = expect(tokens, 'NAME')
+                if accept(tokens, 'LPAREN'):
+                    operators.append((ENUM, (name, choice), lineno, None))
+                    continue
+                operands.append(located(EnumValue(name, choice, None), lineno))
+            elif accept(tokens, 'LPAREN'):
+                if accept(tokens, 'RPAREN'):
+                    operands.append(located(Call(name, [ ]), lineno))
+                else:
+                    operators.append((CALL, name, lineno, [ ]))
+                    continue
+            else:
+                operands.append(located(Name(name), lineno))
+        else:
+            operands.append(parse_primary(tokens))
+
+        # Operator position.  Postfix '.name' applies immediately to the
+        # last operand since it binds tighter than anything else.
+        while True:
+            if tokens.type == 'DOT':
+                lineno = tokens.lineno
+                tokens.advance()
+                operands[-1] = located(Attribute(operands[-1], expect(tokens, 'NAME')), lineno)
+                continue
+
+            toktype = tokens.type
+            if toktype in binary_precedence:
+                lineno = tokens.lineno
+                prec = binary_precedence[toktype]
+                reduce(prec)
+                if prec == relation_precedence and operands[-1] is relation:
+                    raise SyntaxError(f'{lineno}: Relations may not be chained')
+                operators.append((BINARY, accept(tokens, toktype), lineno, prec))
+                break
+
+            elif toktype == 'RPAREN' or toktype == 'COMMA':
+                reduce(0)
+                if not operators:
+                    # Belongs to an enclosing construct
+                    return operands.pop()
+                kind, value, lineno, extra = operators[-1]
+                if toktype == 'COMMA':
+                    if kind != CALL:
+                        expect(tokens, 'RPAREN')
+                    extra.append(operands.pop())
+                    tokens.advance()
+                    break
+                tokens.advance()
+                operators.pop()
+                if kind == PAREN:
+                    # (a < b) < c is allowed
+                    relation = None
+                elif kind == CALL:
+                    extra.append(operands.pop())
+                    operands.append(located(Call(value, extra), lineno))
+                else:
+                    operands[-1] = located(EnumValue(*value, operands[-1]), lineno)
+                continue
+
+            else:
+                # End of the expression
+                reduce(0)
+                if operators:
+                    expect(tokens, 'RPAREN')
+                return operands.pop()
+
+# Primaries that don't involve operators or parentheses.  These are
+# parsed directly.
+def parse_primary(tokens):
+    lineno = tokens.lineno
+    toktype = tokens.type
+    if toktype == 'INTEGER':
+        node = Integer(accept(tokens, 'INTEGER'))
+    elif toktype == 'FLOAT':
+        node = Float(accept(tokens, 'FLOAT'))
+    elif toktype == 'CHAR':
+        node = Char(literal_eval(accept(tokens, 'CHAR')))
+    elif toktype == 'TRUE' or toktype == 'FALSE':
+        node = Bool(accept(tokens, toktype) == 'true')
+    elif toktype == 'LBRACE':
+        node = Compound(parse_block(tokens))
+    elif toktype == 'MATCH':
+        node = parse_match(tokens)
+    else:
+        found = repr(tokens.value) if toktype != 'EOF' else 'end of input'
+        raise SyntaxError(f'{lineno}: Syntax error at {found}')
+    return located(node, lineno)
+
+# match : MATCH expression LBRACE { matchcase } RBRACE
+# matchcase : NAME [ LPAREN NAME RPAREN ] ARROW expression SEMI
+def parse_match(tokens):
+    expect(tokens, 'MATCH')
+    value = parse_expression(tokens)
+    expect(tokens, 'LBRACE')
+    cases = [ ]
+    while not peek(tokens, 'RBRACE'):
+        lineno = tokens.lineno
+        choice = expect(tokens, 'NAME')
+        binding = None
+        if accept(tokens, 'LPAREN'):
+            binding = expect(tokens, 'NAME')
+            expect(tokens, 'RPAREN')
+        expect(tokens, 'ARROW')
+        result = parse_expression(tokens)
+        expect(tokens, 'SEMI')
+        cases.append(located(MatchCase(choice, binding, result), lineno))
+    expect(tokens, 'RBRACE')
+    return Match(value, cases)
+
+# Example of a main program.  The file is tokenized directly from
+# a memory-mapped buffer rather than being read into memory first.
 def parse_file(filename):
-    with open(filename) as file:
-        text = file.read()
-    return parse_source(text)
+    return parse_tokens(tokenize_file(filename))
+
+# Parse a file into the flat representation (see flatten() in model.py).
+# Statements go into the arena as they're parsed.
+def parse_file_flat(filename):
+    return flatten(parse_toplevel(tokenize_file(filename)))
 
 if __name__ == '__main__':
     import sys
@@ -182,5 +701,3 @@ if __name__ == '__main__':
         raise SystemExit('Usage: wabbit.parse filename')
     model = parse_file(sys.argv[1])
     print(model)
-
-
@@ -0,0 +1,280 @@
+# profiler.py
+#
+# Execution profiler for the interpreter
+#
+# Shows where a Wabbit program spends its time.  The interpreter runs
+# the program with its dispatch function and statement handlers
+# replaced by a Profiler's (see interp.profile_program()), which
+# records:
+#
+#   - how many nodes are executed on each source line
+#   - the time spent on each source line (not counting lines run from
+#     it, such as the body of a called function)
+#   - the chain of function calls that led there
+#
+# Calls are kept as a tree of CallPaths, one for each distinct chain
+# of calls (main -> fib -> fib is a different path than main -> fib).
+# Each path has its own times and counts, both lists indexed by line
+# number.  From these, the profiler can make a report of the hottest
+# lines and functions, and "collapsed stacks" (one line per path:
+# "main;fib;fib 1234", the number being microseconds) which can be
+# turned into a flame graph with flamegraph.pl or speedscope.
+#
+# Time is measured with a clock reading whenever execution moves to
+# a statement on another line and at the end of a block of statements
+# (back to the line before it), not on every node, which keeps the
+# overhead down.  Expressions aren't wrapped at all (an extra Python
+# call for every node would about double the cost of running an
+# expression).  Their time goes to the line of the statement they're
+# part of, and they're counted a statement at a time:  before the run,
+# each statement is weighed (the number of nodes it runs), and running
+# it adds that to its line.  Where the number can vary (the test of a
+# while loop, the right side of && and ||, match and compound
+# expressions), the statement is counted as it runs instead, node by
+# node, by the dispatch function.  A statement that fails partway
+# still counts all of its nodes.
+#
+#     profiler = Profiler()
+#     interp.profile_program(model, profiler)     # Calls profiler.start(model)
+#     print(profiler.report(source_lines))
+#     profiler.write_collapsed('prog.folded')
+
+import time
+
+from .model import *
+
+TOP = '<top>'
+
+class CallPath:
+    __slots__ = ('name', 'parent', 'children', 'calls', 'times', 'counts')
+
+    def __init__(self, name, nlines, parent=None):
+        self.name = name
+        self.parent = parent
+        self.children = { }
+        self.calls = 0
+        self.times = [ 0.0 ] * nlines    # Seconds by line number
+        self.counts = [ 0 ] * nlines     # Nodes executed by line number
+
+    def child(self, name):
+        path = self.children.get(name)
+        if path is None:
+            path = self.children[name] = CallPath(name, len(self.times), self)
+        return path
+
+    def names(self):
+        names = [ ]
+        path = self
+        while path is not None:
+            names.append(path.name)
+            path = path.parent
+        return names[::-1]
+
+    def walk(self):
+        stack = [ self ]
+        while stack:
+            path = stack.pop()
+            yield path
+            stack.extend(path.children.values())
+
+class Profiler:
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.root = self.path = None
+        self.times = None                # Times of the current path
+        self.counts = None               # Counts of the current path
+        self.line = 0
+        self.last = None
+        self.weights = { }               # Statement -> (nodes, varies)
+        self.dynamic = False             # Count nodes one by one?
+
+    def start(self, model):
+        nlines = 1
+        for node in walk(model):
+            nlines = max(nlines, getattr(node, 'lineno', 0) + 1)
+            if not isinstance(node, Expression):
+                self.weights[node] = weigh(node)
+        self.root = self.path = CallPath(TOP, nlines)
+        self.times = self.path.times
+        self.counts = self.path.counts
+        self.last = self.clock()
+
+    def stop(self):
+        self.switch(self.line)
+
+    # Charge the time since the last switch to the current line and
+    # move on to another one
+    def switch(self, line):
+        now = self.clock()
+        self.times[self.line] += now - self.last
+        self.last = now
+        self.line = line
+
+    # Make the function that runs a node, interpret(node, env), given
+    # the handlers for each class of node.  Nodes are only counted here
+    # while running a statement whose count can vary.
+    def wrap_interpret(self, handlers):
+        def interpret(node, env):
+            cls = type(node)
+            if self.dynamic and cls is not list:
+                self.counts[node.lineno] += 1
+            return handlers[cls](node, env)
+        return interpret
+
+    # Wrap the handler for a class of statements, handler(node, env).
+    # Running a statement on another line moves to that line.  Moving
+    # back happens when the block the statement is in ends (see
+    # wrap_block()), so that each statement reads the clock once, not
+    # twice.
+    def wrap(self, handler):
+        clock = self.clock
+        weights = self.weights
+        def profiled(node, env):
+            line = getattr(node, 'lineno', 0)
+            if line != self.line:
+                now = clock()
+                self.times[self.line] += now - self.last
+                self.last = now
+                self.line = line
+            nodes, varies = weights[node]
+            if self.dynamic:
+                nodes -= 1               # The statement itself was counted by interpret()
+            self.counts[line] += nodes
+            self.dynamic = varies
+            return handler(node, env)
+        return profiled
+
+    # Wrap the handler for a block of statements (a list of them, or a
+    # compound expression).  Afterwards, time goes to the line that was
+    # current before it again, and nodes are counted the way they were
+    # (the statements in it change that, see wrap()).
+    def wrap_block(self, handler):
+        def profiled(node, env):
+            saved, dynamic = self.line, self.dynamic
+            try:
+                return handler(node, env)
+            finally:
+                self.dynamic = dynamic
+                if self.line != saved:
+                    self.switch(saved)
+        return profiled
+
+    # Wrap the function that calls Wabbit functions, call(func, args, env)
+    def wrap_call(self, call):
+        def profiled(func, args, env):
+            saved = self.path, self.line
+            self.switch(getattr(func, 'lineno', 0))
+            self.path = self.path.child(func.name)
+            self.path.calls += 1
+            self.times = self.path.times
+            self.counts = self.path.counts
+            try:
+                return call(func, args, env)
+            finally:
+                self.switch(saved[1])
+                self.path = saved[0]
+                self.times = self.path.times
+                self.counts = self.path.counts
+        return profiled
+
+    # ---- Results
+
+    # (function, line) -> [ executions, seconds ]
+    def lines(self):
+        lines = { }
+        for path in self.root.walk():
+            for line, (count, seconds) in enumerate(zip(path.counts, path.times)):
+                if not (count or seconds):
+                    continue
+                entry = lines.setdefault((path.name, line), [ 0, 0.0 ])
+                entry[0] += count
+                entry[1] += seconds
+        return lines
+
+    # function -> [ calls, executions, seconds in the function,
+    # seconds including the functions it calls ].  Time in a recursive
+    # call is only counted once in the total.
+    def functions(self):
+        functions = { }
+        stack = [ (self.root, frozenset()) ]
+        inclusive = self.inclusive_times()
+        while stack:
+            path, outer = stack.pop()
+            entry = functions.setdefault(path.name, [ 0, 0, 0.0, 0.0 ])
+            entry[0] += path.calls
+            entry[1] += sum(path.counts)
+            entry[2] += sum(path.times)
+            if path.name not in outer:
+                entry[3] += inclusive[path]
+            inner = outer | { path.name }
+            stack.extend((child, inner) for child in path.children.values())
+        return functions
+
+    def inclusive_times(self):
+        paths = list(self.root.walk())
+        inclusive = { }
+        for path in reversed(paths):
+            inclusive[path] = (sum(path.times)
+                               + sum(inclusive[child] for child in path.children.values()))
+        return inclusive
+
+    def collapsed(self):
+        result = [ ]
+        for path in self.root.walk():
+            micros = round(sum(path.times) * 1e6)
+            if micros:
+                result.append(f'{";".join(path.names())} {micros}')
+        return sorted(result)
+
+    def write_collapsed(self, filename):
+        with open(filename, 'w') as file:
+            for line in self.collapsed():
+                print(line, file=file)
+
+    # Hot spot report.  source is the lines of the program (to show
+    # the source of each line), count the number of lines to show.
+    def report(self, source=None, count=20):
+        lines = self.lines()
+        total = sum(seconds for _, seconds in lines.values()) or 1.0
+        out = [ f'{"line":>6s} {"count":>10s} {"time":>9s} {"%":>6s}  function' ]
+        ordered = sorted(lines.items(), key=lambda item: item[1][1], reverse=True)
+        for (name, line), (executions, seconds) in ordered[:count]:
+            text = source[line-1].strip() if source and 0 < line <= len(source) else ''
+            out.append(f'{line:6d} {executions:10d} {seconds*1e3:7.1f}ms '
+                       f'{seconds/total*100:5.1f}%  {name:12s} {text}')
+        out.append('')
+        out.append(f'{"function":20s} {"calls":>8s} {"count":>10s} {"self":>9s} {"total":>9s}')
+        functions = sorted(self.functions().items(), key=lambda item: item[1][2], reverse=True)
+        for name, (calls, executions, own, inclusive) in functions[:count]:
+            out.append(f'{name:20s} {calls:8d} {executions:10d} {own*1e3:7.1f}ms {inclusive*1e3:7.1f}ms')
+        return '\n'.join(out)
+
+# The weight of a statement:  (nodes, varies), the number of nodes
+# run each time it runs, and whether that can vary (if so, nodes is 1
+# and the rest are counted as they run).  Nodes in blocks of
+# statements aren't included (those statements count themselves).
+def weigh(stmt):
+    if isinstance(stmt, While):
+        return 1, True
+    nodes = 1
+    exprs = [ getattr(stmt, field) for field in evaluated_fields[type(stmt)] ]
+    if isinstance(stmt, Assignment) and isinstance(stmt.location, Attribute):
+        exprs.append(stmt.location.value)
+    for expr in exprs:
+        if expr is None:
+            continue
+        for node in walk(expr):
+            if isinstance(node, (Match, Compound)):
+                return 1, True
+            if isinstance(node, BinOp) and node.op in ('&&', '||'):
+                return 1, True
+            nodes += 1
+    return nodes, False
+
+# Fields of each class of statement holding expressions it evaluates
+# (all of them, every time)
+evaluated_fields = Dispatch({
+    (Print, Assignment, Variable, Const, Return): ('value',),
+    If: ('test',),
+    ExprStatement: ('expression',),
+}, default=())
@@ -0,0 +1,526 @@
+# pycode.py
+#
+# Translation of Wabbit to Python
+#
+# A checked program is turned into Python source code, which is then
+# compile()d and run.  Each Wabbit function becomes a Python def and
+# the statements outside of functions go into a function _init().
+# CPython executes the result as bytecode with no interpretation of
+# the model left, so this is the fastest way of running a program
+# without going through LLVM or Wasm.
+#
+# For example:
+#
+#     func fib(n int) int {              def fib(n):
+#         if n < 2 {                         if (n < 2):
+#             return 1;                          return 1
+#         } else {             ---->         else:
+#             return fib(n-1) + fib(n-2);        return ((fib(...) + fib(...) + ...
+#         }                                  return ()
+#     }
+#
+# Values are the same as in interp.py, so the output is the same:
+#
+#    int    -> Python int.  Arithmetic is wrapped to 32 bits on the spot
+#              and division truncates towards zero.
+#    float  -> Python float
+#    char   -> Python str of length 1
+#    bool   -> Python bool
+#    unit   -> ()
+#    struct -> StructInstance
+#    enum   -> EnumInstance
+#
+# Wabbit has block scoping while Python only has function scopes.  So,
+# every declaration gets a Python name of its own (x, x_1, x_2, ...).
+# Names are chosen so that they never clash with Python keywords or the
+# helpers used by the generated code.  Globals are Python globals.
+#
+# Compound and match expressions contain statements, which a Python
+# expression can't.  Their statements are "lifted" out in front of the
+# statement that contains the expression and the value is left in a
+# temporary variable.  As in ircode.py, values already computed before
+# such an expression are saved in temporaries first so that everything
+# is still evaluated in order.
+#
+#     model = parse_file('prog.wb')
+#     if check_program(model):
+#         source = generate_python(model)
+#         run_python(source)
+
+import builtins
+import keyword
+from collections import ChainMap
+
+from .model import *
+from .interp import StructInstance, EnumInstance, idiv, format_value
+
+# Functions available to the generated code
+helpers = {
+    '_idiv': idiv,
+    '_format': format_value,
+    '_Struct': StructInstance,
+    '_Enum': EnumInstance,
+}
+
+# Names a Wabbit name can't be turned into
+reserved = (set(keyword.kwlist) | set(keyword.softkwlist) | set(dir(builtins))
+            | set(helpers) | { '_init' })
+
+# Expressions nested deeper than this are broken up using temporaries.
+# CPython limits how deeply parentheses may be nested.
+max_depth = 30
+
+class PyContext:
+    def __init__(self):
+        self.lines = [ ]
+        self.indent = '    '
+        self.scope = ChainMap()       # Wabbit name -> Python name (or a Function/Struct/Enum)
+        self.names = set(reserved)    # Python names used so far
+        self.globals = set()          # Globals assigned in the function being made
+        self.ntemps = 0
+        self.measured = { }           # id(expression) -> (depth, lifted) (see measure())
+
+    def emit(self, line):
+        self.lines.append(self.indent + line)
+
+    def new_name(self, name):
+        pyname = name
+        n = 0
+        while pyname in self.names:
+            n += 1
+            pyname = f'{name}_{n}'
+        self.names.add(pyname)
+        return pyname
+
+    def new_temp(self):
+        self.ntemps += 1
+        return self.new_name(f'_t{self.ntemps}')
+
+    def declare(self, name):
+        pyname = self.scope[name] = self.new_name(name)
+        if self.is_global(name):
+            self.globals.add(pyname)
+        return pyname
+
+    def is_global(self, name):
+        return name in self.scope.maps[-1] and not any(name in scope for scope in self.scope.maps[:-1])
+
+    # Save a value in a new temporary.  Returns its name.
+    def spill(self, value):
+        temp = self.new_temp()
+        self.emit(f'{temp} = {value}')
+        return temp
+
+    def new_scope(self):
+        self.scope = self.scope.new_child()
+
+    def end_scope(self):
+        self.scope = self.scope.parents
+
+    def block(self, statements):
+        self.indent += '    '
+        start = len(self.lines)
+        self.new_scope()
+        generate(statements, self)
+        self.end_scope()
+        if len(self.lines) == start:
+            self.emit('pass')
+        self.indent = self.indent[:-4]
+
+# Top level function.  Returns the Python source of a checked program.
+def generate_python(model):
+    context = PyContext()
+    for stmt in model.statements:
+        if isinstance(stmt, (Function, Struct, Enum)):
+            context.scope[stmt.name] = stmt
+    for stmt in model.statements:
+        if isinstance(stmt, Function):
+            context.names.add(stmt.name if stmt.name not in reserved else stmt.name + '_')
+
+    source = [ ]
+    generate_function_code('_init', [ ], [ stmt for stmt in model.statements
+                                          if not isinstance(stmt, (Function, Struct, Enum)) ],
+                           context, source)
+    for stmt in model.statements:
+        if isinstance(stmt, Function):
+            context.scope = ChainMap(context.scope.maps[-1]).new_child()
+            params = [ context.declare(param.name) for param in stmt.parameters ]
+            generate_function_code(function_name(stmt.name), params, stmt.body, context, source)
+            context.scope = ChainMap(context.scope.maps[-1])
+
+    source.append('_init()')
+    if isinstance(context.scope.get('main'), Function):
+        source.append(f'{function_name("main")}()')
+    return '\n'.join(source) + '\n'
+
+def function_name(name):
+    return name if name not in reserved else name + '_'
+
+def generate_function_code(name, params, body, context, source):
+    context.lines = [ ]
+    context.globals = set()
+    generate(body, context)
+    if not context.lines or not context.lines[-1].startswith('    return '):
+        context.emit('return ()')
+    source.append(f'def {name}({", ".join(params)}):')
+    if context.globals:
+        source.append(f'    global {", ".join(sorted(context.globals))}')
+    source.extend(context.lines)
+    source.append('')
+
+# Compile and run the Python source of a program
+def run_python(source, filename='<wabbit>'):
+    code = compile(source, filename, 'exec')
+    exec(code, dict(helpers))
+
+# ---- Statements.  These add lines to context.
+
+def generate(node, context):
+    statements[type(node)](node, context)
+
+def generate_list(node, context):
+    for stmt in node:
+        generate(stmt, context)
+
+def generate_unknown(node, context):
+    raise RuntimeError(f"Can't generate Python for {node}")
+
+def generate_print(node, context):
+    value = expression(node.value, context)
+    valtype = node.value.type
+    if valtype == 'char':
+        context.emit(f"print({value}, end='')")
+    elif valtype in ('int', 'float'):
+        context.emit(f'print({value})')
+    else:
+        context.emit(f'print(_format({value}))')
+
+def generate_assignment(node, context):
+    value = expression(node.value, context)
+    if isinstance(node.location, Attribute):
+        if has_statements(node.location, context):
+            value = context.spill(value)
+        target = expression(node.location.value, context)
+        context.emit(f'{target}.fields[{node.location.name!r}] = {value}')
+    else:
+        name = node.location.name
+        if context.is_global(name):
+            context.globals.add(context.scope[name])
+        context.emit(f'{context.scope[name]} = {value}')
+
+def generate_variable(node, context):
+    if node.value is not None:
+        value = expression(node.value, context)
+    else:
+        value = default_value(node.type, context)
+    context.emit(f'{context.declare(node.name)} = {value}')
+
+# Python expression for the initial value of a variable declared
+# without a value.  Each structure gets new instances of its fields.
+def default_value(typename, context):
+    defaults = { 'int': '0', 'float': '0.0', 'char': repr('\x00'), 'bool': 'False', 'unit': '()' }
+    if typename in defaults:
+        return defaults[typename]
+    struct = context.scope[typename]
+    fields = ', '.join(f'{field.name!r}: {default_value(field.type, context)}' for field in struct.fields)
+    return f'_Struct({struct.name!r}, {{{fields}}})'
+
+def generate_if(node, context):
+    test = expression(node.test, context)
+    context.emit(f'if {test}:')
+    context.block(node.consequence)
+    if node.alternative:
+        context.emit('else:')
+        context.block(node.alternative)
+
+# If evaluating the test needs statements, they go at the top of the loop
+def generate_while(node, context):
+    if has_statements(node.test, context):
+        context.emit('while True:')
+        context.indent += '    '
+        test = expression(node.test, context)
+        context.emit(f'if not {test}:')
+        context.emit('    break')
+        context.indent = context.indent[:-4]
+    else:
+        context.emit(f'while {expression(node.test, context)}:')
+    context.block(node.body)
+
+def generate_break(node, context):
+    context.emit('break')
+
+def generate_continue(node, context):
+    context.emit('continue')
+
+def generate_return(node, context):
+    context.emit(f'return {expression(node.value, context)}')
+
+def generate_exprstatement(node, context):
+    context.emit(expression(node.expression, context))
+
+def generate_definition(node, context):
+    pass
+
+statements = Dispatch({
+    list: generate_list,
+    Print: generate_print,
+    Assignment: generate_assignment,
+    (Variable, Const): generate_variable,
+    If: generate_if,
+    While: generate_while,
+    Break: generate_break,
+    Continue: generate_continue,
+    Return: generate_return,
+    ExprStatement: generate_exprstatement,
+    (Function, Struct, Enum): generate_definition,
+}, default=generate_unknown)
+
+# ---- Expressions.  These return the text of a Python expression.
+# Any statements needed to compute it are added to context first.
+
+def expression(node, context):
+    return expressions[type(node)](node, context)
+
+def expression_unknown(node, context):
+    raise RuntimeError(f"Can't generate Python for {node}")
+
+# Measure an expression.  Returns (depth, lifted) where depth is how
+# deeply its Python expression is nested and lifted is True if computing
+# it needs statements.  Compound and match expressions are always
+# lifted.  So is anything containing a subexpression nested max_depth
+# deep, since that subexpression is saved in a temporary (see
+# expression_values()).  Results are kept in context.measured.
+def measure(node, context):
+    if id(node) in context.measured:
+        return context.measured[id(node)]
+    if isinstance(node, (Compound, Match)):
+        result = (1, True)
+    else:
+        depth, lifted = 0, False
+        for child in subexpressions(node):
+            childdepth, childlifted = measure(child, context)
+            if childdepth >= max_depth:
+                childdepth, childlifted = 1, True
+            depth = max(depth, childdepth)
+            lifted = lifted or childlifted
+        result = (depth + 1, lifted)
+    context.measured[id(node)] = result
+    return result
+
+def subexpressions(node):
+    if isinstance(node, (UnaryOp, Attribute)):
+        return [ node.operand if isinstance(node, UnaryOp) else node.value ]
+    elif isinstance(node, BinOp):
+        return [ node.left, node.right ]
+    elif isinstance(node, Call):
+        return node.arguments
+    elif isinstance(node, EnumValue) and node.value is not None:
+        return [ node.value ]
+    return [ ]
+
+# Does computing an expression need statements?
+def has_statements(node, context):
+    return measure(node, context)[1]
+
+# Text of several expressions evaluated in order.  If a later one needs
+# statements, the earlier ones are saved in temporaries first.  An
+# expression nested too deeply is saved in a temporary itself.
+def expression_values(nodes, context):
+    values = [ ]
+    for node in nodes:
+        if has_statements(node, context):
+            values = [ context.spill(value) for value in values ]
+        value = expression(node, context)
+        if measure(node, context)[0] >= max_depth:
+            value = context.spill(value)
+        values.append(value)
+    return values
+
+# 32-bit wrap around of an int.  value is a sum, difference, product,
+# negation or call, all of which bind at least as tightly as the +.
+def wrap(value):
+    return f'((({value} + 0x80000000) & 0xFFFFFFFF) - 0x80000000)'
+
+def expression_integer(node, context):
+    value = int(node.value)
+    value = ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+    return f'({value})' if value < 0 else str(value)
+
+def expression_float(node, context):
+    return repr(float(node.value))
+
+def expression_char(node, context):
+    return repr(node.value)
+
+def expression_bool(node, context):
+    return 'True' if node.value else 'False'
+
+def expression_unit(node, context):
+    return '()'
+
+def expression_name(node, context):
+    return context.scope[node.name]
+
+def expression_attribute(node, context):
+    value, = expression_values([ node.value ], context)
+    return f'{value}.fields[{node.name!r}]'
+
+def expression_unaryop(node, context):
+    operand, = expression_values([ node.operand ], context)
+    if node.op == '-':
+        return wrap(f'-{operand}') if node.type == 'int' else f'(-{operand})'
+    elif node.op == '!':
+        return f'(not {operand})'
+    return operand
+
+pyops = { '+': '+', '-': '-', '*': '*', '/': '/', '<': '<', '<=': '<=', '>': '>',
+          '>=': '>=', '==': '==', '!=': '!=', '&&': 'and', '||': 'or' }
+
+def expression_binop(node, context):
+    if node.op in ('&&', '||') and has_statements(node.right, context):
+        return expression_shortcircuit(node, context)
+    left, right = expression_values([ node.left, node.right ], context)
+    if node.left.type == 'int' and node.op in ('+', '-', '*'):
+        return wrap(f'{left} {node.op} {right}')
+    elif node.left.type == 'int' and node.op == '/':
+        return f'_idiv({left}, {right})'
+    return f'({left} {pyops[node.op]} {right})'
+
+# Short-circuit evaluation where the right side needs statements
+def expression_shortcircuit(node, context):
+    result = context.spill(expression(node.left, context))
+    context.emit(f'if {"" if node.op == "&&" else "not "}{result}:')
+    context.indent += '    '
+    context.emit(f'{result} = {expression_values([ node.right ], context)[0]}')
+    context.indent = context.indent[:-4]
+    return result
+
+def expression_call(node, context):
+    args = expression_values(node.arguments, context)
+    if node.name == 'int':
+        return f'ord({args[0]})' if node.arguments[0].type == 'char' else wrap(f'int({args[0]})')
+    elif node.name == 'float':
+        return f'float({args[0]})'
+    elif node.name == 'char':
+        return f'chr({args[0]} & 0xFF)' if node.arguments[0].type == 'int' else args[0]
+    elif node.name in ('bool', 'unit'):
+        return args[0]
+
+    decl = context.scope[node.name]
+    if isinstance(decl, Struct):
+        fields = ', '.join(f'{field.name!r}: {arg}' for field, arg in zip(decl.fields, args))
+        return f'_Struct({decl.name!r}, {{{fields}}})'
+    return f'{function_name(node.name)}({", ".join(args)})'
+
+def expression_enumvalue(node, context):
+    if node.value is None:
+        return f'_Enum({node.enum!r}, {node.choice!r})'
+    value, = expression_values([ node.value ], context)
+    return f'_Enum({node.enum!r}, {node.choice!r}, {value})'
+
+# The first case that matches is used
+def expression_match(node, context):
+    value = context.spill(expression(node.value, context))
+    result = context.new_temp()
+    keyword = 'if'
+    for case in node.cases:
+        if case.choice == '_':
+            context.emit('else:' if keyword == 'elif' else 'if True:')
+        else:
+            context.emit(f'{keyword} {value}.choice == {case.choice!r}:')
+        context.indent += '    '
+        context.new_scope()
+        if case.binding is not None:
+            context.emit(f'{context.declare(case.binding)} = {value}.value')
+        context.emit(f'{result} = {expression(case.value, context)}')
+        context.end_scope()
+        context.indent = context.indent[:-4]
+        if case.choice == '_':
+            break
+        keyword = 'elif'
+    return result
+
+def expression_compound(node, context):
+    context.new_scope()
+    last = node.statements[-1] if node.statements else None
+    if isinstance(last, ExprStatement):
+        generate(node.statements[:-1], context)
+        result = context.spill(expression(last.expression, context))
+    else:
+        generate(node.statements, context)
+        result = '()'
+    context.end_scope()
+    return result
+
+expressions = Dispatch({
+    Integer: expression_integer,
+    Float: expression_float,
+    Char: expression_char,
+    Bool: expression_bool,
+    Unit: expression_unit,
+    Name: expression_name,
+    Attribute: expression_attribute,
+    UnaryOp: expression_unaryop,
+    BinOp: expression_binop,
+    Call: expression_call,
+    EnumValue: expression_enumvalue,
+    Match: expression_match,
+    Compound: expression_compound,
+}, default=expression_unknown)
+
+# Conformance check.  Runs each program with the interpreter and as
+# Python and reports any difference in output.  Returns the names of
+# the files that differ.
+def check_conformance(filenames):
+    import contextlib
+    import io
+    from .parse import parse_file
+    from .typecheck import check_program
+    from .interp import interpret_program
+
+    def output(func, *args):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            try:
+                func(*args)
+            except Exception as err:
+                print(f'{type(err).__name__}: {err}')
+        return out.getvalue()
+
+    failed = [ ]
+    for filename in filenames:
+        model = parse_file(filename)
+        with contextlib.redirect_stdout(io.StringIO()):
+            if not check_program(model):
+                continue
+        source = generate_python(model)
+        ok = output(interpret_program, model) == output(run_python, source, filename)
+        print(f'{filename}: {"ok" if ok else "FAILED"}')
+        if not ok:
+            failed.append(filename)
+    return failed
+
+# Sample main program.  Prints the Python code for a program.  With
+# run=True, runs it instead.
+def main(filename, run=False):
+    from .parse import parse_file
+    from .typecheck import check_program
+    from .transform import transform
+    model = parse_file(filename)
+    if not check_program(model):
+        raise SystemExit(1)
+    source = generate_python(transform(model))
+    if run:
+        run_python(source, filename)
+    else:
+        print(source)
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:2] == ['-run']:
+        main(sys.argv[2], run=True)
+    elif sys.argv[1:2] == ['-check']:
+        if check_conformance(sys.argv[2:]):
+            raise SystemExit(1)
+    else:
+        main(sys.argv[1])
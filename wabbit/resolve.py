@@ -0,0 +1,190 @@
+# resolve.py
+#
+# Name resolution
+#
+# The interpreter, type checker and IR generator used to find variables
+# by searching a ChainMap of scopes (one dict per block) for every use
+# of a name.  This pass works out ahead of time where each variable
+# lives so that they can index an array instead.
+#
+# Variables live in frames (lists).  Each function call has a frame
+# holding its parameters and every variable declared in its body, and
+# there is one global frame holding the globals.  Block scoping is
+# decided here, so blocks don't need frames of their own:  every
+# declaration in a function gets its own slot even if its name is
+# reused in another block.
+#
+# Every Name, declaration (Variable, Const, Parameter) and MatchCase
+# with a binding is annotated with an address (depth, slot):
+#
+#    depth 0 (LOCAL)  - slot in the frame of the running function
+#    depth 1 (GLOBAL) - slot in the global frame
+#
+# Top-level code runs in the global frame.  Variables declared in
+# blocks at the top level get slots there too, but only the ones in
+# the outermost scope are visible to functions.  Functions get their
+# frame size annotated as size, and the Program the size of the global
+# frame.
+#
+# Names that can't be resolved (undefined, used before they're
+# declared, or naming a function or type) get address None.  The type
+# checker reports those.  Scoping follows the checker exactly:
+# structs, enums and functions are declared first, then the top-level
+# statements are resolved in order and finally function bodies (which
+# see all globals).
+#
+#     resolve_program(model)
+#     model.statements[0].address    # -> (1, 0)
+#
+# Resolving again (after an edit) overwrites the old annotations.
+
+from collections import ChainMap
+
+from .model import *
+
+LOCAL = 0
+GLOBAL = 1
+
+class Resolver:
+    def __init__(self):
+        self.scope = ChainMap()   # Name -> address (or the Function/Struct/Enum declared)
+        self.depth = GLOBAL       # Depth of the frame being filled in
+        self.size = 0             # Slots used so far in that frame
+
+    def declare(self, name):
+        address = (self.depth, self.size)
+        self.size += 1
+        self.scope[name] = address
+        return address
+
+    def lookup(self, name):
+        address = self.scope.get(name)
+        return address if isinstance(address, tuple) else None
+
+    def new_scope(self):
+        self.scope = self.scope.new_child()
+
+    def end_scope(self):
+        self.scope = self.scope.parents
+
+def resolve_program(model):
+    resolver = resolve_toplevel(model)
+    for stmt in model.statements:
+        if isinstance(stmt, Function):
+            resolve_function(stmt, resolver)
+    return model
+
+# Resolve everything but function bodies.  Returns the resolver, which
+# the bodies can be resolved with afterwards, in any order (parcheck.py
+# resolves them in worker processes).
+def resolve_toplevel(model):
+    resolver = Resolver()
+    for stmt in model.statements:
+        if isinstance(stmt, (Function, Struct, Enum)):
+            resolver.scope[stmt.name] = stmt
+    for stmt in model.statements:
+        if not isinstance(stmt, (Function, Struct, Enum)):
+            resolve(stmt, resolver)
+    model.size = resolver.size
+    return resolver
+
+# Functions see the outermost top-level scope only
+def resolve_function(node, resolver):
+    globals = resolver.scope
+    resolver.scope = ChainMap(globals).new_child()
+    resolver.depth, resolver.size = LOCAL, 0
+    for param in node.parameters:
+        param.address = resolver.declare(param.name)
+    resolver.new_scope()
+    resolve(node.body, resolver)
+    node.size = resolver.size
+    resolver.scope = globals
+    resolver.depth = GLOBAL
+
+def resolve(node, resolver):
+    resolvers[type(node)](node, resolver)
+
+def resolve_list(node, resolver):
+    for stmt in node:
+        resolve(stmt, resolver)
+
+def resolve_nothing(node, resolver):
+    pass
+
+def resolve_name(node, resolver):
+    node.address = resolver.lookup(node.name)
+
+def resolve_value(node, resolver):
+    if node.value is not None:
+        resolve(node.value, resolver)
+
+def resolve_unaryop(node, resolver):
+    resolve(node.operand, resolver)
+
+def resolve_binop(node, resolver):
+    resolve(node.left, resolver)
+    resolve(node.right, resolver)
+
+def resolve_call(node, resolver):
+    resolve(node.arguments, resolver)
+
+def resolve_match(node, resolver):
+    resolve(node.value, resolver)
+    for case in node.cases:
+        resolver.new_scope()
+        case.address = resolver.declare(case.binding) if case.binding is not None else None
+        resolve(case.value, resolver)
+        resolver.end_scope()
+
+def resolve_compound(node, resolver):
+    resolver.new_scope()
+    resolve(node.statements, resolver)
+    resolver.end_scope()
+
+def resolve_block(statements, resolver):
+    resolver.new_scope()
+    resolve(statements, resolver)
+    resolver.end_scope()
+
+def resolve_assignment(node, resolver):
+    resolve(node.value, resolver)
+    resolve(node.location, resolver)
+
+# The value is resolved first.  In "var x = x + 1;", x on the right is
+# an x from an enclosing scope.
+def resolve_variable(node, resolver):
+    resolve_value(node, resolver)
+    node.address = resolver.declare(node.name)
+
+def resolve_if(node, resolver):
+    resolve(node.test, resolver)
+    resolve_block(node.consequence, resolver)
+    resolve_block(node.alternative, resolver)
+
+def resolve_while(node, resolver):
+    resolve(node.test, resolver)
+    resolve_block(node.body, resolver)
+
+def resolve_exprstatement(node, resolver):
+    resolve(node.expression, resolver)
+
+# Definitions anywhere but the top level are errors (reported by the
+# checker).  Nothing in them is resolved.
+resolvers = Dispatch({
+    list: resolve_list,
+    (Integer, Float, Char, Bool, Unit): resolve_nothing,
+    Name: resolve_name,
+    (Attribute, EnumValue, Print, Return): resolve_value,
+    UnaryOp: resolve_unaryop,
+    BinOp: resolve_binop,
+    Call: resolve_call,
+    Match: resolve_match,
+    Compound: resolve_compound,
+    Assignment: resolve_assignment,
+    (Variable, Const): resolve_variable,
+    If: resolve_if,
+    While: resolve_while,
+    (Break, Continue): resolve_nothing,
+    ExprStatement: resolve_exprstatement,
+    (Function, Struct, Enum): resolve_nothing,
+}, default=resolve_nothing)
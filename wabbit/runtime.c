@@ -0,0 +1,46 @@
+/* runtime.c
+
+   Runtime library for programs compiled by wabbit.llvm.  Link it
+   with the generated code. For example:
+
+       bash % python3 -m wabbit.llvm prog.wb
+       bash % clang out.ll wabbit/runtime.c
+*/
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+void _printi(int x) {
+    printf("%i\n", x);
+}
+
+/* Print floats the same way Python does (shortest representation
+   that reads back as the same value) */
+void _printf(double x) {
+    char buf[32];
+    int prec;
+    for (prec = 1; prec < 17; prec++) {
+        snprintf(buf, sizeof(buf), "%.*g", prec, x);
+        if (strtod(buf, NULL) == x) {
+            break;
+        }
+    }
+    snprintf(buf, sizeof(buf), "%.*g", prec, x);
+    if (strspn(buf, "-0123456789") == strlen(buf)) {
+        strcat(buf, ".0");
+    }
+    printf("%s\n", buf);
+}
+
+void _printb(int x) {
+    printf("%s\n", x ? "true" : "false");
+}
+
+void _printc(int x) {
+    putchar(x);
+}
+
+void _printu(int x) {
+    printf("()\n");
+}
@@ -0,0 +1,397 @@
+# stackinterp.py
+#
+# Interpreter with an explicit stack
+#
+# interp.py runs a program by calling interpret() recursively.  A
+# Wabbit function call is a few levels of Python recursion deeper, so
+# a recursive Wabbit function that goes a few hundred calls deep runs
+# into Python's recursion limit.
+#
+# This interpreter keeps its own stacks instead, in the spirit of
+# run() in mental/mental.py.  There is a control stack of steps still
+# to be done and a value stack of results.  A step is a pair
+# (function, argument).  Running a program is just
+#
+#     while control:
+#         step, arg = control.pop()
+#         step(arg, machine)
+#
+# Evaluating a node pushes the steps needed to finish it (for a BinOp:
+# apply the operator) and then the steps for its children (evaluate
+# the right operand, evaluate the left one).  Each child leaves its
+# value on the value stack.  Nothing ever calls back into the loop,
+# so the depth of Wabbit recursion is only limited by memory.
+#
+# A few steps are markers:
+#
+#   - loop_again sits under the body of a while loop while it runs.
+#     When it's reached, the loop is tested again.  break and continue
+#     drop everything above it.
+#
+#   - end_call sits under the body of a function.  It holds the frame
+#     of the caller.  return drops everything above it.
+#
+# Both also record the height of the value stack, since control flow
+# can leave a compound expression with operands still pushed.
+#
+# Names must be resolved (see resolve.py) and frames work as in
+# interp.py, as do specialized operations (interp.specialize()).
+# Frames of functions that have returned are kept in a pool (by size)
+# and reused by later calls, so a call doesn't need a new list.  Values
+# and output are the same as interp.py.
+#
+#     interpret_program(parse_file('prog.wb'))
+
+from .model import *
+from .resolve import resolve_program
+from .interp import (StructInstance, EnumInstance, wrap32, idiv, format_value,
+                     default_value, specialize)
+
+class Machine:
+    def __init__(self, size):
+        self.values = [ ]
+        self.control = [ ]
+        self.frame = self.globals = [ None ] * size
+        self.decls = { }          # Functions, structs and enums by name
+        self.pool = { }           # Frame size -> frames that can be reused
+
+    def run(self):
+        control = self.control
+        while control:
+            step, arg = control.pop()
+            step(arg, self)
+
+def interpret_program(model):
+    resolve_program(model)
+    specialize(model)
+    machine = Machine(model.size)
+    for stmt in model.statements:
+        if isinstance(stmt, (Function, Struct, Enum)):
+            machine.decls[stmt.name] = stmt
+    push_block(model.statements, machine)
+    machine.run()
+    main = machine.decls.get('main')
+    if isinstance(main, Function):
+        machine.control.append((drop, None))
+        call_function(main, [ ], machine)
+        machine.run()
+
+# Push the step that evaluates node
+def push(node, machine):
+    machine.control.append((evaluators[type(node)], node))
+
+# Push statements so that they run in order
+def push_block(statements, machine):
+    control = machine.control
+    for stmt in reversed(statements):
+        control.append((evaluators[type(stmt)], stmt))
+
+def drop(arg, machine):
+    machine.values.pop()
+
+def push_unit(arg, machine):
+    machine.values.append(())
+
+def eval_unknown(node, machine):
+    raise RuntimeError(f"Can't interpret {node}")
+
+# ---- Expressions
+
+def eval_integer(node, machine):
+    machine.values.append(wrap32(int(node.value)))
+
+def eval_float(node, machine):
+    machine.values.append(float(node.value))
+
+def eval_value(node, machine):
+    machine.values.append(node.value)
+
+def eval_unit(node, machine):
+    machine.values.append(())
+
+def eval_name(node, machine):
+    depth, slot = node.address
+    machine.values.append((machine.globals if depth else machine.frame)[slot])
+
+def eval_attribute(node, machine):
+    machine.control.append((get_attribute, node))
+    push(node.value, machine)
+
+def get_attribute(node, machine):
+    values = machine.values
+    values[-1] = values[-1].fields[node.name]
+
+def eval_unaryop(node, machine):
+    machine.control.append((apply_unaryop, node))
+    push(node.operand, machine)
+
+def apply_unaryop(node, machine):
+    values = machine.values
+    value = values[-1]
+    if node.operation is not None:
+        values[-1] = node.operation(value)
+    elif node.op == '-':
+        values[-1] = wrap32(-value) if isinstance(value, int) else -value
+    elif node.op == '!':
+        values[-1] = not value
+
+def eval_binop(node, machine):
+    if node.op in ('&&', '||'):
+        machine.control.append((shortcircuit, node))
+    else:
+        machine.control.append((apply_binop, node))
+        push(node.right, machine)
+    push(node.left, machine)
+
+# The right operand is only evaluated if the left one doesn't decide
+# the result
+def shortcircuit(node, machine):
+    values = machine.values
+    if bool(values[-1]) == (node.op == '&&'):
+        values.pop()
+        push(node.right, machine)
+
+def apply_binop(node, machine):
+    values = machine.values
+    right = values.pop()
+    left = values[-1]
+    if node.operation is not None:
+        values[-1] = node.operation(left, right)
+        return
+    op = node.op
+    if op == '+':
+        result = left + right
+    elif op == '-':
+        result = left - right
+    elif op == '*':
+        result = left * right
+    elif op == '/':
+        values[-1] = idiv(left, right) if isinstance(left, int) else left / right
+        return
+    elif op == '<':
+        result = left < right
+    elif op == '<=':
+        result = left <= right
+    elif op == '>':
+        result = left > right
+    elif op == '>=':
+        result = left >= right
+    elif op == '==':
+        result = left == right
+    elif op == '!=':
+        result = left != right
+    else:
+        raise RuntimeError(f'Unsupported operator {op}')
+    values[-1] = wrap32(result) if type(result) is int else result
+
+def eval_call(node, machine):
+    control = machine.control
+    control.append((apply_call, node))
+    for arg in reversed(node.arguments):
+        control.append((evaluators[type(arg)], arg))
+
+def apply_call(node, machine):
+    values = machine.values
+    if node.operation is not None:
+        values[-1] = node.operation(values[-1])
+        return
+    nargs = len(node.arguments)
+    args = values[len(values)-nargs:]
+    del values[len(values)-nargs:]
+    if node.name == 'int':
+        values.append(wrap32(ord(args[0]) if isinstance(args[0], str) else int(args[0])))
+    elif node.name == 'float':
+        values.append(float(args[0]))
+    elif node.name == 'char':
+        values.append(chr(args[0] & 0xFF) if isinstance(args[0], int) else args[0])
+    elif node.name in ('bool', 'unit'):
+        values.append(args[0])
+    else:
+        decl = machine.decls[node.name]
+        if isinstance(decl, Struct):
+            values.append(StructInstance(decl.name, { field.name: arg
+                                                      for field, arg in zip(decl.fields, args) }))
+        else:
+            call_function(decl, args, machine)
+
+# Start running a function.  Its value is pushed by end_call when it
+# returns.
+def call_function(func, args, machine):
+    free = machine.pool.get(func.size)
+    if free:
+        frame = free.pop()
+        frame[:len(args)] = args
+    else:
+        frame = args + [ None ] * (func.size - len(args))
+    machine.control.append((end_call, (machine.frame, len(machine.values))))
+    machine.frame = frame
+    push_block(func.body, machine)
+
+# Reached when a function finishes without a return
+def end_call(saved, machine):
+    finish_call(saved, (), machine)
+
+def finish_call(saved, value, machine):
+    frame = machine.frame
+    machine.pool.setdefault(len(frame), [ ]).append(frame)
+    machine.frame, height = saved
+    del machine.values[height:]
+    machine.values.append(value)
+
+def eval_enumvalue(node, machine):
+    if node.value is None:
+        machine.values.append(EnumInstance(node.enum, node.choice))
+    else:
+        machine.control.append((make_enum, node))
+        push(node.value, machine)
+
+def make_enum(node, machine):
+    values = machine.values
+    values[-1] = EnumInstance(node.enum, node.choice, values[-1])
+
+def eval_match(node, machine):
+    machine.control.append((choose_case, node))
+    push(node.value, machine)
+
+def choose_case(node, machine):
+    value = machine.values.pop()
+    for case in node.cases:
+        if case.choice == value.choice or case.choice == '_':
+            if case.binding is not None:
+                depth, slot = case.address
+                (machine.globals if depth else machine.frame)[slot] = value.value
+            push(case.value, machine)
+            return
+    raise RuntimeError(f'No match for {value}')
+
+# The value of a compound expression is the value of its last statement
+# if that's an expression.  Otherwise it's unit.
+def eval_compound(node, machine):
+    statements = node.statements
+    if statements and isinstance(statements[-1], ExprStatement):
+        push(statements[-1].expression, machine)
+        push_block(statements[:-1], machine)
+    else:
+        machine.control.append((push_unit, None))
+        push_block(statements, machine)
+
+# ---- Statements
+
+def exec_print(node, machine):
+    machine.control.append((print_value, None))
+    push(node.value, machine)
+
+def print_value(arg, machine):
+    value = machine.values.pop()
+    if isinstance(value, str):
+        print(value, end='')
+    else:
+        print(format_value(value))
+
+def exec_assignment(node, machine):
+    location = node.location
+    if isinstance(location, Attribute):
+        machine.control.append((set_attribute, location))
+        push(location.value, machine)
+    else:
+        machine.control.append((store, location))
+    push(node.value, machine)
+
+def store(node, machine):
+    depth, slot = node.address
+    (machine.globals if depth else machine.frame)[slot] = machine.values.pop()
+
+def set_attribute(node, machine):
+    values = machine.values
+    instance = values.pop()
+    instance.fields[node.name] = values.pop()
+
+def exec_variable(node, machine):
+    machine.control.append((store, node))
+    if node.value is not None:
+        push(node.value, machine)
+    else:
+        machine.values.append(default_value(node.type, machine))
+
+def exec_if(node, machine):
+    machine.control.append((choose_branch, node))
+    push(node.test, machine)
+
+def choose_branch(node, machine):
+    if machine.values.pop():
+        push_block(node.consequence, machine)
+    else:
+        push_block(node.alternative, machine)
+
+def exec_while(node, machine):
+    machine.control.append((enter_loop, node))
+    push(node.test, machine)
+
+def enter_loop(node, machine):
+    if machine.values.pop():
+        machine.control.append((loop_again, (node, len(machine.values))))
+        push_block(node.body, machine)
+
+def loop_again(marker, machine):
+    exec_while(marker[0], machine)
+
+# Drop everything above the innermost marker made by step.  Returns
+# its argument.
+def unwind(step, machine):
+    control = machine.control
+    while True:
+        top, arg = control.pop()
+        if top is step:
+            return arg
+
+def exec_break(node, machine):
+    node, height = unwind(loop_again, machine)
+    del machine.values[height:]
+
+def exec_continue(node, machine):
+    node, height = unwind(loop_again, machine)
+    del machine.values[height:]
+    exec_while(node, machine)
+
+def exec_return(node, machine):
+    machine.control.append((do_return, None))
+    push(node.value, machine)
+
+def do_return(arg, machine):
+    value = machine.values.pop()
+    finish_call(unwind(end_call, machine), value, machine)
+
+def exec_exprstatement(node, machine):
+    machine.control.append((drop, None))
+    push(node.expression, machine)
+
+def exec_definition(node, machine):
+    pass
+
+evaluators = Dispatch({
+    # Expressions
+    Integer: eval_integer,
+    Float: eval_float,
+    (Char, Bool): eval_value,
+    Unit: eval_unit,
+    Name: eval_name,
+    Attribute: eval_attribute,
+    UnaryOp: eval_unaryop,
+    BinOp: eval_binop,
+    Call: eval_call,
+    EnumValue: eval_enumvalue,
+    Match: eval_match,
+    Compound: eval_compound,
+
+    # Statements
+    Print: exec_print,
+    Assignment: exec_assignment,
+    (Variable, Const): exec_variable,
+    If: exec_if,
+    While: exec_while,
+    Break: exec_break,
+    Continue: exec_continue,
+    Return: exec_return,
+    ExprStatement: exec_exprstatement,
+    (Function, Struct, Enum): exec_definition,
+}, default=eval_unknown)
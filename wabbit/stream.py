@@ -0,0 +1,219 @@
+# stream.py
+#
+# Streaming compilation
+#
+# Normally, the compiler runs parse_file() -> check_program() ->
+# transform() -> generate_ircode() with each stage finishing the
+# entire program before the next one starts.  Everything for the
+# whole program is in memory at once and nothing comes out until the
+# very end.
+#
+# The StreamCompiler instead takes top-level statements one at a time
+# (see parse_toplevel() in parse.py) and produces IRFunctions as soon
+# as they're complete.  A statement is handled as soon as every name
+# it refers to has been declared:
+#
+#   - struct and enum names are declared as soon as they're seen.
+#     Their fields are checked once the field types are known.
+#
+#   - A function is declared once its parameter and return types are
+#     known.  Its body is checked and turned into IR once everything
+#     it uses (globals, other functions, types) has been declared.
+#     The finished IRFunction is handed out and the body is dropped.
+#
+#   - Other statements are the code of _init().  They're handled in
+#     the order given.  If one has to wait (for instance, it calls a
+#     function defined later), all following statements wait too.
+#
+# At the end of the input, whatever is still waiting is checked anyway
+# in the same order as check_program() would so that errors are
+# reported.  Once an error has been found, no more IR is generated.
+#
+# Example use:
+#
+#     compiler = compile_file('prog.wb')
+#     for func in compiler:
+#         ...                   # Do something with an IRFunction
+#     if compiler.errors:
+#         ...
+#
+# While iterating, compiler.module.globals lists all globals declared
+# so far and compiler.signatures holds (name, argtypes, rettype) for
+# every function that will be produced, in the order declared.  Both
+# only grow, so backends can pick up new entries as they go.
+
+from collections import deque
+
+from .model import *
+from .tokenize import tokenize_file
+from .parse import parse_toplevel
+from .typecheck import (new_environment, report_errors, declare, check, check_struct,
+                        check_enum, check_function_signature, check_function_body)
+from .transform import transform
+from .ircode import IRModule, IRContext, typemap, generate, generate_function, finish_module
+from .iropt import optimize_function
+
+# Names a node refers to, less the names that it declares itself
+def free_names(node):
+    used = set()
+    declared = set()
+    for child in walk(node):
+        if isinstance(child, (Name, Call)):
+            used.add(child.name)
+        elif isinstance(child, EnumValue):
+            used.add(child.enum)
+        elif isinstance(child, (Variable, Const)):
+            declared.add(child.name)
+            if child.type is not None:
+                used.add(child.type)
+        elif isinstance(child, Parameter):
+            declared.add(child.name)
+            used.add(child.type)
+        elif isinstance(child, MatchCase) and child.binding is not None:
+            declared.add(child.binding)
+        elif isinstance(child, Function):
+            used.add(child.rettype)
+        elif isinstance(child, (StructField, EnumChoice)) and child.type is not None:
+            used.add(child.type)
+    return used - declared
+
+def signature_names(node):
+    return { param.type for param in node.parameters } | { node.rettype }
+
+class StreamCompiler:
+    def __init__(self, statements):
+        self.statements = statements
+        self.env = new_environment()
+        self.module = IRModule()
+        self.context = IRContext(self.module)
+        self.signatures = [ ('_init', [ ], 'i32') ]
+
+        # Statements waiting on undeclared names.  Each is kept as a
+        # pair (node, names) where names is the set of names still
+        # missing.
+        self.types = [ ]
+        self.declarations = [ ]
+        self.bodies = [ ]
+        self.script = deque()
+
+        # Finished IRFunctions not yet handed out
+        self.output = deque()
+
+    @property
+    def errors(self):
+        return self.env['$errors']
+
+    def __iter__(self):
+        for stmt in self.statements:
+            self.add(stmt)
+            while self.output:
+                yield self.output.popleft()
+        self.finish()
+        while self.output:
+            yield self.output.popleft()
+        report_errors(self.env)
+
+    def add(self, stmt):
+        if isinstance(stmt, (Struct, Enum)):
+            declare(stmt, stmt.name, self.env)
+            self.types.append((stmt, free_names(stmt)))
+        elif isinstance(stmt, Function):
+            self.declarations.append((stmt, signature_names(stmt)))
+        else:
+            self.script.append((stmt, free_names(stmt)))
+        self.advance()
+
+    # Is everything in names declared?  Names found are removed from the set.
+    def known(self, names):
+        names.difference_update([ name for name in names if name in self.env ])
+        return not names
+
+    # Handle everything that's ready.  Declarations can make other
+    # statements ready, so keep going until nothing changes.  With
+    # final=True, everything is handled whether ready or not.
+    def advance(self, final=False):
+        progress = True
+        while progress:
+            progress = False
+            types, self.types = self.types, [ ]
+            for node, names in types:
+                if final or self.known(names):
+                    (check_struct if isinstance(node, Struct) else check_enum)(node, self.env)
+                    progress = True
+                else:
+                    self.types.append((node, names))
+
+            declarations, self.declarations = self.declarations, [ ]
+            for node, names in declarations:
+                if final or self.known(names):
+                    self.declare_function(node)
+                    progress = True
+                else:
+                    self.declarations.append((node, names))
+
+            while self.script and (final or self.known(self.script[0][1])):
+                node, names = self.script.popleft()
+                self.check_statement(node)
+                progress = True
+
+            bodies, self.bodies = self.bodies, [ ]
+            for node, names in bodies:
+                if final or self.known(names):
+                    self.check_function(node)
+                    progress = True
+                else:
+                    self.bodies.append((node, names))
+
+    def declare_function(self, node):
+        check_function_signature(node, self.env)
+        if all(param.type in typemap for param in node.parameters) and node.rettype in typemap:
+            self.signatures.append((node.name,
+                                    [ typemap[param.type] for param in node.parameters ],
+                                    typemap[node.rettype]))
+        names = free_names(node)
+        names.discard(node.name)
+        self.bodies.append((node, names))
+
+    def check_statement(self, node):
+        check(node, self.env)
+        if not self.errors:
+            generate(transform(node), self.context)
+
+    def check_function(self, node):
+        check_function_body(node, self.env)
+        if not self.errors:
+            func = generate_function(transform(node), self.context)
+            self.module.functions.remove(func)
+            self.output.append(optimize_function(func))
+
+        # Only the signature is needed from now on
+        signature = Function(node.name, node.parameters, node.rettype, [ ])
+        signature.lineno = node.lineno
+        self.env[node.name] = signature
+
+    def finish(self):
+        self.advance(final=True)
+        if self.errors:
+            return
+        main = finish_module(self.context)
+        self.module.functions.remove(self.context.init)
+        self.output.append(optimize_function(self.context.init))
+        if main:
+            self.module.functions.remove(main)
+            self.signatures.append((main.name, main.argtypes, main.rettype))
+            self.output.append(main)
+
+def compile_file(filename):
+    return StreamCompiler(parse_toplevel(tokenize_file(filename)))
+
+# Sample main program.  Shows the IR of each function as it's produced.
+def main(filename):
+    compiler = compile_file(filename)
+    for func in compiler:
+        func.dump()
+    if compiler.errors:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1])
@@ -76,6 +76,9 @@
 # related to bad characters, unterminated comments, and other problems.
 # ----------------------------------------------------------------------
 
+import re
+from array import array
+
 # Class that represents a token
 class Token:
     def __init__(self, type, value, lineno):
@@ -86,30 +89,277 @@ class Token:
     def __repr__(self):
         return f'Token({self.type!r}, {self.value!r}, {self.lineno})'
 
+# Reserved words.  Anything matched as a NAME is looked up here.
+keywords = {
+    'const', 'var', 'print', 'break', 'continue', 'if', 'else', 'while',
+    'func', 'return', 'struct', 'enum', 'match', 'true', 'false',
+}
+keyword_types = { name: name.upper() for name in keywords }
+
+# Token specification.  The order matters--longer symbols such as '<='
+# must be listed before their prefixes ('<').  Everything is combined
+# into a single "master" regular expression with one named group per
+# token type so that the whole input is scanned in a single pass.
+# Whitespace and comments are matched (so that line numbers can be
+# tracked), but never produced as tokens.  Character classes are
+# spelled out rather than using \d or [^...] so that the str and bytes
+# versions of the pattern (see below) accept exactly the same input:
+# digits are 0-9 only and a character literal holds one ASCII
+# character.
+token_specs = [
+    ('WHITESPACE', r'[ \t\r\n]+'),
+    ('COMMENT',    r'//[^\n]*|/\*[\s\S]*?\*/'),
+    ('UNTERMINATED', r'/\*'),
+    ('FLOAT',      r'[0-9]+\.[0-9]*|\.[0-9]+'),
+    ('INTEGER',    r'[0-9]+'),
+    ('CHAR',       r"'(?:\\x[0-9a-fA-F]{2}|\\[\x00-\x7f]|[\x00-\x09\x0b-\x26\x28-\x5b\x5d-\x7f])'"),
+    ('NAME',       r'[a-zA-Z_][a-zA-Z0-9_]*'),
+    ('LE',         r'<='),
+    ('GE',         r'>='),
+    ('EQ',         r'=='),
+    ('NE',         r'!='),
+    ('LAND',       r'&&'),
+    ('LOR',        r'\|\|'),
+    ('DCOLON',     r'::'),
+    ('ARROW',      r'=>'),
+    ('LT',         r'<'),
+    ('GT',         r'>'),
+    ('LNOT',       r'!'),
+    ('ASSIGN',     r'='),
+    ('PLUS',       r'\+'),
+    ('MINUS',      r'-'),
+    ('TIMES',      r'\*'),
+    ('DIVIDE',     r'/'),
+    ('SEMI',       r';'),
+    ('LPAREN',     r'\('),
+    ('RPAREN',     r'\)'),
+    ('LBRACE',     r'\{'),
+    ('RBRACE',     r'\}'),
+    ('DOT',        r'\.'),
+    ('COMMA',      r','),
+    ('ERROR',      r'.'),
+]
+
+# Symbols always have the same text.  Their value is taken from here
+# instead of being sliced out of the input.
+symbols = {
+    'LE': '<=', 'GE': '>=', 'EQ': '==', 'NE': '!=', 'LAND': '&&', 'LOR': '||',
+    'DCOLON': '::', 'ARROW': '=>', 'LT': '<', 'GT': '>', 'LNOT': '!',
+    'ASSIGN': '=', 'PLUS': '+', 'MINUS': '-', 'TIMES': '*', 'DIVIDE': '/',
+    'SEMI': ';', 'LPAREN': '(', 'RPAREN': ')', 'LBRACE': '{', 'RBRACE': '}',
+    'DOT': '.', 'COMMA': ',',
+}
+
+master_pattern = '|'.join(f'(?P<{name}>{pattern})' for name, pattern in token_specs)
+
+# Two compiled versions of the same pattern.  One for text (str) and
+# one for raw bytes.  The bytes version is used on memory-mapped files
+# so that large inputs never need to be read or decoded all at once.
+master_re = re.compile(master_pattern)
+master_re_bytes = re.compile(master_pattern.encode('ascii'))
+
 # High level function that takes input source text and turns it into
-# tokens.  This might be a natural place to use some kind of generator
-# function or iterator.
+# tokens.  text may be a str or any bytes-like object (bytes, mmap,
+# memoryview).  Tokens are produced lazily--nothing other than the
+# current match is held in memory.
+
+def tokenize(text, lineno=1):
+    if isinstance(text, str):
+        scanner = master_re.finditer(text)
+        newline = '\n'
+        decode = str
+    else:
+        scanner = master_re_bytes.finditer(text)
+        newline = b'\n'
+        decode = lambda value: value.decode('utf-8', 'replace')
+
+    m = None
+    try:
+        for m in scanner:
+            toktype = m.lastgroup
+            if toktype == 'WHITESPACE' or toktype == 'COMMENT':
+                lineno += m.group().count(newline)
+            elif toktype in symbols:
+                yield Token(toktype, symbols[toktype], lineno)
+            elif toktype == 'NAME':
+                value = decode(m.group())
+                yield Token(keyword_types.get(value, 'NAME'), value, lineno)
+            elif toktype == 'UNTERMINATED':
+                raise SyntaxError(f'{lineno}: Unterminated comment')
+            elif toktype == 'ERROR':
+                raise SyntaxError(f'{lineno}: Illegal character {decode(m.group())!r}')
+            else:
+                yield Token(toktype, decode(m.group()), lineno)
+    finally:
+        # Drop the scanner and the last match, which hold on to the
+        # buffer of a memory-mapped file (see tokenize_file()).  It
+        # can't be closed while they exist, even if an exception that
+        # refers to this frame is still around.
+        del scanner, m
+
+# Tokenize a file without reading it into memory.  The file is
+# memory-mapped and scanned directly as bytes.
+
+def tokenize_file(filename):
+    import mmap
+    with open(filename, 'rb') as file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be memory-mapped
+            return
+        with data:
+            yield from tokenize(data)
+
+# Compact token streams
+#
+# Making a Token instance for every token dominates the cost of
+# tokenizing large inputs.  A TokenStream instead stores tokens in
+# columns: the token type as a small integer code and the start/end
+# offsets and line number as unsigned integers, each in an array.
+# Token values are slices of the original source buffer, taken only
+# when someone asks for them.  Keywords and symbols never need to be
+# sliced at all since their value is implied by the type.
+
+token_types = sorted(keyword_types.values()) + [
+    name for name, _ in token_specs
+    if name not in {'WHITESPACE', 'COMMENT', 'UNTERMINATED', 'ERROR'}
+]
+token_codes = { name: code for code, name in enumerate(token_types) }
+
+# Values implied by the token type
+fixed_values = dict(symbols)
+fixed_values.update((toktype, name) for name, toktype in keyword_types.items())
+
+class TokenStream:
+    def __init__(self, source):
+        self.source = source
+        # Bytes-like sources are sliced through a memoryview (no copies)
+        self.buffer = source if isinstance(source, str) else memoryview(source)
+        self.types = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+        self.linenos = array('I')
+
+    def __len__(self):
+        return len(self.types)
 
-def tokenize(text):
-    ...
-    yield tok
-    ...
+    def type(self, n):
+        return token_types[self.types[n]]
+
+    def view(self, n):
+        # Raw source text of token n.  A zero-copy memoryview for bytes
+        # sources, a str otherwise.
+        return self.buffer[self.starts[n]:self.ends[n]]
+
+    def value(self, n):
+        toktype = token_types[self.types[n]]
+        if toktype in fixed_values:
+            return fixed_values[toktype]
+        value = self.view(n)
+        return value if isinstance(value, str) else str(value, 'utf-8')
+
+    def __getitem__(self, n):
+        return Token(self.type(n), self.value(n), self.linenos[n])
+
+    def __iter__(self):
+        for n in range(len(self.types)):
+            yield self[n]
+
+    def close(self):
+        if not isinstance(self.buffer, str):
+            self.buffer.release()
+        if hasattr(self.source, 'close'):
+            self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# Tokenize text into a TokenStream.  Only text[pos:endpos] is scanned,
+# but offsets are always relative to the start of text.  If scanning
+# is stopped short of the end, the last token must not continue past
+# endpos in the full text (SyntaxError otherwise).
+
+def tokenize_stream(text, lineno=1, pos=0, endpos=None):
+    if endpos is None:
+        endpos = len(text)
+    stream = TokenStream(text)
+    if isinstance(text, str):
+        pattern = master_re
+        newline = '\n'
+        keyword_codes = { name: token_codes[toktype] for name, toktype in keyword_types.items() }
+    else:
+        pattern = master_re_bytes
+        newline = b'\n'
+        keyword_codes = { name.encode('ascii'): token_codes[toktype] for name, toktype in keyword_types.items() }
+
+    name_code = token_codes['NAME']
+    append_type = stream.types.append
+    append_start = stream.starts.append
+    append_end = stream.ends.append
+    append_lineno = stream.linenos.append
+    m = full = None
+    try:
+        for m in pattern.finditer(text, pos, endpos):
+            toktype = m.lastgroup
+            if toktype == 'WHITESPACE' or toktype == 'COMMENT':
+                lineno += m.group().count(newline)
+                continue
+            elif toktype == 'NAME':
+                code = keyword_codes.get(m.group(), name_code)
+            elif toktype == 'UNTERMINATED':
+                raise SyntaxError(f'{lineno}: Unterminated comment')
+            elif toktype == 'ERROR':
+                char = m.group()
+                if not isinstance(char, str):
+                    char = char.decode('utf-8', 'replace')
+                raise SyntaxError(f'{lineno}: Illegal character {char!r}')
+            else:
+                code = token_codes[toktype]
+            start, end = m.span()
+            append_type(code)
+            append_start(start)
+            append_end(end)
+            append_lineno(lineno)
+
+        if m and m.end() == endpos < len(text):
+            full = pattern.match(text, m.start())
+            if full.span() != m.span() or full.lastgroup != m.lastgroup:
+                raise SyntaxError(f'{lineno}: Token continues past the end of the input')
+    except SyntaxError:
+        # Let go of the buffer of text (held by the matches and the
+        # stream's memoryview) so that a memory-mapped file can be
+        # closed (see tokenize_stream_file())
+        del m, full
+        if not isinstance(stream.buffer, str):
+            stream.buffer.release()
+        raise
+    return stream
+
+# Make a TokenStream for a file.  The stream refers to a memory-mapped
+# copy of the file and should be closed when no longer needed.
+def tokenize_stream_file(filename):
+    import mmap
+    with open(filename, 'rb') as file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            data = b''
+    try:
+        return tokenize_stream(data)
+    except SyntaxError:
+        if isinstance(data, mmap.mmap):
+            data.close()
+        raise
 
 # Main program to test on input files
 def main(filename):
-    with open(filename) as file:
-        text = file.read()
-
-    for tok in tokenize(text):
+    for tok in tokenize_file(filename):
         print(tok)
 
 if __name__ == '__main__':
     import sys
     main(sys.argv[1])
-
-    
-            
-        
-
-            
-    
@@ -17,9 +17,9 @@
 #    node = Integer(5)
 #
 # To the compiler, it won't matter---the finally produced code
-# will be the same. 
+# will be the same.
 #
-# One thing that's a bit different about this project is that 
+# One thing that's a bit different about this project is that
 # it's mostly just focused on the structure of the model itself
 # and not aspects of type checking or code generation.  Mostly
 # it's just about transformation.  You write functions like this:
@@ -29,17 +29,1024 @@
 #       newnode = ... make a new node (if required) ...
 #       return newnode
 #
+# Constant folding, propagation and dead code elimination
+# -------------------------------------------------------
+# transform() works on a checked model (literals it makes need types)
+# and does the following:
+#
+#   - Operators and conversions applied to literals are evaluated,
+#     with the same results as the interpreter (32-bit wraparound for
+#     ints, Python floats for floats).  Division by zero and results
+#     that aren't finite floats are left alone.  "true && x" becomes
+#     x, "false && x" becomes false (and likewise for ||).  In an
+#     integer multiplication, a literal goes on the right.
+#
+#   - A const whose value folds to a literal is replaced by that
+#     literal wherever it's used.  Consts can't be assigned, so this
+#     is always safe.  Uses are found by address (see resolve.py), so
+#     the model must have been resolved (check_program() does that).
+#
+#   - "if" with a literal test is replaced by the branch that's taken
+#     and "while false" is removed.  A branch that declares variables
+#     is left in its if-statement, so its variables stay in their own
+#     scope.
+#
+# When a whole Program is transformed, calls to small functions are
+# then inlined (see inline_functions() below) and the result is folded
+# again, so constant arguments are propagated into the inlined bodies.
+# Repeated work in loops is saved next (see optimize_loops() below).
+# Then dead code is removed (see eliminate_dead_code() below).
+#
+# Transforming a whole Program propagates global consts into function
+# bodies.  A single statement or function (as in stream.py) can pass a
+# dict of the consts seen so far as constants.
+#
+# The handlers below return the node to put in place of the one given
+# (often the same node, with its children transformed).  Those for
+# statements may return a list of statements instead, which is spliced
+# into the enclosing block (an empty list removes the statement).
+
+import copy
 
 from .model import *
+from .resolve import LOCAL, GLOBAL, resolve_program
+from .interp import wrap32
+from .hashcons import fold_unary, fold_binary
+from .typecheck import builtin_types
 
-def transform(node):
+def transform(node, constants=None):
     # Return the node back (unmodified) or a new node in its place
+    node = fold(node, { } if constants is None else constants)
+    if isinstance(node, Program):
+        if inline_functions(node):
+            node = fold(node, { })
+        optimize_loops(node)
+    eliminate_dead_code(node)
+    return node
+
+# Constant folding and propagation of node.  Returns the node to put in
+# its place.
+def fold(node, constants):
+    return transformers[type(node)](node, constants)
+
+# Literal classes and how to get their values
+literals = {
+    Integer: lambda node: wrap32(int(node.value)),
+    Float: lambda node: float(node.value),
+    Char: lambda node: node.value,
+    Bool: lambda node: node.value,
+    Unit: lambda node: (),
+}
+
+def is_literal(node):
+    return type(node) in literals
+
+def literal_value(node):
+    return literals[type(node)](node)
+
+# Make a literal of a checked type.  Returns None if value can't be
+# written as one.
+def make_literal(value, type, like):
+    if type == 'int':
+        node = Integer(str(value))
+    elif type == 'float':
+        if value != value or value in (float('inf'), float('-inf')):
+            return None
+        node = Float(repr(value))
+    elif type == 'char':
+        node = Char(value)
+    elif type == 'bool':
+        node = Bool(bool(value))
+    elif type == 'unit':
+        node = Unit()
+    else:
+        return None
+    node.type = type
+    if hasattr(like, 'lineno'):
+        node.lineno = like.lineno
+    return node
+
+# The literal for the value of an expression node (or the node itself if
+# it can't be folded)
+def folded(value, node):
+    if value is None:
+        return node
+    literal = make_literal(value, getattr(node, 'type', None), node)
+    return literal if literal is not None else node
+
+def transform_list(node, constants):
+    result = [ ]
+    for stmt in node:
+        stmt = fold(stmt, constants)
+        if isinstance(stmt, list):
+            result.extend(stmt)
+        else:
+            result.append(stmt)
+    return result
+
+def transform_nothing(node, constants):
+    return node
+
+# ---- Expressions
+
+def transform_name(node, constants):
+    value = constants.get(getattr(node, 'address', None))
+    if value is None:
+        return node
+    return make_literal(literal_value(value), value.type, node)
+
+def transform_attribute(node, constants):
+    node.value = fold(node.value, constants)
+    return node
+
+def transform_unaryop(node, constants):
+    node.operand = fold(node.operand, constants)
+    if is_literal(node.operand):
+        return folded(fold_unary(node.op, literal_value(node.operand)), node)
+    return node
+
+def transform_binop(node, constants):
+    node.left = fold(node.left, constants)
+    node.right = fold(node.right, constants)
+    if (node.op == '*' and getattr(node, 'type', None) == 'int'
+            and is_literal(node.left) and not is_literal(node.right)):
+        # 8 * x -> x * 8 (the literal on the right, see iropt.py)
+        node.left, node.right = node.right, node.left
+    if node.op in ('&&', '||') and is_literal(node.left):
+        # true && x -> x, false && x -> false, true || x -> true, false || x -> x
+        if literal_value(node.left) == (node.op == '&&'):
+            return node.right
+        return node.left
+    if is_literal(node.left) and is_literal(node.right):
+        return folded(fold_binary(node.op, literal_value(node.left), literal_value(node.right)), node)
+    return node
+
+def transform_call(node, constants):
+    node.arguments = [ fold(arg, constants) for arg in node.arguments ]
+    if len(node.arguments) == 1 and is_literal(node.arguments[0]):
+        return folded(convert(node.name, node.arguments[0]), node)
+    return node
+
+# Value of a conversion of a literal (None if it's not a conversion or
+# the result isn't the same everywhere)
+def convert(name, arg):
+    value = literal_value(arg)
+    if name == 'float' and arg.type == 'int':
+        return float(value)
+    elif name == 'int' and arg.type == 'char':
+        return ord(value)
+    elif name == 'int' and arg.type == 'float':
+        if value == value and -2**31 <= value < 2**31:
+            return int(value)
+    elif name == 'char' and arg.type == 'int':
+        if 0 <= value < 256:
+            return chr(value)
+    elif name == arg.type:
+        return value
+    return None
+
+def transform_enumvalue(node, constants):
+    if node.value is not None:
+        node.value = fold(node.value, constants)
+    return node
+
+def transform_match(node, constants):
+    node.value = fold(node.value, constants)
+    for case in node.cases:
+        case.value = fold(case.value, constants)
+    return node
+
+# The value of a compound expression comes from its last statement if
+# that's an expression statement.  If the one that ends up last after
+# splicing is, but the original wasn't, the value stays unit.
+def transform_compound(node, constants):
+    valued = has_value(node)
+    node.statements = fold(node.statements, constants)
+    if not valued:
+        keep_unit(node)
+    return node
+
+def has_value(node):
+    return bool(node.statements) and isinstance(node.statements[-1], ExprStatement)
+
+def keep_unit(node):
+    if has_value(node):
+        stmt = ExprStatement(make_literal((), 'unit', node))
+        if hasattr(node, 'lineno'):
+            stmt.lineno = node.lineno
+        node.statements.append(stmt)
+
+# ---- Statements
+
+def transform_print(node, constants):
+    node.value = fold(node.value, constants)
+    return node
+
+# The location is a variable being assigned, not a use of it
+def transform_assignment(node, constants):
+    node.value = fold(node.value, constants)
+    if isinstance(node.location, Attribute):
+        node.location.value = fold(node.location.value, constants)
+    return node
+
+def transform_variable(node, constants):
+    if node.value is not None:
+        node.value = fold(node.value, constants)
+    return node
+
+def transform_const(node, constants):
+    node.value = fold(node.value, constants)
+    address = getattr(node, 'address', None)
+    if address is not None and is_literal(node.value) and getattr(node.value, 'type', None):
+        constants[address] = node.value
+    return node
+
+def transform_if(node, constants):
+    node.test = fold(node.test, constants)
+    node.consequence = fold(node.consequence, constants)
+    node.alternative = fold(node.alternative, constants)
+    if isinstance(node.test, Bool):
+        taken = node.consequence if node.test.value else node.alternative
+        if not declares(taken):
+            return taken
+    return node
+
+def transform_while(node, constants):
+    node.test = fold(node.test, constants)
+    if isinstance(node.test, Bool) and not node.test.value:
+        return [ ]
+    node.body = fold(node.body, constants)
+    return node
+
+# Does a block declare variables of its own?
+def declares(statements):
+    return any(isinstance(stmt, (Variable, Const)) for stmt in statements)
+
+def transform_return(node, constants):
+    node.value = fold(node.value, constants)
+    return node
+
+def transform_exprstatement(node, constants):
+    node.expression = fold(node.expression, constants)
+    return node
+
+# Consts of a function are only seen in its body.  Addresses of locals
+# are reused by the next function.
+def transform_function(node, constants):
+    constants = { address: value for address, value in constants.items() if address[0] == GLOBAL }
+    node.body = fold(node.body, constants)
+    return node
+
+# Top-level statements are done first so that global consts are known
+# in every function
+def transform_program(node, constants):
+    statements = [ ]
+    for stmt in node.statements:
+        if isinstance(stmt, Function):
+            statements.append(stmt)
+            continue
+        stmt = fold(stmt, constants)
+        statements.extend(stmt if isinstance(stmt, list) else [ stmt ])
+    for stmt in statements:
+        if isinstance(stmt, Function):
+            fold(stmt, constants)
+    node.statements = statements
+    return node
+
+# ---- Dead code elimination
+#
+# eliminate_dead_code() removes code that can't affect what a program
+# does:
+#
+#   - statements after a return, break or continue in the same block
+#     (or after an if whose branches both end that way)
+#
+#   - expression statements whose values are unused and that can't
+#     have side effects
+#
+#   - variables whose values are never used, along with every
+#     assignment to them.  A value counts as used if it's read anywhere
+#     other than in a value assigned to an unused variable, so a loop
+#     counter that's only ever incremented is unused.  If the value
+#     being assigned might have a side effect (see pure()), it's still
+#     evaluated, as an expression statement.
+#
+#   - ifs with nothing left in either branch
+#
+# Globals are only removed when a whole Program is given.  Otherwise,
+# code that comes later might read them.  Parameters are never removed.
+# Removing code can leave more code unused, so this is repeated until
+# nothing changes.  Returns the number of statements removed.
+
+def eliminate_dead_code(node):
+    removed = 0
+    while True:
+        dead = DeadCode(isinstance(node, Program))
+        dead.mark(node)
+        dead.find_used()
+        if isinstance(node, Program):
+            node.statements = dead.sweep_block(node.statements)
+        else:
+            dead.sweep(node)
+        removed += dead.removed
+        if not dead.removed:
+            return removed
+
+class DeadCode:
+    def __init__(self, program):
+        self.program = program    # Are all reads of globals known?
+        self.func = None          # Function being looked at
+        self.roots = set()        # Variables read where the value is needed
+        self.deps = { }           # Variable -> variables read in values assigned to it
+        self.used = set()         # Variables whose values are needed
+        self.removed = 0
+
+    # Variables are identified by (function, slot), with None for the
+    # function of a global
+    def key(self, address):
+        if address is None:
+            return None
+        depth, slot = address
+        return (None if depth == GLOBAL else self.func, slot)
+
+    # ---- Marking:  find out which variables are read, and where
+
+    def mark(self, node, target=None):
+        if isinstance(node, list):
+            for item in node:
+                self.mark(item, target)
+        elif isinstance(node, Name):
+            key = self.key(getattr(node, 'address', None))
+            if key is None:
+                pass
+            elif target is None:
+                self.roots.add(key)
+            else:
+                self.deps.setdefault(target, set()).add(key)
+        elif isinstance(node, (Variable, Const)):
+            if node.value is not None:
+                self.mark_value(getattr(node, 'address', None), node.value)
+        elif isinstance(node, Assignment):
+            if isinstance(node.location, Name):
+                self.mark_value(getattr(node.location, 'address', None), node.value)
+            else:
+                self.mark(node.location.value)
+                self.mark(node.value)
+        elif isinstance(node, Function):
+            self.func = node
+            self.mark(node.body)
+            self.func = None
+        else:
+            for name in node._fields:
+                value = getattr(node, name, None)
+                if isinstance(value, (Node, list)):
+                    self.mark(value, target)
+
+    # A value assigned to a variable only needs the variables it reads if
+    # the variable itself is needed (unless it has to be evaluated anyway)
+    def mark_value(self, address, value):
+        key = self.key(address)
+        self.mark(value, key if key is not None and pure(value) else None)
+
+    def find_used(self):
+        pending = list(self.roots)
+        while pending:
+            key = pending.pop()
+            if key not in self.used:
+                self.used.add(key)
+                pending.extend(self.deps.get(key, ()))
+
+    def is_dead(self, address):
+        key = self.key(address)
+        if key is None or (key[0] is None and not self.program):
+            return False
+        return key not in self.used
+
+    # ---- Sweeping:  remove what isn't needed
+
+    def sweep_block(self, statements):
+        result = [ ]
+        for stmt in statements:
+            if result and terminates(result[-1]):
+                self.removed += 1
+                continue
+            stmt = self.sweep(stmt)
+            if stmt is None:
+                self.removed += 1
+            else:
+                result.append(stmt)
+        return result
+
+    # Returns the statement to keep in place of stmt (None to remove it)
+    def sweep(self, stmt):
+        if isinstance(stmt, (Variable, Const)):
+            if stmt.value is not None:
+                self.sweep_expression(stmt.value)
+            if self.is_dead(getattr(stmt, 'address', None)):
+                return self.side_effects(stmt, stmt.value)
+        elif isinstance(stmt, Assignment):
+            self.sweep_expression(stmt.value)
+            if isinstance(stmt.location, Name) and self.is_dead(getattr(stmt.location, 'address', None)):
+                return self.side_effects(stmt, stmt.value)
+        elif isinstance(stmt, ExprStatement):
+            self.sweep_expression(stmt.expression)
+            if pure(stmt.expression):
+                return None
+        elif isinstance(stmt, If):
+            self.sweep_expression(stmt.test)
+            stmt.consequence = self.sweep_block(stmt.consequence)
+            stmt.alternative = self.sweep_block(stmt.alternative)
+            if not stmt.consequence and not stmt.alternative and pure(stmt.test):
+                return None
+        elif isinstance(stmt, While):
+            self.sweep_expression(stmt.test)
+            stmt.body = self.sweep_block(stmt.body)
+        elif isinstance(stmt, (Print, Return)):
+            self.sweep_expression(stmt.value)
+        elif isinstance(stmt, Function):
+            self.func = stmt
+            stmt.body = self.sweep_block(stmt.body)
+            self.func = None
+        return stmt
+
+    # What's left of a store to a dead variable
+    def side_effects(self, stmt, value):
+        if value is None or pure(value):
+            return None
+        result = ExprStatement(value)
+        if hasattr(stmt, 'lineno'):
+            result.lineno = stmt.lineno
+        return result
+
+    # Compound expressions have blocks of their own
+    def sweep_expression(self, node):
+        if isinstance(node, Compound):
+            if has_value(node):
+                last = node.statements[-1]
+                self.sweep_expression(last.expression)
+                node.statements = self.sweep_block(node.statements[:-1]) + [ last ]
+            else:
+                node.statements = self.sweep_block(node.statements)
+                keep_unit(node)
+            return
+        for name in node._fields:
+            value = getattr(node, name, None)
+            if isinstance(value, Node):
+                self.sweep_expression(value)
+            elif isinstance(value, list):
+                for item in value:
+                    self.sweep_expression(item)
+
+# Does control never get past stmt?
+def terminates(stmt):
+    if isinstance(stmt, (Return, Break, Continue)):
+        return True
+    if isinstance(stmt, If):
+        return (bool(stmt.consequence) and terminates(stmt.consequence[-1])
+                and bool(stmt.alternative) and terminates(stmt.alternative[-1]))
+    return False
+
+# Can evaluating an expression be skipped?  Calls (other than type
+# conversions), matches and compound expressions with statements
+# other than pure expressions might have side effects, and division
+# fails when dividing by zero (float division too, in the interpreter
+# and the Python code), so only division by a nonzero literal is pure.
+def pure(node):
+    if is_literal(node) or isinstance(node, Name):
+        return True
+    elif isinstance(node, Attribute):
+        return pure(node.value)
+    elif isinstance(node, UnaryOp):
+        return pure(node.operand)
+    elif isinstance(node, BinOp):
+        if node.op == '/' and not (is_literal(node.right) and literal_value(node.right) != 0):
+            return False
+        return pure(node.left) and pure(node.right)
+    elif isinstance(node, Call):
+        return node.name in builtin_types and all(pure(arg) for arg in node.arguments)
+    elif isinstance(node, EnumValue):
+        return node.value is None or pure(node.value)
+    elif isinstance(node, Compound):
+        return all(isinstance(stmt, ExprStatement) and pure(stmt.expression)
+                   for stmt in node.statements)
+    return False
+
+# ---- Inlining
+#
+# inline_functions() replaces calls to small functions with the body of
+# the function, as a compound expression:
+#
+#     func square(x int) int {            print { const x_1 int = n;
+#         return x * x;          ---->            x_1 * x_1; };
+#     }
+#     ... print square(n); ...
+#
+# Arguments are evaluated in order into declarations named after the
+# parameters (consts, unless the function assigns to them) and the
+# value returned is the value of the compound.  A function whose
+# returns are all in tail position (last in its body, or last in both
+# branches of an if that is) gets a variable for its result instead:
+#
+#     func fabs(x float) float {          { const x_1 float = y;
+#         if x < 0.0 {                      var result_1 float;
+#             return -x;         ---->      if x_1 < 0.0 {
+#         } else {                              result_1 = -x_1;
+#             return x;                     } else {
+#         }                                     result_1 = x_1;
+#     }                                     }
+#                                           result_1; }  Every variable of the
+# inlined body is renamed to a name not used anywhere in the program,
+# so neither the arguments nor the code around the call can see them.
+#
+# Only calls inside function bodies are inlined, and only calls to
+# functions that:
+#
+#   - aren't recursive (directly or through other functions)
+#   - have at most limit nodes in their body
+#   - only return in tail position (or not at all, if they return unit)
+#   - don't refer to a global or call a function whose name is declared
+#     as a variable in the caller, where it would mean something else
+#
+# Functions are done callees first, so a function inlined into another
+# may already have had calls inlined into it.  The functions themselves
+# are kept.  Afterwards the program is resolved again to give the new
+# variables their addresses.  Returns the number of calls inlined.
+
+inline_limit = 40
+
+def inline_functions(program, limit=inline_limit):
+    inliner = Inliner(program, limit)
+    for func in inliner.order():
+        inliner.func = func
+        inliner.locals = declared_names(func)
+        func.body = inliner.expand(func.body)
+    if inliner.inlined:
+        resolve_program(program)
+    return inliner.inlined
+
+class Inliner:
+    def __init__(self, program, limit):
+        self.functions = { stmt.name: stmt for stmt in program.statements
+                           if isinstance(stmt, Function) }
+        self.calls = { name: { node.name for node in walk(func.body)
+                               if isinstance(node, Call) and node.name in self.functions }
+                       for name, func in self.functions.items() }
+        self.limit = limit
+        self.names = program_names(program)
+        self.candidates = { }     # Function name -> free names if it can be inlined, else None
+        self.func = None          # Function being expanded
+        self.locals = set()       # Names declared in it
+        self.inlined = 0
+
+    # Functions in the order to expand them:  callees before callers
+    def order(self):
+        result = [ ]
+        seen = set()
+        def visit(name):
+            if name not in seen:
+                seen.add(name)
+                for callee in sorted(self.calls[name]):
+                    visit(callee)
+                result.append(self.functions[name])
+        for name in self.functions:
+            visit(name)
+        return result
+
+    def recursive(self, name):
+        pending = list(self.calls[name])
+        seen = set()
+        while pending:
+            callee = pending.pop()
+            if callee == name:
+                return True
+            if callee not in seen:
+                seen.add(callee)
+                pending.extend(self.calls[callee])
+        return False
+
+    # The global names a function refers to if it can be inlined (None
+    # if it can't).  Worked out once it's been expanded itself.
+    def candidate(self, name):
+        if name not in self.candidates:
+            func = self.functions[name]
+            nodes = list(walk(func.body))
+            returns = sum(isinstance(node, Return) for node in nodes)
+            tail = tail_returns(func.body)
+            if self.recursive(name) or len(nodes) > self.limit:
+                free = None
+            elif returns and (tail is None or len(tail) != returns):
+                free = None
+            elif not returns and func.rettype != 'unit':
+                free = None
+            else:
+                free = free_names(nodes)
+            self.candidates[name] = free
+        return self.candidates[name]
+
+    def fresh_name(self, name):
+        return fresh_name(name, self.names)
+
+    # Inline calls in a node (or list of nodes).  Returns what to put in
+    # its place.
+    def expand(self, node):
+        if isinstance(node, list):
+            return [ self.expand(item) for item in node ]
+        for name in node._fields:
+            value = getattr(node, name, None)
+            if isinstance(value, (Node, list)):
+                setattr(node, name, self.expand(value))
+        if isinstance(node, Call) and node.name in self.functions:
+            free = self.candidate(node.name)
+            if free is not None and not (free & self.locals):
+                self.inlined += 1
+                return self.inline_call(node, self.functions[node.name])
+        return node
+
+    def inline_call(self, call, func):
+        body = copy.deepcopy(func.body)
+        renames = { }
+        for param in func.parameters:
+            renames[param.name] = self.fresh_name(param.name)
+        for node in walk(body):
+            if isinstance(node, (Variable, Const)) and node.name not in renames:
+                renames[node.name] = self.fresh_name(node.name)
+            elif isinstance(node, MatchCase) and node.binding is not None and node.binding not in renames:
+                renames[node.binding] = self.fresh_name(node.binding)
+        for node in walk(body):
+            if isinstance(node, (Variable, Const)):
+                node.name = renames[node.name]
+            elif isinstance(node, MatchCase) and node.binding is not None:
+                node.binding = renames[node.binding]
+            elif isinstance(node, Name) and getattr(node, 'address', None) is not None:
+                if node.address[0] == LOCAL:
+                    node.name = renames[node.name]
+        self.locals.update(renames.values())
+
+        assigned = { node.location.name for node in walk(body)
+                     if isinstance(node, Assignment) and isinstance(node.location, Name) }
+        statements = [ ]
+        for param, arg in zip(func.parameters, call.arguments):
+            name = renames[param.name]
+            decl = (Variable if name in assigned else Const)(name, param.type, arg)
+            statements.append(located(decl, call))
+        returns = tail_returns(body)
+        if returns is None:
+            value = make_literal((), 'unit', call)
+        elif len(returns) == 1:
+            value = body.pop().value
+        else:
+            result = self.fresh_name('result')
+            statements.append(located(Variable(result, func.rettype, None), call))
+            set_result(body, result, func.rettype)
+            value = located(Name(result), call)
+            value.type = func.rettype
+        statements.extend(body)
+        statements.append(located(ExprStatement(value), call))
+        result = located(Compound(statements), call)
+        result.type = func.rettype
+        return result
+
+# The returns in tail position in a block (None if it doesn't end with
+# one)
+def tail_returns(statements):
+    last = statements[-1] if statements else None
+    if isinstance(last, Return):
+        return [ last ]
+    elif isinstance(last, If):
+        consequence = tail_returns(last.consequence)
+        alternative = tail_returns(last.alternative)
+        if consequence is not None and alternative is not None:
+            return consequence + alternative
+    return None
+
+# Replace the returns in tail position with assignments to a variable
+def set_result(statements, name, type):
+    last = statements[-1]
+    if isinstance(last, Return):
+        location = located(Name(name), last)
+        location.type = type
+        statements[-1] = located(Assignment(location, last.value), last)
+    else:
+        set_result(last.consequence, name, type)
+        set_result(last.alternative, name, type)
+
+def located(node, like):
+    if hasattr(like, 'lineno'):
+        node.lineno = like.lineno
     return node
 
+# Every name used in a program
+def program_names(program):
+    return { name for node in walk(program) for name in node_names(node) }
+
+# A name made from name that isn't in names (which it's added to)
+def fresh_name(name, names):
+    n = 1
+    while f'{name}_{n}' in names:
+        n += 1
+    names.add(f'{name}_{n}')
+    return f'{name}_{n}'
+
+# Names declared by a node (or the name of what it defines)
+def node_names(node):
+    if isinstance(node, (Name, Call, Variable, Const, Parameter, Function, Struct, Enum)):
+        return [ node.name ]
+    elif isinstance(node, MatchCase) and node.binding is not None:
+        return [ node.binding ]
+    return [ ]
+
+def declared_names(func):
+    names = { param.name for param in func.parameters }
+    for node in walk(func.body):
+        if isinstance(node, (Variable, Const)):
+            names.add(node.name)
+        elif isinstance(node, MatchCase) and node.binding is not None:
+            names.add(node.binding)
+    return names
+
+# Names that nodes look up outside of the function they're in:  globals,
+# functions, structs and enums
+def free_names(nodes):
+    names = set()
+    for node in nodes:
+        if isinstance(node, Name) and getattr(node, 'address', None) is not None:
+            if node.address[0] == GLOBAL:
+                names.add(node.name)
+        elif isinstance(node, Call):
+            names.add(node.name)
+        elif isinstance(node, EnumValue):
+            names.add(node.enum)
+    return names
+
+# ---- Loop optimization
+#
+# optimize_loops() saves work in while loops by keeping the value of an
+# arithmetic expression in a variable and using the variable where the
+# expression would give the same value again:
+#
+#   - An expression none of whose variables are changed in the loop
+#     (it's loop-invariant) is computed once, before the loop.
+#
+#   - An expression computed again later in the loop, with none of its
+#     variables changed in between, reuses the earlier value.  That
+#     includes the first one in an iteration reusing the last one of
+#     the iteration before.  In mandel_loop.wb:
+#
+#         while n > 0 {                      var t_1 float = _x*_x;
+#             xtemp = _x*_x - ... ;          while n > 0 {
+#             ...                                xtemp = t_1 - ... ;
+#             _x = xtemp;           ---->        ...
+#             n = n - 1;                         _x = xtemp;
+#             if _x*_x + ... > 4.0 {             n = n - 1;
+#                 ...                            t_1 = _x*_x;
+#                                                if t_1 + ... > 4.0 {
+#
+#     so _x*_x is multiplied once per iteration instead of twice.
+#
+# Only expressions made of arithmetic operators, variables and literals
+# are considered, and only where they're always evaluated:  in the
+# statements of the loop body itself (not in nested blocks), outside
+# the right side of && and ||, and not in statements that call a
+# function or assign to a variable in a compound expression or match
+# (where uses in the same statement might see different values).  A
+# statement changes the variables assigned or declared anywhere in it,
+# and a call may change any global.  Loops containing a continue are
+# left alone.
+#
+# None of these expressions can fail (pure() rules out division by
+# anything but a nonzero literal), so computing one before the loop is
+# safe even if the loop never runs.  Inner loops are done first.  The program is resolved
+# again afterwards.  Returns the number of expressions given variables.
+
+def optimize_loops(program):
+    optimizer = LoopOptimizer(program_names(program))
+    program.statements = optimizer.optimize_block(program.statements)
+    for stmt in program.statements:
+        if isinstance(stmt, Function):
+            stmt.body = optimizer.optimize_block(stmt.body)
+    if optimizer.optimized:
+        resolve_program(program)
+    return optimizer.optimized
+
+class LoopOptimizer:
+    def __init__(self, names):
+        self.names = names        # Names in use (see fresh_name())
+        self.optimized = 0
+
+    # Optimize the loops in a block.  Returns the new block.
+    def optimize_block(self, statements):
+        result = [ ]
+        for stmt in statements:
+            if isinstance(stmt, If):
+                stmt.consequence = self.optimize_block(stmt.consequence)
+                stmt.alternative = self.optimize_block(stmt.alternative)
+            elif isinstance(stmt, While):
+                stmt.body = self.optimize_block(stmt.body)
+                if not continues(stmt.body):
+                    result.extend(self.optimize_loop(stmt))
+            result.append(stmt)
+        return result
+
+    # Give expressions in a loop variables, largest first.  Returns the
+    # declarations of the variables (to go in front of the loop).
+    def optimize_loop(self, loop):
+        declarations = [ ]
+        while True:
+            uses, changes = self.find_uses(loop)
+            best = None
+            for found in uses.values():
+                reused = reuses(found, changes)
+                size = sum(1 for _ in walk(found[0][1]))
+                if any(reused) and (best is None or size > best[0]):
+                    best = (size, found, reused)
+            if best is None:
+                return declarations
+            declarations.append(self.keep_value(loop, best[1], best[2]))
+
+    # Expressions always evaluated in the loop body.  Returns a dict
+    # mapping each expression's key to where it's found (in order) as
+    # (statement number, node, holder, field), and the variables changed
+    # by each statement, followed by those changed by the test.
+    def find_uses(self, loop):
+        changes = [ changed(stmt) for stmt in loop.body ] + [ changed(loop.test) ]
+        uses = { }
+        for index, stmt in enumerate(loop.body):
+            if GLOBAL not in changes[index] and not assigns_within(stmt):
+                for field in evaluated_fields(stmt):
+                    find_expressions(stmt, field, index, uses)
+        return uses, changes
+
+    # Replace the uses of an expression with a new variable.  Where the
+    # value can't be reused, it's assigned to the variable first.
+    def keep_value(self, loop, found, reused):
+        first = found[0][1]
+        name = fresh_name('t', self.names)
+        if all(reused):
+            decl = Const(name, first.type, first)
+        elif reused[0]:
+            decl = Variable(name, first.type, copy.deepcopy(first))
+        else:
+            decl = Variable(name, first.type, None)
+        assignments = { }
+        for (index, node, holder, field), ok in zip(found, reused):
+            if not ok and index not in assignments:
+                assignments[index] = located(Assignment(typed_name(name, node), node), loop.body[index])
+            if isinstance(field, int):
+                holder[field] = typed_name(name, node)
+            else:
+                setattr(holder, field, typed_name(name, node))
+        body = [ ]
+        for index, stmt in enumerate(loop.body):
+            if index in assignments:
+                body.append(assignments[index])
+            body.append(stmt)
+        loop.body = body
+        self.optimized += 1
+        return located(decl, loop)
+
+# Does a loop body have a continue of its own (not one in a nested loop)?
+def continues(statements):
+    pending = list(statements)
+    while pending:
+        node = pending.pop()
+        if isinstance(node, Continue):
+            return True
+        if isinstance(node, Node) and not isinstance(node, While):
+            for name in node._fields:
+                value = getattr(node, name, None)
+                if isinstance(value, list):
+                    pending.extend(value)
+                elif isinstance(value, Node):
+                    pending.append(value)
+    return False
+
+# Addresses of the variables that a node may change.  GLOBAL stands for
+# every global (a call might change any of them).
+def changed(node):
+    result = set()
+    for child in walk(node):
+        if isinstance(child, Assignment) and isinstance(child.location, Name):
+            result.add(getattr(child.location, 'address', None))
+        elif isinstance(child, (Variable, Const, MatchCase)):
+            result.add(getattr(child, 'address', None))
+        elif isinstance(child, Call) and child.name not in builtin_types:
+            result.add(GLOBAL)
+    return result
+
+# Does a statement assign to a variable declared outside of a compound
+# expression or match while its expressions are being evaluated?
+def assigns_within(stmt):
+    for field in evaluated_fields(stmt):
+        for node in walk(getattr(stmt, field)):
+            if isinstance(node, (Compound, Match)):
+                declared = { getattr(child, 'address', None) for child in walk(node)
+                             if isinstance(child, (Variable, Const, MatchCase)) }
+                if changed(node) - declared:
+                    return True
+    return False
+
+def changes_any(changes, variables):
+    return any(address in changes or (GLOBAL in changes and address[0] == GLOBAL)
+               for address in variables)
+
+# Which uses of an expression (found by find_uses()) can reuse the value
+# of the one before?  The first reuses the last, one iteration back.
+def reuses(found, changes):
+    variables = { node.address for node in walk(found[0][1]) if isinstance(node, Name) }
+    result = [ ]
+    for n, (index, node, holder, field) in enumerate(found):
+        last = found[n - 1][0]
+        if n == 0:
+            between = changes[last:] + changes[:index]
+        else:
+            between = changes[last:index]
+        result.append(not any(changes_any(change, variables) for change in between))
+    return result
+
+# Fields of a statement holding expressions it always evaluates
+def evaluated_fields(stmt):
+    if isinstance(stmt, (Assignment, Variable, Const, Print, Return)):
+        return [ 'value' ] if stmt.value is not None else [ ]
+    elif isinstance(stmt, ExprStatement):
+        return [ 'expression' ]
+    elif isinstance(stmt, If):
+        return [ 'test' ]
+    return [ ]
+
+# Find the expressions that could be kept in variables in holder.field
+# (holder[field] for a list).  Subexpressions come first.
+def find_expressions(holder, field, index, uses):
+    node = holder[field] if isinstance(field, int) else getattr(holder, field)
+    if isinstance(node, BinOp):
+        find_expressions(node, 'left', index, uses)
+        if node.op not in ('&&', '||'):
+            find_expressions(node, 'right', index, uses)
+    elif isinstance(node, UnaryOp):
+        find_expressions(node, 'operand', index, uses)
+    elif isinstance(node, Call):
+        for n in range(len(node.arguments)):
+            find_expressions(node.arguments, n, index, uses)
+    if isinstance(node, (BinOp, UnaryOp)):
+        key = expression_key(node)
+        if key is not None:
+            uses.setdefault(key, [ ]).append((index, node, holder, field))
+
+# A key that's the same for expressions that compute the same thing
+# from the same variables (None if node can't be kept in a variable)
+def expression_key(node):
+    if isinstance(node, Name):
+        return getattr(node, 'address', None)
+    elif is_literal(node):
+        return (type(node).__name__, node.value)
+    elif (isinstance(node, (BinOp, UnaryOp)) and node.op in ('+', '-', '*', '/')
+          and getattr(node, 'type', None) in ('int', 'float') and pure(node)):
+        children = (node.left, node.right) if isinstance(node, BinOp) else (node.operand,)
+        keys = tuple(expression_key(child) for child in children)
+        if None not in keys:
+            return (node.op,) + keys
+    return None
+
+def typed_name(name, like):
+    node = located(Name(name), like)
+    node.type = like.type
+    return node
+
+transformers = Dispatch({
+    list: transform_list,
+
+    # Expressions
+    (Integer, Float, Char, Bool, Unit): transform_nothing,
+    Name: transform_name,
+    Attribute: transform_attribute,
+    UnaryOp: transform_unaryop,
+    BinOp: transform_binop,
+    Call: transform_call,
+    EnumValue: transform_enumvalue,
+    Match: transform_match,
+    Compound: transform_compound,
+
+    # Statements
+    Print: transform_print,
+    Assignment: transform_assignment,
+    Variable: transform_variable,
+    Const: transform_const,
+    If: transform_if,
+    While: transform_while,
+    (Break, Continue): transform_nothing,
+    Return: transform_return,
+    ExprStatement: transform_exprstatement,
+    Function: transform_function,
+    (Struct, Enum): transform_nothing,
+    Program: transform_program,
+}, default=transform_nothing)
+
 # Main function (for testing)
 def main(filename):
     from .parse import parse_file
+    from .typecheck import check_program
     model = parse_file(filename)
+    if not check_program(model):
+        raise SystemExit(1)
     model = transform(model)
     print(model)
 
@@ -50,37 +50,554 @@
 #
 # The directory tests/Errors has Wabbit programs with various errors.
 
+from collections import ChainMap
+
 from .model import *
+from .resolve import resolve_toplevel, resolve_function
+
+# Built-in type names
+builtin_types = { 'int', 'float', 'char', 'bool', 'unit' }
+
+# Capabilities of the operators.  Maps (op, type) or (op, left, right)
+# to the result type.
+unary_ops = {
+    ('+', 'int'): 'int',
+    ('-', 'int'): 'int',
+    ('+', 'float'): 'float',
+    ('-', 'float'): 'float',
+    ('!', 'bool'): 'bool',
+}
+
+binary_ops = { }
+for op in '+-*/':
+    binary_ops[op, 'int', 'int'] = 'int'
+    binary_ops[op, 'float', 'float'] = 'float'
+for op in ('<', '<=', '>', '>=', '==', '!='):
+    for typename in ('int', 'float', 'char'):
+        binary_ops[op, typename, typename] = 'bool'
+for op in ('==', '!='):
+    binary_ops[op, 'bool', 'bool'] = 'bool'
+    binary_ops[op, 'unit', 'unit'] = 'bool'
+for op in ('&&', '||'):
+    binary_ops[op, 'bool', 'bool'] = 'bool'
+
+# Type conversions.  Maps (target, source) to a result
+conversions = {
+    ('int', 'int'), ('int', 'float'), ('int', 'char'),
+    ('float', 'float'), ('float', 'int'),
+    ('char', 'char'), ('char', 'int'),
+}
+
+# Represents one of the built-in types in the environment
+class BuiltinType:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f'BuiltinType({self.name})'
+
+# The environment maps names to the model node that declared them
+# (Variable, Const, Parameter, Function, Struct, Enum) or to a
+# BuiltinType.  Scopes are layered using a ChainMap.  A few entries
+# with names that can't appear in source code carry information about
+# the context being checked:
+#
+#    '$errors'    - List of (lineno, message) errors (global)
+#    '$function'  - The Function being checked (if any)
+#    '$loop'      - True if inside a while-loop
+#
+# Declarations of resolved variables (see resolve.py) are also kept in
+# frames by address so that uses of them don't have to search through
+# the scopes:  env.frames is (frame of the function, global frame),
+# lists of declarations.  It's None when checking code that hasn't been
+# resolved.  The scopes are still used to report errors.
+
+class Environment(ChainMap):
+    frames = None
+
+    def new_child(self, m=None):
+        child = super().new_child(m)
+        child.frames = self.frames
+        return child
+
+def new_environment():
+    env = Environment({ name: BuiltinType(name) for name in builtin_types })
+    env['$errors'] = [ ]
+    env['$function'] = None
+    env['$loop'] = False
+    return env.new_child()
+
+def error(node, message, env):
+    env['$errors'].append((getattr(node, 'lineno', 0), message))
+
+def is_type(name, env):
+    return isinstance(env.get(name), (BuiltinType, Struct, Enum))
+
+# Top-level function used to check programs.  Returns True if there
+# are no errors.  Checking happens in three passes:
+#
+#   1. Declare all structs, enums and function signatures.  These may be
+#      used before they are defined in the source.
+#   2. Check all other top-level statements in order.  Globals must be
+#      defined before they're used here.
+#   3. Check function bodies.  All globals are visible by now.
+#
+# With a CheckCache (see checkcache.py), function bodies that haven't
+# changed since an earlier check aren't resolved or checked again.
+# With jobs > 1, function bodies are resolved and checked by that many
+# processes (see parcheck.py).
+def check_program(model, cache=None, jobs=1):
+    functions = [ stmt for stmt in model.statements if isinstance(stmt, Function) ]
+    parallel = jobs > 1 and len(functions) > 1
+    resolver = resolve_toplevel(model)
+    if cache is None and not parallel:
+        for func in functions:
+            resolve_function(func, resolver)
+    env = new_environment()
+    globals = [ None ] * model.size
+    env.frames = (globals, globals)
+    declare_toplevel(model.statements, env)
+    for stmt in model.statements:
+        if not isinstance(stmt, (Function, Struct, Enum)):
+            check(stmt, env)
+    if cache is not None:
+        cache.check_functions(functions, env, resolver, jobs)
+    elif parallel:
+        from .parcheck import check_functions
+        check_functions(functions, env, resolver, jobs)
+    else:
+        for func in functions:
+            check_function_body(func, env)
+    report_errors(env)
+    return not env['$errors']
+
+def report_errors(env):
+    for lineno, message in sorted(env['$errors'], key=lambda err: err[0]):
+        print(f'{lineno}: {message}')
+
+# Pass 1: Declare structs, enums and function signatures.  Type names
+# are entered first so that they can refer to each other.
+def declare_toplevel(statements, env):
+    types = [ stmt for stmt in statements if isinstance(stmt, (Struct, Enum)) ]
+    for stmt in types:
+        declare(stmt, stmt.name, env)
+    for stmt in types:
+        if isinstance(stmt, Struct):
+            check_struct(stmt, env)
+        else:
+            check_enum(stmt, env)
+    for stmt in statements:
+        if isinstance(stmt, Function):
+            check_function_signature(stmt, env)
 
-# Top-level function used to check programs
-def check_program(model):
-    env = { }
-    check(model, env)
-    # Maybe return True/False if there are errors
+def declare(node, name, env):
+    if name in env.maps[0]:
+        error(node, f'Duplicate definition of {name!r}', env)
+    env[name] = node
+    address = getattr(node, 'address', None)
+    if address is not None and env.frames is not None:
+        env.frames[address[0]][address[1]] = node
+
+# The declaration of the variable named by a Name (None if not declared)
+def lookup(node, env):
+    address = getattr(node, 'address', None)
+    if address is not None and env.frames is not None:
+        decl = env.frames[address[0]][address[1]]
+        if decl is not None:
+            return decl
+    return env.get(node.name)
 
 # Internal function used to check nodes with an environment.  Critical
 # point: Everything is focused on types.  The result of an expression
-# is a type.  The inputs to different operations are types.
+# is a type.  The inputs to different operations are types.  The type
+# of each expression is also recorded on the node as node.type.
 
 def check(node, env):
-    if isinstance(node, Integer):
-        return "int"
-    ...
+    result = checkers[type(node)](node, env)
+    if isinstance(node, Expression):
+        node.type = result
+    return result
+
+def check_list(node, env):
+    for stmt in node:
+        check(stmt, env)
+    return None
+
+def check_unknown(node, env):
     raise RuntimeError(f"Couldn't check {node}")
 
-# Sample main program
-def main(filename):
-    from .parse import parse_file
-    model = parse_file(filename)
-    check_program(model)
+# ---- Expressions
 
-if __name__ == '__main__':
-    import sys
-    main(sys.argv[1])
+def check_integer(node, env):
+    return 'int'
+
+def check_float(node, env):
+    return 'float'
+
+def check_char(node, env):
+    return 'char'
+
+def check_bool(node, env):
+    return 'bool'
+
+def check_unit(node, env):
+    return 'unit'
+
+def check_name(node, env):
+    decl = lookup(node, env)
+    if decl is None:
+        error(node, f'{node.name!r} not defined', env)
+        return 'error'
+    if not isinstance(decl, (Variable, Const, Parameter)):
+        error(node, f'{node.name!r} is not a variable', env)
+        return 'error'
+    return decl.type
+
+def check_attribute(node, env):
+    valtype = check(node.value, env)
+    if valtype == 'error':
+        return 'error'
+    struct = env.get(valtype)
+    if not isinstance(struct, Struct):
+        error(node, f'{to_source(node.value)} is not a structure', env)
+        return 'error'
+    for field in struct.fields:
+        if field.name == node.name:
+            return field.type
+    error(node, f'{valtype} has no field {node.name!r}', env)
+    return 'error'
+
+def check_unaryop(node, env):
+    optype = check(node.operand, env)
+    if optype == 'error':
+        return 'error'
+    result = unary_ops.get((node.op, optype))
+    if result is None:
+        error(node, f'Unsupported operation {node.op}{optype}', env)
+        return 'error'
+    return result
 
+def check_binop(node, env):
+    lefttype = check(node.left, env)
+    righttype = check(node.right, env)
+    if lefttype == 'error' or righttype == 'error':
+        return 'error'
+    result = binary_ops.get((node.op, lefttype, righttype))
+    if result is None:
+        error(node, f'Unsupported operation {lefttype} {node.op} {righttype}', env)
+        return 'error'
+    return result
 
+def check_call(node, env):
+    argtypes = [ check(arg, env) for arg in node.arguments ]
+    decl = env.get(node.name)
+    if decl is None:
+        error(node, f'{node.name!r} not defined', env)
+        return 'error'
 
-        
+    if isinstance(decl, BuiltinType):
+        if len(argtypes) != 1:
+            error(node, f'{node.name}() takes exactly 1 argument', env)
+        elif argtypes[0] != 'error' and (node.name, argtypes[0]) not in conversions:
+            error(node, f"Can't convert {argtypes[0]} to {node.name}", env)
+        return node.name
 
+    if isinstance(decl, Function):
+        expected = [ param.type for param in decl.parameters ]
+        result = decl.rettype
+    elif isinstance(decl, Struct):
+        expected = [ field.type for field in decl.fields ]
+        result = decl.name
+    else:
+        error(node, f'{node.name!r} is not callable', env)
+        return 'error'
 
-        
+    if len(argtypes) != len(expected):
+        error(node, f'{node.name}() expects {len(expected)} arguments. Got {len(argtypes)}', env)
+    else:
+        for n, (argtype, exptype) in enumerate(zip(argtypes, expected), 1):
+            if argtype != exptype and argtype != 'error':
+                error(node, f'Type error in argument {n} of {node.name}(). Expected {exptype}. Got {argtype}', env)
+    return result
+
+def check_enumvalue(node, env):
+    valtype = check(node.value, env) if node.value is not None else None
+    enum = env.get(node.enum)
+    if not isinstance(enum, Enum):
+        error(node, f'{node.enum!r} is not an enum', env)
+        return 'error'
+    for choice in enum.choices:
+        if choice.name == node.choice:
+            break
+    else:
+        error(node, f'{node.enum} has no choice {node.choice!r}', env)
+        return 'error'
+    if choice.type is None and valtype is not None:
+        error(node, f'{node.enum}::{node.choice} takes no value', env)
+    elif choice.type is not None and valtype is None:
+        error(node, f'{node.enum}::{node.choice} expects a value', env)
+    elif valtype not in (choice.type, 'error'):
+        error(node, f'{node.enum}::{node.choice} expects {choice.type}. Got {valtype}', env)
+    return enum.name
+
+def check_match(node, env):
+    valtype = check(node.value, env)
+    if valtype == 'error':
+        return 'error'
+    enum = env.get(valtype)
+    if not isinstance(enum, Enum):
+        error(node, f"Can't match on {valtype}", env)
+        return 'error'
+
+    choices = { choice.name: choice for choice in enum.choices }
+    seen = set()
+    result = None
+    for case in node.cases:
+        caseenv = env.new_child()
+        if case.choice == '_':
+            seen.update(choices)
+        elif case.choice not in choices:
+            error(case, f'{case.choice!r} is not a choice of {enum.name}', env)
+        else:
+            seen.add(case.choice)
+            choice = choices[case.choice]
+            if choice.type is None and case.binding is not None:
+                error(case, f'{case.choice} has no value', env)
+            elif choice.type is not None and case.binding is None:
+                error(case, f'{case.choice} expects a value', env)
+            elif case.binding is not None:
+                binding = Parameter(case.binding, choice.type)
+                binding.lineno = case.lineno
+                binding.address = getattr(case, 'address', None)
+                declare(binding, case.binding, caseenv)
+        casetype = check(case.value, caseenv)
+        if result is None or result == 'error':
+            result = casetype
+        elif casetype != result and casetype != 'error':
+            error(case, f'Inconsistent type in match. Expected {result}. Got {casetype}', env)
+
+    missing = [ name for name in choices if name not in seen ]
+    if missing:
+        error(node, f'match does not cover {", ".join(missing)}', env)
+    return result or 'error'
+
+def check_compound(node, env):
+    env = env.new_child()
+    check(node.statements, env)
+    if node.statements and isinstance(node.statements[-1], ExprStatement):
+        return node.statements[-1].expression.type
+    return 'unit'
+
+# ---- Statements
+
+def check_print(node, env):
+    check(node.value, env)
+
+def check_assignment(node, env):
+    valtype = check(node.value, env)
+    loctype = check(node.location, env)
+
+    # Find the variable at the root of the location (p in p.x.y)
+    root = node.location
+    while isinstance(root, Attribute):
+        root = root.value
+    decl = lookup(root, env) if isinstance(root, Name) else None
+    if isinstance(decl, Const):
+        error(node, f"Can't assign to const {root.name!r}", env)
+    elif loctype != valtype and 'error' not in (loctype, valtype):
+        error(node, f'Type error in assignment. {loctype} = {valtype}', env)
+
+def check_variable(node, env):
+    valtype = check(node.value, env) if node.value is not None else None
+    if node.type is None:
+        if valtype is None:
+            error(node, f'Variable {node.name!r} needs a type or a value', env)
+        node.type = valtype or 'error'
+    elif not is_type(node.type, env):
+        error(node, f'{node.type!r} is not a type', env)
+        node.type = 'error'
+    elif valtype not in (None, 'error', node.type):
+        error(node, f'Type error in initialization. Expected {node.type}. Got {valtype}', env)
+    elif valtype is None and isinstance(env[node.type], Enum):
+        error(node, f'Variable {node.name!r} of type {node.type} needs a value', env)
+    declare(node, node.name, env)
+
+def check_const(node, env):
+    # Same rules as variables, but a value is always required by the grammar
+    check_variable(node, env)
+
+def check_if(node, env):
+    testtype = check(node.test, env)
+    if testtype not in ('bool', 'error'):
+        error(node.test, f'Condition must be bool. Got {testtype}', env)
+    check(node.consequence, env.new_child())
+    check(node.alternative, env.new_child())
+
+def check_while(node, env):
+    testtype = check(node.test, env)
+    if testtype not in ('bool', 'error'):
+        error(node.test, f'Condition must be bool. Got {testtype}', env)
+    env = env.new_child()
+    env['$loop'] = True
+    check(node.body, env)
+
+def check_break(node, env):
+    if not env['$loop']:
+        error(node, 'break used outside of a loop', env)
+
+def check_continue(node, env):
+    if not env['$loop']:
+        error(node, 'continue used outside of a loop', env)
+
+def check_return(node, env):
+    valtype = check(node.value, env)
+    func = env['$function']
+    if func is None:
+        error(node, 'return used outside of a function', env)
+    elif valtype not in (func.rettype, 'error'):
+        error(node, f'Type error in return. Expected {func.rettype}. Got {valtype}', env)
+
+def check_exprstatement(node, env):
+    check(node.expression, env)
+
+# Functions are checked in two parts.  The signature is checked (and
+# the function declared) first.  The body is checked separately.
+def check_function(node, env):
+    error(node, 'Nested functions are not supported', env)
+
+def check_function_signature(node, env):
+    for param in node.parameters:
+        if not is_type(param.type, env):
+            error(param, f'{param.type!r} is not a type', env)
+    if not is_type(node.rettype, env):
+        error(node, f'{node.rettype!r} is not a type', env)
+    declare(node, node.name, env)
+
+def check_function_body(node, env):
+    env = env.new_child()
+    if env.frames is not None and getattr(node, 'size', None) is not None:
+        env.frames = ([ None ] * node.size, env.frames[1])
+    else:
+        env.frames = None
+    env['$function'] = node
+    env['$loop'] = False
+    for param in node.parameters:
+        declare(param, param.name, env)
+    check(node.body, env.new_child())
+    if node.rettype != 'unit' and not always_returns(node.body):
+        error(node, f'Function {node.name!r} might not return a value', env)
+
+# Does a list of statements always end in a return?
+def always_returns(statements):
+    for stmt in statements:
+        if isinstance(stmt, Return):
+            return True
+        if isinstance(stmt, If) and always_returns(stmt.consequence) and always_returns(stmt.alternative):
+            return True
+    return False
+
+def check_struct(node, env):
+    names = set()
+    for field in node.fields:
+        if field.name in names:
+            error(field, f'Duplicate field {field.name!r}', env)
+        names.add(field.name)
+        if field.type == node.name:
+            error(field, f'Recursive structure {node.name!r} not allowed', env)
+        elif not is_type(field.type, env):
+            error(field, f'{field.type!r} is not a type', env)
+
+def check_enum(node, env):
+    names = set()
+    for choice in node.choices:
+        if choice.name in names:
+            error(choice, f'Duplicate choice {choice.name!r}', env)
+        names.add(choice.name)
+        if choice.type is None:
+            continue
+        if choice.type == node.name:
+            error(choice, f'Recursive enum {node.name!r} not allowed', env)
+        elif not is_type(choice.type, env):
+            error(choice, f'{choice.type!r} is not a type', env)
+
+# Struct and enum definitions are declared by declare_toplevel().  If
+# one turns up anywhere else, it's nested.
+def check_typedef(node, env):
+    error(node, f'{node.name!r} must be defined at the top level', env)
+
+def check_program_node(node, env):
+    declare_toplevel(node.statements, env)
+    check([ stmt for stmt in node.statements if not isinstance(stmt, (Function, Struct, Enum)) ], env)
+    for stmt in node.statements:
+        if isinstance(stmt, Function):
+            check_function_body(stmt, env)
+
+# Functions used to check each class of node.  Those for expressions
+# return the type of the expression.
+checkers = Dispatch({
+    list: check_list,
+
+    # Expressions
+    Integer: check_integer,
+    Float: check_float,
+    Char: check_char,
+    Bool: check_bool,
+    Unit: check_unit,
+    Name: check_name,
+    Attribute: check_attribute,
+    UnaryOp: check_unaryop,
+    BinOp: check_binop,
+    Call: check_call,
+    EnumValue: check_enumvalue,
+    Match: check_match,
+    Compound: check_compound,
+
+    # Statements
+    Print: check_print,
+    Assignment: check_assignment,
+    Variable: check_variable,
+    Const: check_const,
+    If: check_if,
+    While: check_while,
+    Break: check_break,
+    Continue: check_continue,
+    Return: check_return,
+    ExprStatement: check_exprstatement,
+    Function: check_function,
+    (Struct, Enum): check_typedef,
+    Program: check_program_node,
+}, default=check_unknown)
+
+# Sample main program.  With cache set to a filename, results are
+# kept there between runs and the number reused is printed to stderr.
+# jobs is the number of processes used to check function bodies.
+def main(filename, cache=None, jobs=1):
+    from .parse import parse_file
+    model = parse_file(filename)
+    if cache is None:
+        ok = check_program(model, jobs=jobs)
+    else:
+        import sys
+        from .checkcache import CheckCache
+        results = CheckCache.load(cache)
+        ok = check_program(model, cache=results, jobs=jobs)
+        results.save(cache)
+        print(f'{filename}: {results.stats}', file=sys.stderr)
+    if not ok:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    import sys
+    # Use the checker in the module wabbit.typecheck, not in this copy
+    # of it running as __main__.  checkcache.py and parcheck.py import
+    # it from there and test environments against its classes.
+    from wabbit.typecheck import main
+    args = sys.argv[1:]
+    options = { }
+    while len(args) > 1 and args[0] in ('-cache', '-j'):
+        if args[0] == '-cache':
+            options['cache'] = args[1]
+        else:
+            options['jobs'] = int(args[1])
+        args = args[2:]
+    main(args[0], **options)
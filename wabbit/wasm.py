@@ -11,11 +11,117 @@
 # machine.  If your IRCode is using registers, you will need to
 # figure out some way to translate that to a stack.
 
-from .model import *
+import struct
 
-# Class representing the world of Wasm
+from .iropt import expand_code
+
+# Wasm Type names
+i32 = b'\x7f'   # (32-bit int)
+i64 = b'\x7e'   # (64-bit int)
+f32 = b'\x7d'   # (32-bit float)
+f64 = b'\x7c'   # (64-bit float)
+
+# IR types.  Booleans and characters are held in an i32
+types = {
+    'i32': i32,
+    'i1': i32,
+    'i8': i32,
+    'f64': f64,
+    }
+
+# Runtime functions imported from the 'runtime' module (see html/test.html)
+runtime = {
+    '_printi': i32,
+    '_printf': f64,
+    '_printb': i32,
+    '_printc': i32,
+    '_printu': i32,
+    }
+
+# Encoding of primitive values
+
+def encode_unsigned(value):
+    parts = [ ]
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if not value:
+            parts.append(byte)
+            return bytes(parts)
+        parts.append(byte | 0x80)
+
+def encode_signed(value):
+    parts = [ ]
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if (value == 0 and not byte & 0x40) or (value == -1 and byte & 0x40):
+            parts.append(byte)
+            return bytes(parts)
+        parts.append(byte | 0x80)
+
+def encode_f64(value):
+    return struct.pack('<d', value)
+
+def encode_vector(items):
+    if isinstance(items, bytes):
+        return encode_unsigned(len(items)) + items
+    else:
+        return encode_unsigned(len(items)) + b''.join(items)
+
+def encode_string(text):
+    return encode_vector(text.encode('utf-8'))
+
+def encode_section(sectnum, contents):
+    return bytes([sectnum]) + encode_unsigned(len(contents)) + contents
+
+# Class representing the world of Wasm.  A function gets its index
+# when it is declared (imports come first).  The code of a function is
+# kept as already-encoded bytes.
 class WabbitWasmModule:
-    pass
+    def __init__(self):
+        self.imported_functions = [ ]
+        self.functions = [ ]
+        self.index = { }
+        self.global_variables = [ ]
+        for name, argtype in runtime.items():
+            self.index[name] = WasmImportedFunction(self, 'runtime', name, [ argtype ], [ ])
+
+    def declare_globals(self, globals):
+        # Declare any (name, irtype) globals not seen before
+        for name, irtype in globals[len(self.global_variables):]:
+            self.global_variables.append(types[irtype])
+
+    def declare_functions(self, signatures):
+        # Declare any (name, argtypes, rettype) signatures not seen before
+        for name, argtypes, rettype in signatures[len(self.functions):]:
+            self.declare_function(name, argtypes, rettype)
+
+    def declare_function(self, name, argtypes, rettype):
+        if name not in self.index:
+            self.index[name] = WasmFunction(self, name, [ types[ty] for ty in argtypes ], [ types[rettype] ])
+        return self.index[name]
+
+class WasmImportedFunction:
+    def __init__(self, module, envname, name, argtypes, rettypes):
+        self.module = module
+        self.envname = envname
+        self.name = name
+        self.argtypes = argtypes
+        self.rettypes = rettypes
+        self.idx = len(module.imported_functions)
+        module.imported_functions.append(self)
+
+class WasmFunction:
+    def __init__(self, module, name, argtypes, rettypes):
+        self.module = module
+        self.name = name
+        self.argtypes = argtypes
+        self.rettypes = rettypes
+        self.idx = len(module.imported_functions) + len(module.functions)
+        self.local_types = [ ]
+        self.code = b''
+        module.functions.append(self)
 
 # Top-level function for generating code from the model
 def generate_wasm(irmodule):
@@ -23,33 +129,211 @@ def generate_wasm(irmodule):
     convert_module(irmodule, wasmmod)
     return wasmmod
 
-# Internal function for generating code on each node
 def convert_module(irmodule, wasmmod):
-    raise RuntimeError(f"Can't generate {node}")
-
-def main(filename):
-    from .parse import parse_file
-    from .typecheck import check_program
-    from .ircode import generate_ircode
-    from .transform import transform
-    
-    model = parse_file(filename)
-    check_program(model)
-    model = transform(model)
-    irmodule = generate_ircode(model)
-    wasmmodule = generate_wasm(irmodule)
-    
+    wasmmod.declare_globals(irmodule.globals)
+    for func in irmodule.functions:
+        wasmmod.declare_function(func.name, func.argtypes, func.rettype)
+    for func in irmodule.functions:
+        convert_function(func, wasmmod)
+
+# Encoded instructions that translate one-to-one
+opcodes = {
+    'i32.add': b'\x6a', 'i32.sub': b'\x6b', 'i32.mul': b'\x6c', 'i32.div': b'\x6d',
+    'i32.shl': b'\x74',
+    'i32.eq': b'\x46', 'i32.ne': b'\x47', 'i32.lt': b'\x48', 'i32.gt': b'\x4a',
+    'i32.le': b'\x4c', 'i32.ge': b'\x4e',
+    'i8.eq': b'\x46', 'i8.ne': b'\x47', 'i8.lt': b'\x49', 'i8.gt': b'\x4b',
+    'i8.le': b'\x4d', 'i8.ge': b'\x4f',
+    'i1.eq': b'\x46', 'i1.ne': b'\x47', 'i1.not': b'\x45',
+    'f64.add': b'\xa0', 'f64.sub': b'\xa1', 'f64.mul': b'\xa2', 'f64.div': b'\xa3',
+    'f64.neg': b'\x9a',
+    'f64.eq': b'\x61', 'f64.ne': b'\x62', 'f64.lt': b'\x63', 'f64.gt': b'\x64',
+    'f64.le': b'\x65', 'f64.ge': b'\x66',
+    'i32.neg': b'\x41\x7f\x6c',            # i32.const -1; i32.mul
+    'i32.to_f64': b'\xb7',
+    'f64.to_i32': b'\xaa',
+    'i8.to_i32': b'',
+    'i32.to_i8': b'\x41\xff\x01\x71',      # i32.const 255; i32.and
+    'drop': b'\x1a',
+    'ret': b'\x0f',
+    }
+
+# Wasm only has structured control flow.  If a function has labels,
+# its code is turned into a dispatch loop.  Each label starts a new
+# block of code and a local $pc holds the number of the block to run:
+#
+#     loop
+#       block                        ;; block n-1
+#         ...
+#           block                    ;; block 0
+#             local.get $pc
+#             br_table 0 1 ... n-1
+#           end
+#           <code for block 0>
+#         ...
+#       end
+#       <code for block n-1>
+#     end
+#
+# A goto sets $pc and branches back to the top of the loop.  Every
+# block ends with a goto, cbranch or ret, so nothing falls through.
+# Superinstructions other than local.tee are expanded first.
+def convert_function(irfunc, wasmmod):
+    func = wasmmod.declare_function(irfunc.name, irfunc.argtypes, irfunc.rettype)
+    func.local_types = [ types[ty] for name, ty in irfunc.locals[len(irfunc.argtypes):] ]
+
+    # Split the code into blocks
+    blocks = [ [ ] ]
+    numbers = { }
+    for instr in expand_code(irfunc.code):
+        if instr[0] == 'label':
+            numbers[instr[1]] = len(blocks)
+            blocks.append([ ])
+        else:
+            blocks[-1].append(instr)
+
+    code = [ ]
+    if len(blocks) > 1:
+        pc = encode_unsigned(len(irfunc.locals))
+        func.local_types.append(i32)
+        code.append(b'\x03\x40' + b'\x02\x40' * len(blocks))
+        code.append(b'\x20' + pc + b'\x0e' +
+                    encode_vector([ encode_unsigned(n) for n in range(len(blocks)) ]) + b'\x00')
+
+    for n, block in enumerate(blocks):
+        if len(blocks) > 1:
+            code.append(b'\x0b')
+        jump = b'\x21' + pc + b'\x0c' + encode_unsigned(len(blocks) - 1 - n) if len(blocks) > 1 else None
+        for instr in block:
+            op = instr[0]
+            if op in opcodes:
+                code.append(opcodes[op])
+            elif op in ('i32.const', 'i8.const', 'i1.const'):
+                code.append(b'\x41' + encode_signed(instr[1]))
+            elif op == 'f64.const':
+                code.append(b'\x44' + encode_f64(instr[1]))
+            elif op == 'local.load':
+                code.append(b'\x20' + encode_unsigned(instr[1]))
+            elif op == 'local.store':
+                code.append(b'\x21' + encode_unsigned(instr[1]))
+            elif op == 'local.tee':
+                code.append(b'\x22' + encode_unsigned(instr[1]))
+            elif op == 'global.load':
+                code.append(b'\x23' + encode_unsigned(instr[1]))
+            elif op == 'global.store':
+                code.append(b'\x24' + encode_unsigned(instr[1]))
+            elif op in ('call', 'call_ext'):
+                code.append(b'\x10' + encode_unsigned(wasmmod.index[instr[1]].idx))
+            elif op == 'goto':
+                code.append(b'\x41' + encode_signed(numbers[instr[1]]) + jump)
+            elif op == 'cbranch':
+                # if (result i32) then-block else else-block end
+                code.append(b'\x04\x7f' + b'\x41' + encode_signed(numbers[instr[1]]) +
+                            b'\x05' + b'\x41' + encode_signed(numbers[instr[2]]) + b'\x0b' + jump)
+            else:
+                raise RuntimeError(f"Can't convert {instr}")
+
+    if len(blocks) > 1:
+        # End of the loop.  It's never reached.
+        code.append(b'\x0b\x00')
+    code.append(b'\x0b')
+    func.code = b''.join(code)
+    return func
+
+# Encoding of the module
+
+def encode_signature(func):
+    return b'\x60' + encode_vector(func.argtypes) + encode_vector(func.rettypes)
+
+def encode_import_function(func):
+    return (encode_string(func.envname) +
+            encode_string(func.name) +
+            b'\x00' +
+            encode_unsigned(func.idx))
+
+def encode_global(gtype):
+    if gtype == i32:
+        return i32 + b'\x01\x41' + encode_signed(0) + b'\x0b'
+    else:
+        return f64 + b'\x01\x44' + encode_f64(0.0) + b'\x0b'
+
+def encode_export_function(func):
+    return encode_string(func.name) + b'\x00' + encode_unsigned(func.idx)
+
+def encode_function_code(func):
+    localtypes = [ b'\x01' + ltype for ltype in func.local_types ]
+    code = encode_vector(localtypes) + func.code
+    return encode_unsigned(len(code)) + code
+
+# Everything in front of the code section.  Only main() is exported.
+def encode_header(module):
+    all_funcs = module.imported_functions + module.functions
+    signatures = [ encode_signature(func) for func in all_funcs ]
+    all_imports = [ encode_import_function(func) for func in module.imported_functions ]
+    all_globals = [ encode_global(gtype) for gtype in module.global_variables ]
+    exports = [ encode_export_function(func) for func in module.functions if func.name == 'main' ]
+    return b''.join([
+        b'\x00asm\x01\x00\x00\x00',
+        encode_section(1, encode_vector(signatures)),
+        encode_section(2, encode_vector(all_imports)),
+        encode_section(3, encode_vector([ encode_unsigned(func.idx) for func in module.functions ])),
+        encode_section(6, encode_vector(all_globals)),
+        encode_section(7, encode_vector(exports)),
+        ])
+
+def encode_module(module):
+    all_code = [ encode_function_code(func) for func in module.functions ]
+    return encode_header(module) + encode_section(10, encode_vector(all_code))
+
+def main(filename, stream=False, time_passes=False):
+    from .compile import compile_file, pipelines
+
+    if stream:
+        return main_stream(filename)
+
+    wasmcode = compile_file(filename, pipelines['wasm'], time_passes)
     with open('out.wasm', 'wb') as file:
-        file.write(encode_module(wasmmodule))
+        file.write(wasmcode)
     print('Wrote out.wasm')
 
-if __name__ == '__main__':
-    import sys
-    main(sys.argv[1])
+# In streaming mode, the encoded code of each function is spooled to
+# a temporary file as soon as it's ready.  The sections in front of
+# the code need every function and global, and the code has to be in
+# the order the functions were declared, so the output file is
+# assembled from the spool at the end.
+def main_stream(filename):
+    import tempfile
+    from .stream import compile_file
 
-        
-        
+    wasmmod = WabbitWasmModule()
+    spooled = { }
+    with tempfile.TemporaryFile() as spool:
+        compiler = compile_file(filename)
+        for irfunc in compiler:
+            wasmmod.declare_globals(compiler.module.globals)
+            wasmmod.declare_functions(compiler.signatures)
+            func = convert_function(irfunc, wasmmod)
+            spooled[func.idx] = (spool.tell(), spool.write(encode_function_code(func)))
+            func.code = None
+        if compiler.errors:
+            raise SystemExit(1)
 
-    
+        with open('out.wasm', 'wb') as file:
+            file.write(encode_header(wasmmod))
+            count = encode_unsigned(len(wasmmod.functions))
+            size = len(count) + sum(length for offset, length in spooled.values())
+            file.write(b'\x0a' + encode_unsigned(size) + count)
+            for func in wasmmod.functions:
+                offset, length = spooled[func.idx]
+                spool.seek(offset)
+                file.write(spool.read(length))
+    print('Wrote out.wasm')
 
-                   
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:2] == ['-stream']:
+        main(sys.argv[2], stream=True)
+    elif sys.argv[1:2] == ['-time-passes']:
+        main(sys.argv[2], time_passes=True)
+    else:
+        main(sys.argv[1])